@@ -0,0 +1,192 @@
+"""
+In-memory registry of the tracked assets' divisibility, longnames and total supply, so that the (very frequent)
+lookups of these during message processing and in API calls don't need a tracked_assets query each time.
+
+The registry is loaded from tracked_assets at startup, written through as assets are created or changed,
+and restored (from tracked_assets) after a rollback. It also keeps a sorted index of the (uppercased) asset names
+and longnames for prefix searches, and a cached JSON listing of all asset names and longnames.
+"""
+import logging
+import bisect
+import json
+import hashlib
+
+from counterblock.lib import config, blockchain
+
+logger = logging.getLogger(__name__)
+
+assets = {}  # asset name -> AssetRecord
+longnames = {}  # asset longname -> asset name
+search_index = []  # sorted list of (uppercased asset name or longname, asset name) tuples
+version = 0  # incremented on every change to the registry
+listing = {'version': None, 'etag': None, 'entries': None, 'data': None}  # cached listing of all assets, for the version it was built at
+
+
+class AssetRecord(object):
+    __slots__ = ('asset', 'asset_longname', 'divisible', 'supply')
+
+    def __init__(self, asset, asset_longname, divisible, supply=None):
+        self.asset = asset
+        self.asset_longname = asset_longname
+        self.divisible = divisible
+        self.supply = supply  # total_issued (raw), or None for XCP and BTC
+
+    def __repr__(self):
+        return "AssetRecord(%r, %r, %r, %r)" % (self.asset, self.asset_longname, self.divisible, self.supply)
+
+
+def _make_record(tracked_asset):
+    return AssetRecord(tracked_asset['asset'], tracked_asset.get('asset_longname', None),
+                       tracked_asset.get('divisible', True), tracked_asset.get('total_issued', None))
+
+
+def _search_keys(record):
+    keys = [(record.asset.upper(), record.asset)]
+    if record.asset_longname:
+        keys.append((record.asset_longname.upper(), record.asset))
+    return keys
+
+
+def _add_to_search_index(record):
+    for key in _search_keys(record):
+        bisect.insort(search_index, key)
+
+
+def _remove_from_search_index(record):
+    for key in _search_keys(record):
+        i = bisect.bisect_left(search_index, key)
+        if i < len(search_index) and search_index[i] == key:
+            del search_index[i]
+
+
+def clear():
+    global version
+    assets.clear()
+    longnames.clear()
+    del search_index[:]
+    version += 1
+
+
+def load():
+    """Loads the registry from the tracked_assets collection"""
+    global version
+    clear()
+    for tracked_asset in config.mongo_db.tracked_assets.find(
+            {}, {'_id': 0, 'asset': 1, 'asset_longname': 1, 'divisible': 1, 'total_issued': 1}):
+        record = _make_record(tracked_asset)
+        assets[record.asset] = record
+        if record.asset_longname:
+            longnames[record.asset_longname] = record.asset
+        search_index.extend(_search_keys(record))
+    search_index.sort()  # sort once, instead of inserting each key in order
+    version += 1
+    logger.info("Loaded %i assets into the asset registry" % len(assets))
+
+
+def update(tracked_asset):
+    """Adds or updates the registry entry for the given tracked_assets document"""
+    global version
+    asset = tracked_asset['asset']
+    record = _make_record(tracked_asset)
+    prev_record = assets.get(asset, None)
+    if prev_record is not None:
+        if prev_record.asset_longname == record.asset_longname and prev_record.divisible == record.divisible:
+            prev_record.supply = record.supply  # (the supply isn't part of the search index and listing)
+            return prev_record
+        if prev_record.asset_longname and prev_record.asset_longname != record.asset_longname:
+            longnames.pop(prev_record.asset_longname, None)
+        _remove_from_search_index(prev_record)
+    assets[asset] = record
+    if record.asset_longname:
+        longnames[record.asset_longname] = asset
+    _add_to_search_index(record)
+    version += 1
+    return record
+
+
+def remove(asset):
+    global version
+    record = assets.pop(asset, None)
+    if record is None:
+        return
+    if record.asset_longname:
+        longnames.pop(record.asset_longname, None)
+    _remove_from_search_index(record)
+    version += 1
+
+
+def reload(asset_names):
+    """Re-syncs the registry entries for the given assets with tracked_assets (e.g. after those assets were rolled back)"""
+    asset_names = list(asset_names)
+    found = set()
+    for tracked_asset in config.mongo_db.tracked_assets.find(
+            {'asset': {'$in': asset_names}}, {'_id': 0, 'asset': 1, 'asset_longname': 1, 'divisible': 1, 'total_issued': 1}):
+        update(tracked_asset)
+        found.add(tracked_asset['asset'])
+    for asset in asset_names:
+        if asset not in found:
+            remove(asset)
+
+
+def get(asset):
+    """Returns the AssetRecord for the given asset name, or None if the asset is not tracked"""
+    return assets.get(asset, None)
+
+
+def get_by_longname(asset_longname):
+    asset = longnames.get(asset_longname, None)
+    return assets[asset] if asset is not None else None
+
+
+def resolve(asset_or_longname):
+    """Returns the AssetRecord for the given asset name or asset longname, or None if no such asset is tracked"""
+    return assets.get(asset_or_longname, None) or get_by_longname(asset_or_longname)
+
+
+def search(prefix, limit=20):
+    """Returns the AssetRecords of up to `limit` assets whose name or longname starts with the given prefix
+    (case insensitive), ordered by the matching name"""
+    prefix = prefix.upper()
+    results = []
+    seen = set()
+    for i in range(bisect.bisect_left(search_index, (prefix,)), len(search_index)):
+        key, asset = search_index[i]
+        if not key.startswith(prefix) or len(results) >= limit:
+            break
+        if asset not in seen:
+            seen.add(asset)
+            results.append(assets[asset])
+    return results
+
+
+def get_listing():
+    """Returns the listing of all asset names and longnames, as a dict with `entries` (a list of dicts), `data` (that
+    list, JSON encoded) and `etag` fields. The listing is only rebuilt after the registry has changed, and its etag is
+    derived from its contents"""
+    if listing['version'] != version:
+        listing['entries'] = [{'asset': e.asset, 'asset_longname': e.asset_longname} for e in assets.values()]
+        listing['data'] = json.dumps(listing['entries'])
+        listing['etag'] = hashlib.sha1(listing['data'].encode('utf-8')).hexdigest()
+        listing['version'] = version
+    return listing
+
+
+def get_longname(asset, default=None):
+    record = assets.get(asset, None)
+    return record.asset_longname if record is not None else default
+
+
+def is_divisible(asset, default=None):
+    record = assets.get(asset, None)
+    return record.divisible if record is not None else default
+
+
+def get_supply(asset, default=None):
+    """Returns the total (raw) supply of the given asset. (The XCP supply comes from counterparty-server, and is
+    cached per block)"""
+    if asset == config.XCP:
+        return blockchain.get_xcp_supply(normalize=False)
+    elif asset == config.BTC:
+        return 0
+    record = assets.get(asset, None)
+    return record.supply if record is not None and record.supply is not None else default
@@ -15,6 +15,7 @@ from counterblock.lib import config, util
 D = decimal.Decimal
 decimal.getcontext().prec = 8
 logger = logging.getLogger(__name__)
+xcp_supply_cache = {'block_index': None, 'supply': None}
 
 
 def round_out(num):
@@ -56,6 +57,17 @@ def get_btc_supply(normalize=False, at_block_index=None):
     return total_supply if normalize else int(total_supply * config.UNIT)
 
 
+def get_xcp_supply(normalize=False):
+    """returns the total supply of XCP (as reported by counterparty-server). This is only fetched once per block
+    processed by counterblock"""
+    block_index = config.state['my_latest_block']['block_index']
+    if xcp_supply_cache['block_index'] != block_index or xcp_supply_cache['supply'] is None:
+        xcp_supply_cache['supply'] = util.call_jsonrpc_api(
+            "get_supply", {'asset': config.XCP}, abort_on_error=True, use_cache=False)['result']
+        xcp_supply_cache['block_index'] = block_index
+    return normalize_quantity(xcp_supply_cache['supply']) if normalize else xcp_supply_cache['supply']
+
+
 def pubkey_to_address(pubkey_hex):
     sec = binascii.unhexlify(pubkey_hex)
     compressed = encoding.is_sec_compressed(sec)
@@ -149,6 +149,7 @@ def process_cp_blockfeed():
             'block_hash': config.state['cur_block']['block_hash'],
         }
         config.mongo_db.processed_blocks.insert(new_block)
+        database.track_block_time(new_block['block_index'], new_block['block_time'])
 
         config.state['my_latest_block'] = new_block
 
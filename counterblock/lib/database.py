@@ -1,5 +1,8 @@
 import os
 import logging
+import array
+import bisect
+import calendar
 import pymongo
 
 from counterblock.lib import config, cache, util
@@ -7,6 +10,16 @@ from counterblock.lib.processor import RollbackProcessor
 
 logger = logging.getLogger(__name__)
 
+# in-memory index of processed block times, for resolving dates to block ranges without hitting mongo.
+# both arrays are kept sorted by block time (a block's time is not guaranteed to be greater than its parent's)
+block_times = array.array('q')  # block times, as epoch seconds
+block_time_indexes = array.array('q')  # the block index for each corresponding entry in block_times
+
+# declarative index registry. core code and plugin modules declare the indexes (and representative query shapes)
+# they rely on at import time; indexes are then built by build_indexes() and checked by audit_indexes()
+index_registry = []  # list of (collection name, index keys, index options) tuples
+query_shape_registry = []  # list of (collection name, sample query, sort) tuples
+
 
 def get_connection():
     """Connect to mongodb, returning a connection object"""
@@ -19,14 +32,126 @@ def get_connection():
     return mongo_db
 
 
-def init_base_indexes():
-    """insert mongo indexes if need-be (i.e. for newly created database)"""
-    # COLLECTIONS THAT ARE PURGED AS A RESULT OF A REPARSE
-    # processed_blocks
-    config.mongo_db.processed_blocks.ensure_index('block_index', unique=True)
-    # COLLECTIONS THAT ARE *NOT* PURGED AS A RESULT OF A REPARSE
-    # mempool
-    config.mongo_db.mempool.ensure_index('tx_hash')
+def _normalize_index_keys(keys):
+    if isinstance(keys, str):
+        keys = [(keys, pymongo.ASCENDING)]
+    return [(k, int(v) if isinstance(v, (int, float)) else v) for k, v in keys]
+
+
+def register_index(collection, keys, **kwargs):
+    """Declare an index that should exist on the specified collection. Takes the same keys and options
+    as pymongo's create_index. The index is created (if missing) by build_indexes()"""
+    entry = (collection, _normalize_index_keys(keys), kwargs)
+    if entry not in index_registry:
+        index_registry.append(entry)
+
+
+def register_query_shape(collection, query, sort=None):
+    """Declare a representative query (with sample values) made against the specified collection, so that
+    audit_indexes() can flag it if mongo ends up serving it with a collection scan"""
+    query_shape_registry.append((collection, query, sort))
+
+
+def build_indexes(background=True, unique=None):
+    """insert any registered mongo indexes that don't exist yet (i.e. for a newly created or purged collection). If
+    `unique` is given, only the unique (or only the non unique) indexes are built"""
+    existing = {}
+    num_built = 0
+    for collection, keys, kwargs in index_registry:
+        if unique is not None and bool(kwargs.get('unique', False)) != unique:
+            continue
+        if collection not in existing:
+            existing[collection] = [
+                _normalize_index_keys(i['key']) for i in config.mongo_db[collection].index_information().values()]
+        if keys in existing[collection]:
+            continue
+        logger.info("Building index on %s: %s ..." % (collection, keys))
+        config.mongo_db[collection].create_index(keys, background=background, **kwargs)
+        existing[collection].append(keys)
+        num_built += 1
+    logger.info("Index build complete (%i of %i registered indexes built)" % (num_built, len(index_registry)))
+
+
+def _plan_has_stage(plan, stage):
+    if plan.get('stage') == stage:
+        return True
+    children = plan.get('inputStages', []) + ([plan['inputStage']] if 'inputStage' in plan else [])
+    return any(_plan_has_stage(c, stage) for c in children)
+
+
+def audit_indexes():
+    """Logs indexes that haven't been used since mongod was started (via $indexStats), indexes that exist but
+    are not registered, and registered query shapes that mongo serves with a collection scan (COLLSCAN)"""
+    for collection in sorted(set(e[0] for e in index_registry)):
+        registered = [keys for c, keys, kwargs in index_registry if c == collection]
+        for name, info in config.mongo_db[collection].index_information().items():
+            if name != '_id_' and _normalize_index_keys(info['key']) not in registered:
+                logger.warn("Index audit: index %s on %s is not registered (stale index?)" % (name, collection))
+        try:
+            stats = list(config.mongo_db[collection].aggregate([{"$indexStats": {}}]))
+        except pymongo.errors.OperationFailure as e:  # $indexStats requires mongodb 3.2+
+            logger.debug("Index audit: cannot get index stats for %s: %s" % (collection, e))
+            continue
+        for stat in stats:
+            if stat['name'] != '_id_' and not stat['accesses']['ops']:
+                logger.warn("Index audit: index %s on %s has not been used since %s" % (
+                    stat['name'], collection, stat['accesses']['since']))
+
+    for collection, query, sort in query_shape_registry:
+        cursor = config.mongo_db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        if _plan_has_stage(plan, 'COLLSCAN'):
+            logger.warn("Index audit: query on %s is served by a collection scan: %s (sort: %s)" % (collection, query, sort))
+
+
+# COLLECTIONS THAT ARE PURGED AS A RESULT OF A REPARSE
+# processed_blocks
+register_index('processed_blocks', 'block_index', unique=True)
+register_index('processed_blocks', 'block_time')
+# COLLECTIONS THAT ARE *NOT* PURGED AS A RESULT OF A REPARSE
+# mempool
+register_index('mempool', 'tx_hash')
+register_index('mempool', 'viewed_in_block')
+
+
+def _to_timestamp(dt):
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1000000.0
+
+
+def init_block_times():
+    """(Re)load the in-memory block time index from the processed_blocks collection"""
+    blocks = config.mongo_db.processed_blocks.find(
+        {}, {'_id': 0, 'block_index': 1, 'block_time': 1}).sort("block_index", pymongo.ASCENDING)
+    entries = sorted((calendar.timegm(b['block_time'].utctimetuple()), b['block_index']) for b in blocks)
+    del block_times[:]
+    del block_time_indexes[:]
+    block_times.extend(e[0] for e in entries)
+    block_time_indexes.extend(e[1] for e in entries)
+    logger.info("Loaded block times for %i processed blocks" % len(block_times))
+
+
+def track_block_time(block_index, block_time):
+    """Add a newly processed block to the in-memory block time index"""
+    ts = calendar.timegm(block_time.utctimetuple())
+    i = bisect.bisect_right(block_times, ts)  # normally the end of the array
+    block_times.insert(i, ts)
+    block_time_indexes.insert(i, block_index)
+
+
+def prune_block_times(max_block_index=None):
+    """Remove all blocks above max_block_index from the in-memory block time index (or all blocks, if not specified)"""
+    if max_block_index is None:
+        del block_times[:]
+        del block_time_indexes[:]
+        return
+    keep = [i for i in range(len(block_time_indexes)) if block_time_indexes[i] <= max_block_index]
+    if len(keep) == len(block_time_indexes):
+        return
+    times, indexes = array.array('q', (block_times[i] for i in keep)), array.array('q', (block_time_indexes[i] for i in keep))
+    block_times[:] = times
+    block_time_indexes[:] = indexes
 
 
 def get_block_indexes_for_dates(start_dt=None, end_dt=None):
@@ -35,17 +160,19 @@ def get_block_indexes_for_dates(start_dt=None, end_dt=None):
     if start_dt is None:
         start_block_index = config.BLOCK_FIRST
     else:
-        start_block = config.mongo_db.processed_blocks.find_one({"block_time": {"$lte": start_dt}}, sort=[("block_time", pymongo.DESCENDING)])
-        start_block_index = config.BLOCK_FIRST if not start_block else start_block['block_index']
+        # last block with a block_time <= start_dt
+        i = bisect.bisect_right(block_times, _to_timestamp(start_dt))
+        start_block_index = config.BLOCK_FIRST if i == 0 else block_time_indexes[i - 1]
 
     if end_dt is None:
         end_block_index = config.state['my_latest_block']['block_index']
     else:
-        end_block = config.mongo_db.processed_blocks.find_one({"block_time": {"$gte": end_dt}}, sort=[("block_time", pymongo.ASCENDING)])
-        if not end_block:
-            end_block_index = config.mongo_db.processed_blocks.find_one(sort=[("block_index", pymongo.DESCENDING)])['block_index']
+        # first block with a block_time >= end_dt
+        i = bisect.bisect_left(block_times, _to_timestamp(end_dt))
+        if i == len(block_times):
+            end_block_index = config.state['my_latest_block']['block_index']
         else:
-            end_block_index = end_block['block_index']
+            end_block_index = block_time_indexes[i]
     return (start_block_index, end_block_index)
 
 
@@ -60,6 +187,7 @@ def get_block_time(block_index):
 def reset_db_state():
     """boom! blow away all applicable collections in mongo"""
     config.mongo_db.processed_blocks.drop()
+    prune_block_times()
 
     # create/update default app_config object
     config.mongo_db.app_config.update({}, {
@@ -81,6 +209,9 @@ def reset_db_state():
     # call any rollback processors for any extension modules
     RollbackProcessor.run_active_functions(None)
 
+    # dropped collections lose their indexes, so recreate them
+    build_indexes(background=False)
+
     return app_config
 
 
@@ -95,6 +226,27 @@ def init_reparse(quit_after=False):
     return app_config
 
 
+def rollback_versioned_collection(collection, versions_collection, key, max_block_index, is_live=None):
+    """Rolls back a collection that holds the current state of a set of entities (each identified by its `key` field),
+    where every state change of an entity is also recorded as a version document (with an `_at_block` field) in
+    versions_collection. Any entity changed after max_block_index is restored to its latest remaining version, or
+    removed if there is no such version (or if `is_live` is given, and returns False for that version).
+
+    Returns the list of keys for the entities that were rolled back"""
+    keys = versions_collection.find({'_at_block': {"$gt": max_block_index}}).distinct(key)
+    versions_collection.remove({'_at_block': {"$gt": max_block_index}})
+    for k in keys:
+        prev_ver = versions_collection.find_one(
+            {key: k}, {'_id': 0}, sort=[("_at_block", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+        if not prev_ver or (is_live and not is_live(prev_ver)):
+            logger.info("Pruning %s %s (no state available that is <= block %i)" % (key, k, max_block_index))
+            collection.remove({key: k})
+        else:
+            logger.info("Pruning %s %s (to state at block %i)" % (key, k, prev_ver['_at_block']))
+            collection.replace_one({key: k}, prev_ver, upsert=True)
+    return keys
+
+
 def rollback(max_block_index):
     """called if there are any records for blocks higher than this in the database? If so, they were impartially created
        and we should get rid of them
@@ -108,6 +260,7 @@ def rollback(max_block_index):
 
     logger.warn("Pruning to block %i ..." % (max_block_index))
     config.mongo_db.processed_blocks.remove({"block_index": {"$gt": max_block_index}})
+    prune_block_times(max_block_index)
 
     config.state['last_message_index'] = -1
     config.state['caught_up'] = False
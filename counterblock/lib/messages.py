@@ -3,7 +3,7 @@ import copy
 import logging
 import pymongo
 
-from counterblock.lib import config, blockchain, database
+from counterblock.lib import config, asset_registry, blockchain, database
 
 logger = logging.getLogger(__name__)
 
@@ -25,9 +25,9 @@ def decorate_message(message, for_txn_history=False):
     for attr in ('asset', 'get_asset', 'give_asset', 'forward_asset', 'backward_asset', 'dividend_asset'):
         if attr not in message:
             continue
-        asset_info = config.mongo_db.tracked_assets.find_one({'asset': message[attr]})
-        message['_{}_longname'.format(attr)] = asset_info['asset_longname'] if asset_info else None
-        message['_{}_divisible'.format(attr)] = asset_info['divisible'] if asset_info else None
+        asset_info = asset_registry.get(message[attr])
+        message['_{}_longname'.format(attr)] = asset_info.asset_longname if asset_info else None
+        message['_{}_divisible'.format(attr)] = asset_info.divisible if asset_info else None
 
     if message['_category'] in ['credits', 'debits']:
         # find the last balance change on record
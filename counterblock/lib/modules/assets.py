@@ -14,21 +14,58 @@ import urllib.parse
 import urllib.error
 import json
 import base64
+import copy
 import pymongo
 import configparser
 import calendar
+import collections
 
 import dateutil.parser
+import gevent.pool
 
-from counterblock.lib import config, util, blockfeed, blockchain
-from counterblock.lib.modules import ASSETS_PRIORITY_PARSE_ISSUANCE, ASSETS_PRIORITY_PARSE_DESTRUCTION, ASSETS_PRIORITY_BALANCE_CHANGE
+from counterblock.lib import config, util, asset_registry, blockfeed, blockchain, database
+from counterblock.lib.modules import ASSETS_PRIORITY_PARSE_ISSUANCE, ASSETS_PRIORITY_PARSE_DESTRUCTION, ASSETS_PRIORITY_BALANCE_CHANGE, ASSETS_PRIORITY_ESCROW
 from counterblock.lib.processor import MessageProcessor, MempoolMessageProcessor, BlockProcessor, StartUpProcessor, CaughtUpProcessor, RollbackProcessor, API, start_task
 
 ASSET_MAX_RETRY = 3
+ASSET_INFO_FETCH_POOL_SIZE = 20  # max number of asset info URLs fetched concurrently (across all hosts)
+BALANCE_CACHE_MAX_ENTRIES = 250000  # max number of (address, asset) pairs to keep the last balance change for in memory
 
 D = decimal.Decimal
 logger = logging.getLogger(__name__)
 
+asset_info_fetches_in_progress = set()  # assets whose extended info is currently being fetched
+new_asset_info_queue = []  # assets queued for an extended info fetch in the current block
+
+# last balance_changes record per (address, asset), most recently used last. if balance_cache_complete is True, the
+# cache holds every (address, asset) pair on record (i.e. a cache miss means there is no balance change for that pair yet)
+balance_cache = collections.OrderedDict()
+balance_cache_complete = False
+
+
+def get_last_balance_change(address, asset):
+    key = (address, asset)
+    try:
+        balance_cache.move_to_end(key)
+        return balance_cache[key]
+    except KeyError:
+        pass
+    if balance_cache_complete:
+        return None
+    return config.mongo_db.balance_changes.find_one({
+        'address': address,
+        'asset': asset
+    }, sort=[("block_index", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+
+
+def cache_last_balance_change(bal_change):
+    global balance_cache_complete
+    balance_cache[(bal_change['address'], bal_change['asset'])] = bal_change
+    balance_cache.move_to_end((bal_change['address'], bal_change['asset']))
+    while len(balance_cache) > BALANCE_CACHE_MAX_ENTRIES:
+        balance_cache.popitem(last=False)
+        balance_cache_complete = False
+
 
 def inc_fetch_retry(asset, max_retry=ASSET_MAX_RETRY, new_status='error', errors=[]):
     asset['fetch_info_retry'] += 1
@@ -78,63 +115,106 @@ def process_asset_info(asset, info_data):
     return (True, None)
 
 
-def task_compile_extended_asset_info():
-    assets = list(config.mongo_db.asset_extended_info.find({'info_status': 'needfetch'}))
-    asset_info_urls = []
-
-    def asset_fetch_complete_hook(urls_data):
-        logger.info("Enhanced asset info fetching complete. %s unique URLs fetched. Processing..." % len(urls_data))
-        for asset in assets:
-            logger.debug("Looking at asset %s: %s" % (asset, asset['info_url']))
-            if asset['info_url']:
-                info_url = ('http://' + asset['info_url']) \
-                    if not asset['info_url'].startswith('http://') and not asset['info_url'].startswith('https://') else asset['info_url']
-                assert info_url in urls_data
-                if not urls_data[info_url][0]:  # request was not successful
-                    inc_fetch_retry(asset, max_retry=ASSET_MAX_RETRY, errors=[urls_data[info_url][1]])
-                    logger.warn("Fetch for asset at %s not successful: %s (try %i of %i)" % (
-                        info_url, urls_data[info_url][1], asset['fetch_info_retry'], ASSET_MAX_RETRY))
-                else:
-                    result = process_asset_info(asset, urls_data[info_url][1])
-                    if not result[0]:
-                        logger.info("Processing for asset %s at %s not successful: %s" % (asset['asset'], info_url, result[1]))
-                    else:
-                        logger.debug("Processing for asset %s at %s successful" % (asset['asset'], info_url))
-
-    # compose and fetch all info URLs in all assets with them
+def fetch_asset_info(asset):
+    """Fetches and processes the extended info for the given asset_extended_info record. Uses a conditional GET based
+    off of the last fetch of the asset's info URL, and skips re-processing if the info content is unchanged"""
+    # may or may not end with .json. may or may not start with http:// or https://
+    info_url = ('http://' + asset['info_url']) \
+        if not asset['info_url'].startswith('http://') and not asset['info_url'].startswith('https://') else asset['info_url']
+    last_fetch = config.mongo_db.asset_extended_info_fetches.find_one({'info_url': info_url}) or {}
+
+    fetch = util.fetch_conditional(
+        info_url, etag=last_fetch.get('etag', None), last_modified=last_fetch.get('last_modified', None),
+        fetch_timeout=10, max_fetch_size=4 * 1024)
+    logger.debug("Asset info URL %s retrieved, result: %s" % (info_url, fetch))
+    if not fetch['success']:
+        inc_fetch_retry(asset, max_retry=ASSET_MAX_RETRY, errors=[fetch['data']])
+        logger.warn("Fetch for asset at %s not successful: %s (try %i of %i)" % (
+            info_url, fetch['data'], asset['fetch_info_retry'], ASSET_MAX_RETRY))
+        return
+
+    if fetch['not_modified']:
+        info_data, content_hash = last_fetch['data'], last_fetch['content_hash']
+    else:
+        info_data, content_hash = fetch['data'], fetch['content_hash']
+        config.mongo_db.asset_extended_info_fetches.update(
+            {'info_url': info_url},
+            {'$set': {
+                'etag': fetch['etag'],
+                'last_modified': fetch['last_modified'],
+                'content_hash': content_hash,
+                'data': info_data,
+                'fetched_at': datetime.datetime.utcnow(),
+            }}, upsert=True)
+
+    if asset.get('info_hash', None) == content_hash and asset.get('info_data', None):
+        # content has not changed since it was last successfully processed for this asset
+        asset['info_status'] = 'valid'
+        config.mongo_db.asset_extended_info.save(asset)
+        logger.debug("Asset info for asset %s at %s unchanged" % (asset['asset'], info_url))
+        return
+
+    result = process_asset_info(asset, copy.deepcopy(info_data))
+    if not result[0]:
+        logger.info("Processing for asset %s at %s not successful: %s" % (asset['asset'], info_url, result[1]))
+    else:
+        config.mongo_db.asset_extended_info.update({'_id': asset['_id']}, {'$set': {'info_hash': content_hash}})
+        logger.debug("Processing for asset %s at %s successful" % (asset['asset'], info_url))
+
+
+def fetch_extended_asset_info(assets):
+    pool = gevent.pool.Pool(ASSET_INFO_FETCH_POOL_SIZE)
+
+    def fetch(asset):
+        try:
+            fetch_asset_info(asset)
+        finally:
+            asset_info_fetches_in_progress.discard(asset['asset'])
+
     for asset in assets:
-        if not asset['info_url']:
+        if not asset['info_url'] or asset['asset'] in asset_info_fetches_in_progress:
             continue
 
         if asset.get('disabled', False):
             logger.info("ExtendedAssetInfo: Skipping disabled asset %s" % asset['asset'])
             continue
 
-        # may or may not end with .json. may or may not start with http:// or https://
-        asset_info_urls.append((
-            ('http://' + asset['info_url'])
-            if not asset['info_url'].startswith('http://') and not asset['info_url'].startswith('https://')
-            else asset['info_url']))
-
-    asset_info_urls_str = ', '.join(asset_info_urls)
-    asset_info_urls_str = (
-        (asset_info_urls_str[:2000] + ' ...')
-        if len(asset_info_urls_str) > 2000
-        else asset_info_urls_str)  # truncate if necessary
-    if len(asset_info_urls):
-        logger.info('Fetching enhanced asset info for %i assets: %s' % (len(asset_info_urls), asset_info_urls_str))
-        util.stream_fetch(
-            asset_info_urls, asset_fetch_complete_hook,
-            fetch_timeout=10, max_fetch_size=4 * 1024, urls_group_size=20, urls_group_time_spacing=20,
-            per_request_complete_callback=lambda url, data: logger.debug("Asset info URL %s retrieved, result: %s" % (url, data)))
+        asset_info_fetches_in_progress.add(asset['asset'])
+        pool.spawn(fetch, asset)
+    pool.join()
+
+
+def task_compile_extended_asset_info():
+    # fetch assets that have not failed before first, and most recently queued (i.e. newly issued) assets first within that
+    assets = list(config.mongo_db.asset_extended_info.find({'info_status': 'needfetch'}).sort(
+        [("fetch_info_retry", pymongo.ASCENDING), ("info_queued_block", pymongo.DESCENDING)]))
+    if len(assets):
+        logger.info('Fetching enhanced asset info for %i assets...' % len(assets))
+        fetch_extended_asset_info(assets)
+        logger.info("Enhanced asset info fetching complete.")
 
     start_task(task_compile_extended_asset_info, delay=60 * 60)  # call again in 60 minutes
 
 
+@BlockProcessor.subscribe()
+def fetch_new_asset_info():
+    # once caught up, fetch the extended info of assets queued in this block right away, instead of waiting for
+    # the next run of task_compile_extended_asset_info
+    if not new_asset_info_queue:
+        return
+    queued_assets = list(new_asset_info_queue)
+    del new_asset_info_queue[:]
+    if not config.state['caught_up']:
+        return
+    assets = list(config.mongo_db.asset_extended_info.find({'asset': {'$in': queued_assets}, 'info_status': 'needfetch'}))
+    start_task(lambda: fetch_extended_asset_info(assets))
+
+
 @API.add_method
 def get_normalized_balances(addresses):
     """
-    This call augments counterparty's get_balances with a normalized_quantity field. It also will include any owned
+    This call returns counterparty's get_balances (out of the current_balances collection, maintained off of the
+    credit/debit stream), augmented with a normalized_quantity field. It also will include any owned
     assets for an address, even if their balance is zero.
     NOTE: Does not retrieve BTC balance. Use get_address_info for that.
     """
@@ -143,18 +223,13 @@ def get_normalized_balances(addresses):
     if not len(addresses):
         raise Exception("Invalid address list supplied")
 
-    filters = []
-    for address in addresses:
-        filters.append({'field': 'address', 'op': '==', 'value': address})
-
     mappings = {}
-    result = util.call_jsonrpc_api(
-        "get_balances",
-        {'filters': filters, 'filterop': 'or'}, abort_on_error=True)['result']
+    result = config.mongo_db.current_balances.find(
+        {'address': {'$in': addresses}}, {'_id': 0, 'address': 1, 'asset': 1, 'quantity': 1})
 
     isowner = {}
     owned_assets = config.mongo_db.tracked_assets.find(
-        {'$or': [{'owner': a} for a in addresses]}, {'_history': 0, '_id': 0})
+        {'$or': [{'owner': a} for a in addresses]}, {'_id': 0})
     for o in owned_assets:
         isowner[o['owner'] + o['asset']] = o
 
@@ -162,17 +237,11 @@ def get_normalized_balances(addresses):
     for d in result:
         if not d['quantity'] and ((d['address'] + d['asset']) not in isowner):
             continue  # don't include balances with a zero asset value
-        asset_info = config.mongo_db.tracked_assets.find_one({'asset': d['asset']})
-        divisible = True  # XCP and BTC
-        if asset_info and 'divisible' in asset_info:
-            divisible = asset_info['divisible']
+        asset_info = asset_registry.get(d['asset'])
+        divisible = asset_info.divisible if asset_info else True  # XCP and BTC
         d['normalized_quantity'] = blockchain.normalize_quantity(d['quantity'], divisible)
         d['owner'] = (d['address'] + d['asset']) in isowner
-
-        try:
-            d['asset_longname'] = asset_info['asset_longname']
-        except TypeError as e:
-            d['asset_longname'] = d['asset']
+        d['asset_longname'] = asset_info.asset_longname if asset_info else d['asset']
 
         mappings[d['address'] + d['asset']] = d
         data.append(d)
@@ -194,68 +263,68 @@ def get_normalized_balances(addresses):
 
 @API.add_method
 def get_escrowed_balances(addresses):
-    addresses_holder = ','.join(['?' for e in range(0, len(addresses))])
-
-    sql = '''SELECT (source || '_' || give_asset) AS source_asset, source AS address, give_asset AS asset, SUM(give_remaining) AS quantity
-            FROM orders
-            WHERE source IN ({}) AND status = ? AND give_asset != ?
-            GROUP BY source_asset'''.format(addresses_holder)
-    bindings = addresses + ['open', config.BTC]
-    results = util.call_jsonrpc_api("sql", {'query': sql, 'bindings': bindings}, abort_on_error=True)['result']
-
-    sql = '''SELECT (tx0_address || '_' || forward_asset) AS source_asset, tx0_address AS address, forward_asset AS asset, SUM(forward_quantity) AS quantity
-             FROM order_matches
-             WHERE tx0_address IN ({}) AND forward_asset != ? AND status = ?
-             GROUP BY source_asset'''.format(addresses_holder)
-    bindings = addresses + [config.BTC, 'pending']
-    results += util.call_jsonrpc_api("sql", {'query': sql, 'bindings': bindings}, abort_on_error=True)['result']
-
-    sql = '''SELECT (tx1_address || '_' || backward_asset) AS source_asset, tx1_address AS address, backward_asset AS asset, SUM(backward_quantity) AS quantity
-             FROM order_matches
-             WHERE tx1_address IN ({}) AND backward_asset != ? AND status = ?
-             GROUP BY source_asset'''.format(addresses_holder)
-    bindings = addresses + [config.BTC, 'pending']
-    results += util.call_jsonrpc_api("sql", {'query': sql, 'bindings': bindings}, abort_on_error=True)['result']
-
-    sql = '''SELECT source AS address, '{}' AS asset, SUM(wager_remaining) AS quantity
-             FROM bets
-             WHERE source IN ({}) AND status = ?
-             GROUP BY address'''.format(config.XCP, addresses_holder)
-    bindings = addresses + ['open']
-    results += util.call_jsonrpc_api("sql", {'query': sql, 'bindings': bindings}, abort_on_error=True)['result']
-
-    sql = '''SELECT tx0_address AS address, '{}' AS asset, SUM(forward_quantity) AS quantity
-             FROM bet_matches
-             WHERE tx0_address IN ({}) AND status = ?
-             GROUP BY address'''.format(config.XCP, addresses_holder)
-    bindings = addresses + ['pending']
-    results += util.call_jsonrpc_api("sql", {'query': sql, 'bindings': bindings}, abort_on_error=True)['result']
-
-    sql = '''SELECT tx1_address AS address, '{}' AS asset, SUM(backward_quantity) AS quantity
-             FROM bet_matches
-             WHERE tx1_address IN ({}) AND status = ?
-             GROUP BY address'''.format(config.XCP, addresses_holder)
-    bindings = addresses + ['pending']
-    results += util.call_jsonrpc_api("sql", {'query': sql, 'bindings': bindings}, abort_on_error=True)['result']
-
     escrowed_balances = {}
-    for order in results:
-        if order['address'] not in escrowed_balances:
-            escrowed_balances[order['address']] = {}
-        if order['asset'] not in escrowed_balances[order['address']]:
-            escrowed_balances[order['address']][order['asset']] = 0
-        escrowed_balances[order['address']][order['asset']] += order['quantity']
+    for escrow in config.mongo_db.escrows.find({'address': {'$in': addresses}}, {'_id': 0, 'address': 1, 'asset': 1, 'quantity': 1}):
+        if escrow['address'] not in escrowed_balances:
+            escrowed_balances[escrow['address']] = {}
+        if escrow['asset'] not in escrowed_balances[escrow['address']]:
+            escrowed_balances[escrow['address']][escrow['asset']] = 0
+        escrowed_balances[escrow['address']][escrow['asset']] += escrow['quantity']
 
     return escrowed_balances
 
 
+@API.add_method
+def get_asset_holder_counts(assets):
+    """Returns the number of addresses holding a (non-zero) balance of each of the given assets"""
+    if not isinstance(assets, list):
+        raise Exception("assets must be a list of asset names, even if it just contains one entry")
+    holder_counts = dict((asset, 0) for asset in assets)
+    for e in config.mongo_db.asset_holders.find({'asset': {'$in': assets}}, {'_id': 0}):
+        holder_counts[e['asset']] = e['holder_count']
+    return holder_counts
+
+
+@API.add_method
+def get_asset_top_holders(asset, limit=10):
+    """Returns the holder count of an asset, along with its largest holders (and their share of the asset's supply)"""
+    if not isinstance(limit, int) or limit <= 0 or limit > 100:
+        raise Exception("Invalid limit")
+    asset_info = asset_registry.get(asset)
+    if not asset_info:
+        raise Exception("Asset does not exist.")
+
+    supply = asset_registry.get_supply(asset)
+    holder_count = config.mongo_db.asset_holders.find_one({'asset': asset}, {'holder_count': 1})
+
+    top_holders = []
+    for e in config.mongo_db.current_balances.find(
+            {'asset': asset, 'quantity': {"$gt": 0}}, {'_id': 0, 'address': 1, 'quantity': 1}).sort("quantity", pymongo.DESCENDING).limit(limit):
+        top_holders.append({
+            'address': e['address'],
+            'quantity': e['quantity'],
+            'normalized_quantity': blockchain.normalize_quantity(e['quantity'], asset_info.divisible),
+            'pct_of_supply': float(D(e['quantity']) / D(supply) * 100) if supply else None,
+        })
+    return {
+        'asset': asset,
+        'holder_count': holder_count['holder_count'] if holder_count else 0,
+        'top_holders': top_holders,
+    }
+
+
 @API.add_method
 def get_assets_names_and_longnames():
-    ret = []
-    assets = config.mongo_db.tracked_assets.find({}, {'_id': 0, '_history': 0})
-    for e in assets:
-        ret.append({'asset': e['asset'], 'asset_longname': e['asset_longname']})
-    return ret
+    # NOTE: this listing is also served (with an ETag) as a plain HTTP GET to /api/assets/names
+    return asset_registry.get_listing()['entries']
+
+
+@API.add_method
+def search_assets(prefix, limit=20):
+    """Returns the assets whose asset name or longname starts with the given prefix (case insensitive)"""
+    if not isinstance(limit, int) or limit <= 0 or limit > 1000:
+        raise Exception("Invalid limit")
+    return [{'asset': e.asset, 'asset_longname': e.asset_longname} for e in asset_registry.search(prefix, limit=limit)]
 
 
 @API.add_method
@@ -263,6 +332,12 @@ def get_assets_info(assetsList):
     assets = assetsList  # TODO: change the parameter name at some point in the future...shouldn't be using camel case here
     if not isinstance(assets, list):
         raise Exception("assets must be a list of asset names, even if it just contains one entry")
+    # look up all of the user-created assets (by name or longname) in one go
+    asset_records = dict((asset, asset_registry.resolve(asset)) for asset in assets if asset not in [config.BTC, config.XCP])
+    tracked_assets = config.mongo_db.tracked_assets.find(
+        {'asset': {'$in': list(set(r.asset for r in asset_records.values() if r))}}, {'_id': 0})
+    tracked_assets = dict((e['asset'], e) for e in tracked_assets)
+
     assets_info = []
     for asset in assets:
         # BTC and XCP.
@@ -270,7 +345,7 @@ def get_assets_info(assetsList):
             if asset == config.BTC:
                 supply = blockchain.get_btc_supply(normalize=False)
             else:
-                supply = util.call_jsonrpc_api("get_supply", {'asset': config.XCP}, abort_on_error=True)['result']
+                supply = blockchain.get_xcp_supply(normalize=False)
 
             assets_info.append({
                 'asset': asset,
@@ -285,9 +360,10 @@ def get_assets_info(assetsList):
             continue
 
         # User-created asset.
-        tracked_asset = config.mongo_db.tracked_assets.find_one({'$or': [{'asset': asset}, {'asset_longname': asset}]}, {'_id': 0, '_history': 0})
-        if not tracked_asset:
+        asset_info = asset_records[asset]
+        if not asset_info or asset_info.asset not in tracked_assets:
             continue  # asset not found, most likely
+        tracked_asset = tracked_assets[asset_info.asset]
         assets_info.append({
             'asset': tracked_asset['asset'],
             'asset_longname': tracked_asset['asset_longname'],
@@ -306,11 +382,9 @@ def get_base_quote_asset(asset1, asset2):
     """
     # DEPRECATED 1.5
     base_asset, quote_asset = util.assets_to_asset_pair(asset1, asset2)
-    base_asset_info = config.mongo_db.tracked_assets.find_one({'asset': base_asset})
-    quote_asset_info = config.mongo_db.tracked_assets.find_one({'asset': quote_asset})
     pair_name = "%s/%s" % (base_asset, quote_asset)
 
-    if not base_asset_info or not quote_asset_info:
+    if not asset_registry.get(base_asset) or not asset_registry.get(quote_asset):
         raise Exception("Invalid asset(s)")
 
     return {
@@ -382,13 +456,13 @@ def get_asset_history(asset, reverse=False):
     * IF type = 'called_back':
       * 'percentage': The percentage of the asset called back (between 0 and 100)
     """
-    asset = config.mongo_db.tracked_assets.find_one({'asset': asset}, {"_id": 0})
-    if not asset:
+    if not asset_registry.get(asset):
         raise Exception("Unrecognized asset")
 
-    # run down through _history and compose a diff log
+    # run down through the asset's versions and compose a diff log
     history = []
-    raw = asset['_history'] + [asset, ]  # oldest to newest. add on the current state
+    raw = list(config.mongo_db.tracked_asset_versions.find({'asset': asset}, {"_id": 0}).sort(
+        [("_at_block", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]))  # oldest to newest, including the current state
     prev = None
     for i in range(len(raw)):  # oldest to newest
         if i == 0:
@@ -450,17 +524,19 @@ def get_asset_history(asset, reverse=False):
 
 
 @API.add_method
-def get_balance_history(asset, addresses, normalize=True, start_ts=None, end_ts=None):
+def get_balance_history(asset, addresses, normalize=True, start_ts=None, end_ts=None, max_points=None):
     """Retrieves the ordered balance history for a given address (or list of addresses) and asset pair, within the specified date range
     @param normalize: If set to True, return quantities that (if the asset is divisible) have been divided by 100M (satoshi).
+    @param max_points: If specified, downsample each address' series to at most this many points (min 3)
     @return: A list of tuples, with the first entry of each tuple being the block time (epoch TS), and the second being the new balance
      at that block time.
     """
     if not isinstance(addresses, list):
         raise Exception("addresses must be a list of addresses, even if it just contains one address")
+    if max_points is not None and (not isinstance(max_points, int) or max_points < 3):
+        raise Exception("max_points must be an integer >= 3")
 
-    asset_info = config.mongo_db.tracked_assets.find_one({'asset': asset})
-    if not asset_info:
+    if not asset_registry.get(asset):
         raise Exception("Asset does not exist.")
 
     now_ts = calendar.timegm(time.gmtime())
@@ -468,29 +544,45 @@ def get_balance_history(asset, addresses, normalize=True, start_ts=None, end_ts=
         end_ts = now_ts
     if not start_ts:  # default to 30 days before the end date
         start_ts = end_ts - (30 * 24 * 60 * 60)
+    start_dt = datetime.datetime.utcfromtimestamp(start_ts)
+    end_dt = datetime.datetime.utcfromtimestamp(end_ts) if end_ts != now_ts else None
+    start_block_index, end_block_index = database.get_block_indexes_for_dates(start_dt=start_dt, end_dt=end_dt)
+
+    # fetch the balance changes for all of the addresses in one go (bounded on the block_index part of the
+    # address/asset/block_index index), and split them out into a series per address
+    series = dict((address, []) for address in addresses)
+    result = config.mongo_db.balance_changes.find({
+        'address': {"$in": addresses},
+        'asset': asset,
+        'block_index': {"$gte": start_block_index, "$lte": end_block_index},
+        'block_time': {"$gte": start_dt, "$lte": end_dt} if end_dt else {"$gte": start_dt}
+    }, {'_id': 0, 'address': 1, 'block_index': 1, 'block_time': 1, 'new_balance': 1, 'new_balance_normalized': 1})
+    for r in result:
+        series[r['address']].append(r)
+
     results = []
     for address in addresses:
-        result = config.mongo_db.balance_changes.find({
-            'address': address,
-            'asset': asset,
-            "block_time": {
-                "$gte": datetime.datetime.utcfromtimestamp(start_ts)
-            } if end_ts == now_ts else {
-                "$gte": datetime.datetime.utcfromtimestamp(start_ts),
-                "$lte": datetime.datetime.utcfromtimestamp(end_ts)
-            }
-        }).sort("block_time", pymongo.ASCENDING)
-        entry = {
-            'name': address,
-            'data': [
-                (calendar.timegm(r['block_time'].timetuple()) * 1000,
-                 r['new_balance_normalized'] if normalize else r['new_balance']
-                 ) for r in result]
-        }
-        results.append(entry)
+        data = [
+            (calendar.timegm(r['block_time'].timetuple()) * 1000,
+             r['new_balance_normalized'] if normalize else r['new_balance']
+             ) for r in sorted(series[address], key=lambda r: r['block_index'])]
+        if max_points:
+            data = util.downsample_lttb(data, max_points)
+        results.append({'name': address, 'data': data})
     return results
 
 
+def update_tracked_asset(asset, update):
+    """Applies the given update to a tracked asset, and records the resulting state in tracked_asset_versions
+    (to allow for block rollbacks and point-in-time lookups). Returns the updated asset"""
+    tracked_asset = config.mongo_db.tracked_assets.find_one_and_update(
+        {'asset': asset}, update, projection={'_id': 0}, return_document=pymongo.ReturnDocument.AFTER)
+    assert tracked_asset is not None
+    config.mongo_db.tracked_asset_versions.insert(dict(tracked_asset))
+    asset_registry.update(tracked_asset)
+    return tracked_asset
+
+
 @MessageProcessor.subscribe(priority=ASSETS_PRIORITY_PARSE_ISSUANCE)
 def parse_issuance(msg, msg_data):
     if msg['category'] != 'issuances':
@@ -505,15 +597,20 @@ def parse_issuance(msg, msg_data):
         """adds an asset to asset_extended_info collection if the description is a valid json link. or, if the link
         is not a valid json link, will remove the asset entry from the table if it exists"""
         if util.is_valid_url(description, suffix='.json', allow_no_protocol=True):
-            config.mongo_db.asset_extended_info.update(
-                {'asset': asset},
-                {'$set': {
-                    'info_url': description,
-                    'info_status': 'needfetch',
-                    'fetch_info_retry': 0,  # retry ASSET_MAX_RETRY times to fetch info from info_url
-                    'info_data': {},
-                    'errors': []
-                }}, upsert=True)
+            asset_info = config.mongo_db.asset_extended_info.find_one({'asset': asset}, {'info_url': 1})
+            update = {
+                'info_url': description,
+                'info_status': 'needfetch',
+                'fetch_info_retry': 0,  # retry ASSET_MAX_RETRY times to fetch info from info_url
+                'info_queued_block': cur_block_index,
+                'errors': []
+            }
+            if not asset_info or asset_info['info_url'] != description:
+                # keep the info data for an unchanged info_url, so an unchanged info file doesn't need to be reprocessed
+                update['info_data'] = {}
+                update['info_hash'] = None
+            config.mongo_db.asset_extended_info.update({'asset': asset}, {'$set': update}, upsert=True)
+            new_asset_info_queue.append(asset)
             #^ valid info_status settings: needfetch, valid, invalid, error
             # additional fields will be added later in events, once the asset info is pulled
         else:
@@ -524,43 +621,34 @@ def parse_issuance(msg, msg_data):
                 os.remove(imagePath)
 
     tracked_asset = config.mongo_db.tracked_assets.find_one(
-        {'asset': msg_data['asset']}, {'_id': 0, '_history': 0})
-    #^ pulls the tracked asset without the _id and history fields. This may be None
+        {'asset': msg_data['asset']}, {'_id': 0})
+    #^ pulls the tracked asset without the _id field. This may be None
 
     if msg_data['locked'] and (tracked_asset is not None):  # lock asset
         assert tracked_asset is not None
-        config.mongo_db.tracked_assets.update(
-            {'asset': msg_data['asset']},
-            {"$set": {
-                '_at_block': cur_block_index,
-                '_at_block_time': cur_block['block_time_obj'],
-                '_change_type': 'locked',
-                'locked': True,
-            },
-                "$push": {'_history': tracked_asset}}, upsert=False)
+        update_tracked_asset(msg_data['asset'], {"$set": {
+            '_at_block': cur_block_index,
+            '_at_block_time': cur_block['block_time_obj'],
+            '_change_type': 'locked',
+            'locked': True,
+        }})
         logger.info("Locking asset {}{}".format(msg_data['asset'], ' ({})'.format(msg_data['asset_longname']) if msg_data.get('asset_longname', None) else ''))
     elif msg_data['transfer'] and (tracked_asset is not None):  # transfer asset
         assert tracked_asset is not None
-        config.mongo_db.tracked_assets.update(
-            {'asset': msg_data['asset']},
-            {"$set": {
-                '_at_block': cur_block_index,
-                '_at_block_time': cur_block['block_time_obj'],
-                '_change_type': 'transferred',
-                'owner': msg_data['issuer'],
-            },
-                "$push": {'_history': tracked_asset}}, upsert=False)
+        update_tracked_asset(msg_data['asset'], {"$set": {
+            '_at_block': cur_block_index,
+            '_at_block_time': cur_block['block_time_obj'],
+            '_change_type': 'transferred',
+            'owner': msg_data['issuer'],
+        }})
         logger.info("Transferring asset {}{} to address {}".format(msg_data['asset'], ' ({})'.format(msg_data['asset_longname']) if msg_data.get('asset_longname', None) else '', msg_data['issuer']))
     elif msg_data['quantity'] == 0 and tracked_asset is not None:  # change description
-        config.mongo_db.tracked_assets.update(
-            {'asset': msg_data['asset']},
-            {"$set": {
-                '_at_block': cur_block_index,
-                '_at_block_time': cur_block['block_time_obj'],
-                '_change_type': 'changed_description',
-                'description': msg_data['description'],
-            },
-                "$push": {'_history': tracked_asset}}, upsert=False)
+        update_tracked_asset(msg_data['asset'], {"$set": {
+            '_at_block': cur_block_index,
+            '_at_block_time': cur_block['block_time_obj'],
+            '_change_type': 'changed_description',
+            'description': msg_data['description'],
+        }})
         modify_extended_asset_info(msg_data['asset'], msg_data['description'])
         logger.info("Changing description for asset {}{} to '{}'".format(msg_data['asset'], ' ({})'.format(msg_data['asset_longname']) if msg_data.get('asset_longname', None) else '', msg_data['description']))
     else:  # issue new asset or issue addition qty of an asset
@@ -570,7 +658,7 @@ def parse_issuance(msg, msg_data):
                 '_at_block': cur_block_index,  # the block ID this asset is current for
                 '_at_block_time': cur_block['block_time_obj'],
                 #^ NOTE: (if there are multiple asset tracked changes updates in a single block for the same
-                # asset, the last one with _at_block == that block id in the history array is the
+                # asset, the last one with _at_block == that block id in tracked_asset_versions is the
                 # final version for that asset at that block
                 'asset': msg_data['asset'],
                 'asset_longname': msg_data.get('asset_longname', None), # for subassets, this is the full subasset name of the asset, e.g. PIZZA.DOMINOSBLA
@@ -580,26 +668,25 @@ def parse_issuance(msg, msg_data):
                 'locked': msg_data['locked'],
                 'total_issued': int(msg_data['quantity']),
                 'total_issued_normalized': blockchain.normalize_quantity(msg_data['quantity'], msg_data['divisible']),
-                '_history': []  # to allow for block rollbacks
             }
+            config.mongo_db.tracked_asset_versions.insert(dict(tracked_asset))  # to allow for block rollbacks
             config.mongo_db.tracked_assets.insert(tracked_asset)
+            asset_registry.update(tracked_asset)
             logger.info("Tracking new asset: {}{}".format(msg_data['asset'], ' ({})'.format(msg_data['asset_longname']) if msg_data.get('asset_longname', None) else ''))
             modify_extended_asset_info(msg_data['asset'], msg_data['description'])
         else:  # issuing additional of existing asset
             assert tracked_asset is not None
-            config.mongo_db.tracked_assets.update(
-                {'asset': msg_data['asset']},
-                {"$set": {
+            update_tracked_asset(msg_data['asset'], {
+                "$set": {
                     '_at_block': cur_block_index,
                     '_at_block_time': cur_block['block_time_obj'],
                     '_change_type': 'issued_more',
-                    'divisible': msg_data['divisible'],                 
+                    'divisible': msg_data['divisible'],
                 },
-                    "$inc": {
+                "$inc": {
                     'total_issued': msg_data['quantity'],
                     'total_issued_normalized': blockchain.normalize_quantity(msg_data['quantity'], msg_data['divisible'])
-                },
-                    "$push": {'_history': tracked_asset}}, upsert=False)
+                }})
             logger.info("Adding additional {} quantity for asset {}{}".format(blockchain.normalize_quantity(msg_data['quantity'], msg_data['divisible']),
                 msg_data['asset'], ' ({})'.format(msg_data['asset_longname']) if msg_data.get('asset_longname', None) else ''))
     return True
@@ -617,22 +704,20 @@ def parse_destruction(msg, msg_data):
     cur_block = config.state['cur_block']
 
     tracked_asset = config.mongo_db.tracked_assets.find_one(
-        {'asset': msg_data['asset']}, {'_id': 0, '_history': 0})
-    #^ pulls the tracked asset without the _id and history fields. This may be None
+        {'asset': msg_data['asset']}, {'_id': 0})
+    #^ pulls the tracked asset without the _id field. This may be None
 
     assert tracked_asset is not None
-    config.mongo_db.tracked_assets.update(
-        {'asset': msg_data['asset']},
-        {"$set": {
+    update_tracked_asset(msg_data['asset'], {
+        "$set": {
             '_at_block': cur_block_index,
             '_at_block_time': cur_block['block_time_obj'],
             '_change_type': 'destruction',
         },
-            "$inc": {
+        "$inc": {
             'total_issued': -msg_data['quantity'],
             'total_issued_normalized': blockchain.normalize_quantity(-msg_data['quantity'], tracked_asset['divisible'])
-        },
-            "$push": {'_history': tracked_asset}}, upsert=False)
+        }})
     logger.info("Destroying {} quantity of asset {}{}".format(blockchain.normalize_quantity(msg_data['quantity'], tracked_asset['divisible']),
                 msg_data['asset'], ' ({})'.format(msg_data['asset_longname']) if msg_data.get('asset_longname', None) else ''))
     return True
@@ -645,18 +730,15 @@ def parse_balance_change(msg, msg_data):
     if msg['category'] in ['credits', 'debits', ]:
         actionName = 'credit' if msg['category'] == 'credits' else 'debit'
         address = msg_data['address']
-        asset_info = config.mongo_db.tracked_assets.find_one({'asset': msg_data['asset']})
+        asset_info = asset_registry.get(msg_data['asset'])
         if asset_info is None:
             logger.warn("Credit/debit of %s where asset ('%s') does not exist. Ignoring..." % (msg_data['quantity'], msg_data['asset']))
             return 'ABORT_THIS_MESSAGE_PROCESSING'
         quantity = msg_data['quantity'] if msg['category'] == 'credits' else -msg_data['quantity']
-        quantity_normalized = blockchain.normalize_quantity(quantity, asset_info['divisible'])
+        quantity_normalized = blockchain.normalize_quantity(quantity, asset_info.divisible)
 
         # look up the previous balance to go off of
-        last_bal_change = config.mongo_db.balance_changes.find_one({
-            'address': address,
-            'asset': asset_info['asset']
-        }, sort=[("block_index", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+        last_bal_change = get_last_balance_change(address, asset_info.asset)
 
         if last_bal_change \
            and last_bal_change['block_index'] == config.state['cur_block']['block_index']:
@@ -674,8 +756,8 @@ def parse_balance_change(msg, msg_data):
         else:  # new balance change record for this block
             bal_change = {
                 'address': address,
-                'asset': asset_info['asset'],
-                'asset_longname': asset_info['asset_longname'],
+                'asset': asset_info.asset,
+                'asset_longname': asset_info.asset_longname,
                 'block_index': config.state['cur_block']['block_index'],
                 'block_time': config.state['cur_block']['block_time_obj'],
                 'quantity': quantity,
@@ -688,44 +770,172 @@ def parse_balance_change(msg, msg_data):
                 actionName.capitalize(), ('%f' % bal_change['quantity_normalized']).rstrip('0').rstrip('.'), bal_change['asset'],
                 'from' if actionName == 'debit' else 'to',
                 bal_change['address'], ('%f' % bal_change['new_balance_normalized']).rstrip('0').rstrip('.'), msg['message_index'],))
+        cache_last_balance_change(bal_change)
+        config.mongo_db.current_balances.update(
+            {'address': bal_change['address'], 'asset': bal_change['asset']},
+            {"$set": {
+                'quantity': bal_change['new_balance'],
+                'block_index': bal_change['block_index'],
+            }}, upsert=True)
+
+        # keep the asset's holder count up to date, as the address goes from/to holding a (positive) balance
+        holders_delta = int(bal_change['new_balance'] > 0) - int(bal_change['new_balance'] - quantity > 0)
+        if holders_delta:
+            config.mongo_db.asset_holders.update(
+                {'asset': bal_change['asset']}, {"$inc": {'holder_count': holders_delta}}, upsert=True)
+
+
+def update_asset_holder_counts(assets):
+    """Recounts the number of holders of the given assets, from current_balances"""
+    for asset in assets:
+        holder_count = config.mongo_db.current_balances.find({'asset': asset, 'quantity': {"$gt": 0}}).count()
+        config.mongo_db.asset_holders.update({'asset': asset}, {"$set": {'holder_count': holder_count}}, upsert=True)
+
+
+def update_escrow(escrow_id, quantity, address=None, asset=None):
+    """Sets the quantity held in escrow by the given escrow entry (an open order or bet, or one side of a pending order
+    or bet match). Pass address and asset to create a new entry; otherwise, only an existing entry is updated. An entry
+    with a zero quantity is removed (but its removal is still recorded in escrow_versions, to allow for block rollbacks),
+    and is restored from its last version if it is given a quantity again"""
+    if address is None:
+        escrow = config.mongo_db.escrows.find_one({'escrow_id': escrow_id}, {'_id': 0})
+        if escrow is None:
+            # an entry that was emptied out may escrow again (e.g. an order filled by a pending BTC match, and reopened
+            # as that match expires)
+            escrow = config.mongo_db.escrow_versions.find_one(
+                {'escrow_id': escrow_id}, {'_id': 0}, sort=[("_at_block", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+            if escrow is None or quantity <= 0:
+                return  # not escrowing anything that we track (e.g. a BTC order), or still empty
+    else:
+        escrow = {'escrow_id': escrow_id, 'address': address, 'asset': asset}
+    escrow['quantity'] = quantity
+    escrow['_at_block'] = config.state['cur_block']['block_index']
+    config.mongo_db.escrow_versions.insert(dict(escrow))
+    if quantity > 0:
+        config.mongo_db.escrows.replace_one({'escrow_id': escrow_id}, escrow, upsert=True)
+    else:
+        config.mongo_db.escrows.remove({'escrow_id': escrow_id})
+
+
+@MessageProcessor.subscribe(priority=ASSETS_PRIORITY_ESCROW)
+def parse_escrow(msg, msg_data):
+    # track the quantities held in escrow for open orders and bets, and pending order and bet matches
+    if msg['category'] == 'orders':
+        if msg['command'] == 'insert':
+            if msg_data['status'] == 'open' and msg_data['give_asset'] != config.BTC:
+                update_escrow('order_' + msg_data['tx_hash'], msg_data['give_remaining'],
+                              address=msg_data['source'], asset=msg_data['give_asset'])
+        elif msg_data['status'] != 'open':
+            update_escrow('order_' + msg_data['tx_hash'], 0)
+        elif 'give_remaining' in msg_data:
+            update_escrow('order_' + msg_data['tx_hash'], msg_data['give_remaining'])
+    elif msg['category'] == 'order_matches':
+        if msg['command'] == 'insert':
+            if msg_data['status'] == 'pending':
+                if msg_data['forward_asset'] != config.BTC:
+                    update_escrow('order_match_%s_0' % msg_data['id'], msg_data['forward_quantity'],
+                                  address=msg_data['tx0_address'], asset=msg_data['forward_asset'])
+                if msg_data['backward_asset'] != config.BTC:
+                    update_escrow('order_match_%s_1' % msg_data['id'], msg_data['backward_quantity'],
+                                  address=msg_data['tx1_address'], asset=msg_data['backward_asset'])
+        elif msg_data['status'] != 'pending':
+            update_escrow('order_match_%s_0' % msg_data['order_match_id'], 0)
+            update_escrow('order_match_%s_1' % msg_data['order_match_id'], 0)
+    elif msg['category'] == 'bets':
+        if msg['command'] == 'insert':
+            if msg_data['status'] == 'open':
+                update_escrow('bet_' + msg_data['tx_hash'], msg_data['wager_remaining'],
+                              address=msg_data['source'], asset=config.XCP)
+        elif msg_data['status'] != 'open':
+            update_escrow('bet_' + msg_data['tx_hash'], 0)
+        elif 'wager_remaining' in msg_data:
+            update_escrow('bet_' + msg_data['tx_hash'], msg_data['wager_remaining'])
+    elif msg['category'] == 'bet_matches':
+        if msg['command'] == 'insert':
+            if msg_data['status'] == 'pending':
+                update_escrow('bet_match_%s_0' % msg_data['id'], msg_data['forward_quantity'],
+                              address=msg_data['tx0_address'], asset=config.XCP)
+                update_escrow('bet_match_%s_1' % msg_data['id'], msg_data['backward_quantity'],
+                              address=msg_data['tx1_address'], asset=config.XCP)
+        elif msg_data['status'] != 'pending':
+            update_escrow('bet_match_%s_0' % msg_data['bet_match_id'], 0)
+            update_escrow('bet_match_%s_1' % msg_data['bet_match_id'], 0)
+
+# asset_extended_info
+database.register_index('asset_extended_info', 'asset', unique=True)
+database.register_index('asset_extended_info', [
+    ("info_status", pymongo.ASCENDING),
+    ("fetch_info_retry", pymongo.ASCENDING),
+    ("info_queued_block", pymongo.DESCENDING),
+])
+database.register_query_shape('asset_extended_info', {'info_status': 'needfetch'},
+                              [("fetch_info_retry", pymongo.ASCENDING), ("info_queued_block", pymongo.DESCENDING)])
+# asset_extended_info_fetches (NOT purged as a result of a reparse, as it only caches what was fetched from info URLs)
+database.register_index('asset_extended_info_fetches', 'info_url', unique=True)
+# balance_changes
+database.register_index('balance_changes', 'block_index')
+database.register_index('balance_changes', [
+    ("address", pymongo.ASCENDING),
+    ("asset", pymongo.ASCENDING),
+    ("block_index", pymongo.DESCENDING),
+    ("_id", pymongo.DESCENDING)
+])
+database.register_query_shape('balance_changes', {'address': '', 'asset': config.XCP}, [("block_index", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+# current_balances
+database.register_index('current_balances', [
+    ("address", pymongo.ASCENDING),
+    ("asset", pymongo.ASCENDING),
+], unique=True)
+database.register_index('current_balances', 'block_index')  # for rollbacks
+database.register_index('current_balances', [
+    ("asset", pymongo.ASCENDING),
+    ("quantity", pymongo.DESCENDING),
+])  # for top holders and holder counts
+database.register_query_shape('current_balances', {'address': {'$in': ['']}})
+database.register_query_shape('current_balances', {'asset': config.XCP}, [("quantity", pymongo.DESCENDING)])
+# asset_holders
+database.register_index('asset_holders', 'asset', unique=True)
+# escrows
+database.register_index('escrows', 'escrow_id', unique=True)
+database.register_index('escrows', 'address')
+database.register_query_shape('escrows', {'address': {'$in': ['']}})
+# escrow_versions
+database.register_index('escrow_versions', [
+    ("escrow_id", pymongo.ASCENDING),
+    ("_at_block", pymongo.DESCENDING),
+    ("_id", pymongo.DESCENDING)
+])
+database.register_index('escrow_versions', '_at_block')  # for escrow pruning
+# tracked_assets
+database.register_index('tracked_assets', 'asset', unique=True)
+database.register_index('tracked_assets', 'asset_longname')
+database.register_index('tracked_assets', [
+    ("owner", pymongo.ASCENDING),
+    ("asset", pymongo.ASCENDING),
+])
+database.register_query_shape('tracked_assets', {'asset': config.XCP})
+database.register_query_shape('tracked_assets', {'owner': {'$in': ['']}}, [("asset", pymongo.ASCENDING)])
+# tracked_asset_versions
+database.register_index('tracked_asset_versions', [
+    ("asset", pymongo.ASCENDING),
+    ("_at_block", pymongo.DESCENDING),
+    ("_id", pymongo.DESCENDING)
+])
+database.register_index('tracked_asset_versions', '_at_block')  # for tracked asset pruning
+# feeds (also registered in betting module)
+database.register_index('feeds', 'source')
+database.register_index('feeds', 'owner')
+database.register_index('feeds', 'category')
+database.register_index('feeds', 'info_url')
 
 
 @StartUpProcessor.subscribe()
 def init():
-    # init db and indexes
-    # asset_extended_info
-    config.mongo_db.asset_extended_info.ensure_index('asset', unique=True)
-    config.mongo_db.asset_extended_info.ensure_index('info_status')
-    # balance_changes
-    config.mongo_db.balance_changes.ensure_index('block_index')
-    config.mongo_db.balance_changes.ensure_index([
-        ("address", pymongo.ASCENDING),
-        ("asset", pymongo.ASCENDING),
-        ("block_index", pymongo.DESCENDING),
-        ("_id", pymongo.DESCENDING)
-    ])
-    #config.mongo_db.balance_changes.ensure_index([
-    #    ("address", pymongo.ASCENDING),
-    #    ("asset_longname", pymongo.ASCENDING),
-    #])
     try:  # drop unnecessary indexes if they exist
         config.mongo_db.balance_changes.drop_index('address_1_asset_1_block_time_1')
     except:
         pass
 
-    # tracked_assets
-    config.mongo_db.tracked_assets.ensure_index('asset', unique=True)
-    config.mongo_db.tracked_assets.ensure_index('_at_block')  # for tracked asset pruning
-    config.mongo_db.tracked_assets.ensure_index([
-        ("owner", pymongo.ASCENDING),
-        ("asset", pymongo.ASCENDING),
-    ])
-    # feeds (also init in betting module)
-    config.mongo_db.feeds.ensure_index('source')
-    config.mongo_db.feeds.ensure_index('owner')
-    config.mongo_db.feeds.ensure_index('category')
-    config.mongo_db.feeds.ensure_index('info_url')
-
 
 @CaughtUpProcessor.subscribe()
 def start_tasks():
@@ -734,10 +944,19 @@ def start_tasks():
 
 @RollbackProcessor.subscribe()
 def process_rollback(max_block_index):
+    global balance_cache_complete
+    balance_cache.clear()
+    balance_cache_complete = not max_block_index  # after a full reparse, every balance change on record passes through the cache
     if not max_block_index:  # full reparse
         config.mongo_db.balance_changes.drop()
+        config.mongo_db.current_balances.drop()
+        config.mongo_db.asset_holders.drop()
+        config.mongo_db.escrows.drop()
+        config.mongo_db.escrow_versions.drop()
         config.mongo_db.tracked_assets.drop()
+        config.mongo_db.tracked_asset_versions.drop()
         config.mongo_db.asset_extended_info.drop()
+        asset_registry.clear()
         # create XCP and BTC assets in tracked_assets
         for asset in [config.XCP, config.BTC]:
             base_asset = {
@@ -748,32 +967,34 @@ def process_rollback(max_block_index):
                 'locked': False,
                 'total_issued': None,
                 '_at_block': config.BLOCK_FIRST,  # the block ID this asset is current for
-                '_history': []  # to allow for block rollbacks
             }
             config.mongo_db.tracked_assets.insert(base_asset)
+            asset_registry.update(base_asset)
     else:  # rollback
         config.mongo_db.balance_changes.remove({"block_index": {"$gt": max_block_index}})
 
-        # to roll back the state of the tracked asset, dive into the history object for each asset that has
-        # been updated on or after the block that we are pruning back to
-        assets_to_prune = config.mongo_db.tracked_assets.find({'_at_block': {"$gt": max_block_index}})
-        for asset in assets_to_prune:
-            prev_ver = None
-            while len(asset['_history']):
-                prev_ver = asset['_history'].pop()
-                if prev_ver['_at_block'] <= max_block_index:
-                    break
-            if not prev_ver or prev_ver['_at_block'] > max_block_index:
-                # even the first history version is newer than max_block_index.
-                # in this case, just remove the asset tracking record itself
-                logger.info("Pruning asset %s (last modified @ block %i, removing as no older state available that is <= block %i)" % (
-                    asset['asset'], asset['_at_block'], max_block_index))
-                config.mongo_db.tracked_assets.remove({'asset': asset['asset']})
+        # restore the current balance of every (address, asset) pair that changed after the block we are pruning back to
+        rolled_back_holdings = list(config.mongo_db.current_balances.find({"block_index": {"$gt": max_block_index}}))
+        for current_balance in rolled_back_holdings:
+            last_bal_change = config.mongo_db.balance_changes.find_one({
+                'address': current_balance['address'],
+                'asset': current_balance['asset']
+            }, sort=[("block_index", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+            if last_bal_change:
+                config.mongo_db.current_balances.update(
+                    {'_id': current_balance['_id']},
+                    {"$set": {'quantity': last_bal_change['new_balance'], 'block_index': last_bal_change['block_index']}})
             else:
-                # if here, we were able to find a previous version that was saved at or before max_block_index
-                # (which should be prev_ver ... restore asset's values to its values
-                logger.info("Pruning asset %s (last modified @ block %i, pruning to state at block %i)" % (
-                    asset['asset'], asset['_at_block'], max_block_index))
-                prev_ver['_id'] = asset['_id']
-                prev_ver['_history'] = asset['_history']
-                config.mongo_db.tracked_assets.save(prev_ver)
+                config.mongo_db.current_balances.remove({'_id': current_balance['_id']})
+        update_asset_holder_counts(set(e['asset'] for e in rolled_back_holdings))
+
+        # to roll back the state of the tracked assets, restore each asset that has been updated after the block
+        # that we are pruning back to to its last version at or before that block (or remove it, if it has none)
+        rolled_back_assets = database.rollback_versioned_collection(
+            config.mongo_db.tracked_assets, config.mongo_db.tracked_asset_versions, 'asset', max_block_index)
+        asset_registry.reload(rolled_back_assets)
+
+        # likewise for the escrow entries (dropping any entry that had no quantity left in escrow at that block)
+        database.rollback_versioned_collection(
+            config.mongo_db.escrows, config.mongo_db.escrow_versions, 'escrow_id', max_block_index,
+            is_live=lambda escrow: escrow['quantity'] > 0)
@@ -21,7 +21,7 @@ import flask
 import jsonrpc
 import dateutil.parser
 
-from counterblock.lib import config, util, blockfeed, blockchain
+from counterblock.lib import config, util, blockfeed, blockchain, database
 from counterblock.lib.modules import BETTING_PRIORITY_PARSE_BROADCAST
 from counterblock.lib.processor import MessageProcessor, MempoolMessageProcessor, BlockProcessor, StartUpProcessor, CaughtUpProcessor, RollbackProcessor, API, start_task
 
@@ -326,14 +326,11 @@ def task_compile_extended_feed_info():
     start_task(task_compile_extended_feed_info, delay=60 * 5)  # call again in 5 minutes
 
 
-@StartUpProcessor.subscribe()
-def init():
-    # init db and indexes
-    # feeds (also init in enhanced_asset_info module)
-    config.mongo_db.feeds.ensure_index('source')
-    config.mongo_db.feeds.ensure_index('owner')
-    config.mongo_db.feeds.ensure_index('category')
-    config.mongo_db.feeds.ensure_index('info_url')
+# feeds (also registered in assets module)
+database.register_index('feeds', 'source')
+database.register_index('feeds', 'owner')
+database.register_index('feeds', 'category')
+database.register_index('feeds', 'info_url')
 
 
 @CaughtUpProcessor.subscribe()
@@ -21,7 +21,7 @@ import calendar
 
 import dateutil.parser
 
-from counterblock.lib import config, util, blockfeed, blockchain, messages
+from counterblock.lib import config, util, blockfeed, blockchain, messages, database
 from counterblock.lib.processor import MessageProcessor, MempoolMessageProcessor, BlockProcessor, StartUpProcessor, CaughtUpProcessor, RollbackProcessor, API, start_task, CORE_FIRST_PRIORITY
 from counterblock.lib.modules import CWALLET_PRIORITY_PARSE_FOR_SOCKETIO, CWALLET_PRIORITY_PUBLISH_MEMPOOL
 
@@ -552,34 +552,31 @@ def start_tasks():
     start_task(task_generate_wallet_stats)
 
 
+# COLLECTIONS THAT *ARE* PURGED AS A RESULT OF A REPARSE
+# wallet_stats
+database.register_index('wallet_stats', [
+    ("when", pymongo.ASCENDING),
+    ("network", pymongo.ASCENDING),
+])
+# COLLECTIONS THAT ARE *NOT* PURGED AS A RESULT OF A REPARSE
+# preferences
+database.register_index('preferences', 'wallet_id', unique=True)
+database.register_index('preferences', 'network')
+database.register_index('preferences', 'last_touched')
+# login_history
+database.register_index('login_history', 'wallet_id')
+database.register_index('login_history', [
+    ("when", pymongo.DESCENDING),
+    ("network", pymongo.ASCENDING),
+    ("action", pymongo.ASCENDING),
+])
+
+
 @StartUpProcessor.subscribe()
 def init():
     _read_config()
     logger.info("Armory-utxsvr hostname: {}".format(module_config['ARMORY_UTXSVR_HOST']))
 
-    # init db and indexes
-    # COLLECTIONS THAT *ARE* PURGED AS A RESULT OF A REPARSE
-    #wallet_messages
-    #config.mongo_db.wallet_messages.ensure_index('when')
-    # wallet_stats
-    config.mongo_db.wallet_stats.ensure_index([
-        ("when", pymongo.ASCENDING),
-        ("network", pymongo.ASCENDING),
-    ])
-
-    # COLLECTIONS THAT ARE *NOT* PURGED AS A RESULT OF A REPARSE
-    # preferences
-    config.mongo_db.preferences.ensure_index('wallet_id', unique=True)
-    config.mongo_db.preferences.ensure_index('network')
-    config.mongo_db.preferences.ensure_index('last_touched')
-    # login_history
-    config.mongo_db.login_history.ensure_index('wallet_id')
-    config.mongo_db.login_history.ensure_index([
-        ("when", pymongo.DESCENDING),
-        ("network", pymongo.ASCENDING),
-        ("action", pymongo.ASCENDING),
-    ])
-
     # clear the wallet_messages collection, but create a null entry with the last message ID (because it could
     # have been a rapid restart and we don't want to break wallets currently pulling for messages)
     last_wallet_message = config.mongo_db.wallet_messages.find_one(sort=[("_id", pymongo.DESCENDING)])
@@ -10,7 +10,6 @@ import sys
 import time
 import datetime
 import logging
-import decimal
 import urllib.request
 import urllib.parse
 import urllib.error
@@ -19,24 +18,30 @@ import operator
 import base64
 import configparser
 import calendar
+from fractions import Fraction
 
 import pymongo
-from bson.son import SON
 import dateutil.parser
 
-from counterblock.lib import config, util, blockfeed, blockchain
+from counterblock.lib import config, util, asset_registry, blockfeed, blockchain, database, numeric
 from counterblock.lib.modules import DEX_PRIORITY_PARSE_TRADEBOOK
 from counterblock.lib.processor import MessageProcessor, MempoolMessageProcessor, BlockProcessor, StartUpProcessor, CaughtUpProcessor, RollbackProcessor, API, start_task
-from . import assets_trading, dex
+from . import assets_trading, candles, dex, market_windows, order_book
 
-D = decimal.Decimal
-EIGHT_PLACES = decimal.Decimal(10) ** -8
-
-COMPILE_MARKET_PAIR_INFO_PERIOD = 10 * 60  # in seconds (this is every 10 minutes currently)
 COMPILE_ASSET_MARKET_INFO_PERIOD = 30 * 60  # in seconds (this is every 30 minutes currently)
 
 logger = logging.getLogger(__name__)
 
+# (base_asset, quote_asset) pairs traded in the block being processed, and assets whose supply changed in it
+market_summary_pairs = set()
+market_summary_supply_changed_assets = set()
+pair_market_info_state = {'refresh_all': True}
+
+# the order match fields parse_trade_book needs from the (stored) pending BTC order matches
+BTC_ORDER_MATCH_FIELDS = [
+    'tx0_index', 'tx0_hash', 'tx0_address', 'tx1_index', 'tx1_hash', 'tx1_address',
+    'forward_asset', 'forward_quantity', 'backward_asset', 'backward_quantity']
+
 
 @API.add_method
 def get_market_price_summary(asset1, asset2, with_last_trades=0):
@@ -117,44 +122,24 @@ def get_market_info(assets):
 
 @API.add_method
 def get_market_info_leaderboard(limit=100):
-    """returns market leaderboard data for both the XCP and BTC markets"""
-    # do two queries because we limit by our sorted results, and we might miss an asset with a high BTC trading value
-    # but with little or no XCP trading activity, for instance if we just did one query
-    assets_market_info_xcp = list(config.mongo_db.asset_market_info.find({}, {'_id': 0}).sort('market_cap_in_{}'.format(config.XCP.lower()), pymongo.DESCENDING).limit(limit))
-    assets_market_info_btc = list(config.mongo_db.asset_market_info.find({}, {'_id': 0}).sort('market_cap_in_{}'.format(config.BTC.lower()), pymongo.DESCENDING).limit(limit))
-    assets_market_info = {
-        config.XCP.lower(): [a for a in assets_market_info_xcp if a['price_in_{}'.format(config.XCP.lower())]],
-        config.BTC.lower(): [a for a in assets_market_info_btc if a['price_in_{}'.format(config.BTC.lower())]]
-    }
-    # throw on extended info, if it exists for a given asset
-    assets = list(set([a['asset'] for a in assets_market_info[config.XCP.lower()]] + [a['asset'] for a in assets_market_info[config.BTC.lower()]]))
-    extended_asset_info = config.mongo_db.asset_extended_info.find({'asset': {'$in': assets}})
-    extended_asset_info_dict = {}
-    for e in extended_asset_info:
-        if not e.get('disabled', False):  # skip assets marked disabled
-            extended_asset_info_dict[e['asset']] = e
-    for r in (assets_market_info[config.XCP.lower()], assets_market_info[config.BTC.lower()]):
-        for a in r:
-            if a['asset'] in extended_asset_info_dict:
-                extended_info = extended_asset_info_dict[a['asset']]
-                if 'extended_image' not in a or 'extended_description' not in a or 'extended_website' not in a:
-                    continue  # asset has been recognized as having a JSON file description, but has not been successfully processed yet
-                a['extended_image'] = bool(extended_info.get('image', ''))
-                a['extended_description'] = extended_info.get('description', '')
-                a['extended_website'] = extended_info.get('website', '')
-            else:
-                a['extended_image'] = a['extended_description'] = a['extended_website'] = ''
+    """returns market leaderboard data for both the XCP and BTC markets (for up to the top 100 assets of each)"""
+    # the leaderboards are ranked as the market info is compiled (see assets_trading.compile_market_info_leaderboard)
+    assets_market_info = {config.XCP.lower(): [], config.BTC.lower(): []}
+    for a in config.mongo_db.market_info_leaderboard.find({'rank': {'$lt': limit}}, {'_id': 0}).sort(
+            [('market', pymongo.ASCENDING), ('rank', pymongo.ASCENDING)]):
+        market = a.pop('market')
+        del a['rank']
+        assets_market_info[market].append(a)
     return assets_market_info
 
 
 @API.add_method
 def get_market_price_history(asset1, asset2, start_ts=None, end_ts=None, as_dict=False):
-    """Return block-by-block aggregated market history data for the specified asset pair, within the specified date range.
+    """Return hourly aggregated market history data (out of the hourly trade candles) for the specified asset pair,
+    within the specified date range.
     @returns List of lists (or list of dicts, if as_dict is specified).
-        * If as_dict is False, each embedded list has 8 elements [block time (epoch in MS), open, high, low, close, volume, # trades in block, block index]
-        * If as_dict is True, each dict in the list has the keys: block_time (epoch in MS), block_index, open, high, low, close, vol, count
-
-    Aggregate on an an hourly basis 
+        * If as_dict is False, each embedded list has 8 elements [interval time (epoch in MS), open, high, low, close, volume, # trades in interval, midline]
+        * If as_dict is True, each dict in the list has the keys: interval_time (epoch in MS), open, high, low, close, vol, count, midline
     """
     now_ts = calendar.timegm(time.gmtime())
     if not end_ts:  # default to current datetime
@@ -163,56 +148,32 @@ def get_market_price_history(asset1, asset2, start_ts=None, end_ts=None, as_dict
         start_ts = end_ts - (180 * 24 * 60 * 60)
     base_asset, quote_asset = util.assets_to_asset_pair(asset1, asset2)
 
-    # get ticks -- open, high, low, close, volume
-    result = config.mongo_db.trades.aggregate([
-        {"$match": {
-            "base_asset": base_asset,
-            "quote_asset": quote_asset,
-            "block_time": {
-                "$gte": datetime.datetime.utcfromtimestamp(start_ts)
-            } if end_ts == now_ts else {
-                "$gte": datetime.datetime.utcfromtimestamp(start_ts),
-                "$lte": datetime.datetime.utcfromtimestamp(end_ts)
-            }
-        }},
-        {"$project": {
-            "year":  {"$year": "$block_time"},
-            "month": {"$month": "$block_time"},
-            "day":   {"$dayOfMonth": "$block_time"},
-            "hour":  {"$hour": "$block_time"},
-            "block_index": 1,
-            "unit_price": 1,
-            "base_quantity_normalized": 1  # to derive volume
-        }},
-        {"$group": {
-            "_id":   {"year": "$year", "month": "$month", "day": "$day", "hour": "$hour"},
-            "open":  {"$first": "$unit_price"},
-            "high":  {"$max": "$unit_price"},
-            "low":   {"$min": "$unit_price"},
-            "close": {"$last": "$unit_price"},
-            "vol":   {"$sum": "$base_quantity_normalized"},
-            "count": {"$sum": 1},
-        }},
-        {"$sort": SON([("_id.year", pymongo.ASCENDING), ("_id.month", pymongo.ASCENDING), ("_id.day", pymongo.ASCENDING), ("_id.hour", pymongo.ASCENDING)])},
-    ])
-    result = list(result)
+    # get ticks -- open, high, low, close, volume, out of the hourly candles
+    result = candles.get_candles(
+        base_asset, quote_asset, '1h', datetime.datetime.utcfromtimestamp(start_ts),
+        datetime.datetime.utcfromtimestamp(end_ts) if end_ts != now_ts else None)
     if not len(result):
         return False
 
     midline = [((r['high'] + r['low']) / 2.0) for r in result]
     if as_dict:
         for i in range(len(result)):
-            result[i]['interval_time'] = int(calendar.timegm(datetime.datetime(
-                result[i]['_id']['year'], result[i]['_id']['month'], result[i]['_id']['day'], result[i]['_id']['hour']).timetuple()) * 1000)
-            result[i]['midline'] = midline[i]
-            del result[i]['_id']
+            result[i] = {
+                'interval_time': int(calendar.timegm(result[i]['interval_time'].timetuple()) * 1000),
+                'open': result[i]['open'],
+                'high': result[i]['high'],
+                'low': result[i]['low'],
+                'close': result[i]['close'],
+                'vol': result[i]['vol'],
+                'count': result[i]['count'],
+                'midline': midline[i],
+            }
         return result
     else:
         list_result = []
         for i in range(len(result)):
             list_result.append([
-                int(calendar.timegm(datetime.datetime(
-                    result[i]['_id']['year'], result[i]['_id']['month'], result[i]['_id']['day'], result[i]['_id']['hour']).timetuple()) * 1000),
+                int(calendar.timegm(result[i]['interval_time'].timetuple()) * 1000),
                 result[i]['open'], result[i]['high'], result[i]['low'], result[i]['close'], result[i]['vol'],
                 result[i]['count'], midline[i]
             ])
@@ -266,56 +227,23 @@ def _get_order_book(base_asset, quote_asset,
     @param: normalized_fee_provided: Only specify if selling BTC. If specified, the order book will be pruned down to only
      show orders at and above this fee_provided
     """
-    base_asset_info = config.mongo_db.tracked_assets.find_one({'asset': base_asset})
-    quote_asset_info = config.mongo_db.tracked_assets.find_one({'asset': quote_asset})
+    base_asset_info = asset_registry.get(base_asset)
+    quote_asset_info = asset_registry.get(quote_asset)
 
     if not base_asset_info or not quote_asset_info:
         raise Exception("Invalid asset(s)")
 
-    # TODO: limit # results to 8 or so for each book (we have to sort as well to limit)
-    base_bid_filters = [
-        {"field": "get_asset", "op": "==", "value": base_asset},
-        {"field": "give_asset", "op": "==", "value": quote_asset},
-    ]
-    base_ask_filters = [
-        {"field": "get_asset", "op": "==", "value": quote_asset},
-        {"field": "give_asset", "op": "==", "value": base_asset},
-    ]
-    if base_asset == config.BTC or quote_asset == config.BTC:
-        extra_filters = [
-            {'field': 'give_remaining', 'op': '>', 'value': 0},  # don't show empty BTC orders
-            {'field': 'get_remaining', 'op': '>', 'value': 0},  # don't show empty BTC orders
-            {'field': 'fee_required_remaining', 'op': '>=', 'value': 0},
-            {'field': 'fee_provided_remaining', 'op': '>=', 'value': 0},
-        ]
-        base_bid_filters += extra_filters
-        base_ask_filters += extra_filters
-
-    base_bid_orders = util.call_jsonrpc_api(
-        "get_orders", {
-            'filters': base_bid_filters,
-            'show_expired': False,
-            'status': 'open',
-            'order_by': 'block_index',
-            'order_dir': 'asc',
-        }, abort_on_error=True)['result']
-
-    base_ask_orders = util.call_jsonrpc_api(
-        "get_orders", {
-            'filters': base_ask_filters,
-            'show_expired': False,
-            'status': 'open',
-            'order_by': 'block_index',
-            'order_dir': 'asc',
-        }, abort_on_error=True)['result']
+    order_book.ensure_loaded()
+    base_bid_orders = order_book.get_orders(base_asset, quote_asset, give_asset=quote_asset)
+    base_ask_orders = order_book.get_orders(base_asset, quote_asset, give_asset=base_asset)
 
     def get_o_pct(o):
         if o['give_asset'] == config.BTC:  # NB: fee_provided could be zero here
-            pct_fee_provided = float((D(o['fee_provided_remaining']) / D(o['give_quantity'])))
+            pct_fee_provided = o['fee_provided_remaining'] / o['give_quantity']
         else:
             pct_fee_provided = None
         if o['get_asset'] == config.BTC:  # NB: fee_required could be zero here
-            pct_fee_required = float((D(o['fee_required_remaining']) / D(o['get_quantity'])))
+            pct_fee_required = o['fee_required_remaining'] / o['get_quantity']
         else:
             pct_fee_required = None
         return pct_fee_provided, pct_fee_required
@@ -323,7 +251,10 @@ def _get_order_book(base_asset, quote_asset,
     # filter results by pct_fee_provided and pct_fee_required for BTC pairs as appropriate
     filtered_base_bid_orders = []
     filtered_base_ask_orders = []
-    if base_asset == config.BTC or quote_asset == config.BTC:
+    fee_filters = (bid_book_min_pct_fee_provided, bid_book_min_pct_fee_required, bid_book_max_pct_fee_required,
+                   ask_book_min_pct_fee_provided, ask_book_min_pct_fee_required, ask_book_max_pct_fee_required)
+    is_fee_filtered = (base_asset == config.BTC or quote_asset == config.BTC) and any(f is not None for f in fee_filters)
+    if is_fee_filtered:
         for o in base_bid_orders:
             pct_fee_provided, pct_fee_required = get_o_pct(o)
             addToBook = True
@@ -350,68 +281,30 @@ def _get_order_book(base_asset, quote_asset,
         filtered_base_bid_orders += base_bid_orders
         filtered_base_ask_orders += base_ask_orders
 
-    def make_book(orders, isBidBook):
-        book = {}
-        for o in orders:
-            if o['give_asset'] == base_asset:
-                if base_asset == config.BTC and o['give_quantity'] <= config.ORDER_BTC_DUST_LIMIT_CUTOFF:
-                    continue  # filter dust orders, if necessary
-
-                give_quantity = blockchain.normalize_quantity(o['give_quantity'], base_asset_info['divisible'])
-                get_quantity = blockchain.normalize_quantity(o['get_quantity'], quote_asset_info['divisible'])
-                unit_price = float((D(get_quantity) / D(give_quantity)))
-                remaining = blockchain.normalize_quantity(o['give_remaining'], base_asset_info['divisible'])
-            else:
-                if quote_asset == config.BTC and o['give_quantity'] <= config.ORDER_BTC_DUST_LIMIT_CUTOFF:
-                    continue  # filter dust orders, if necessary
-
-                give_quantity = blockchain.normalize_quantity(o['give_quantity'], quote_asset_info['divisible'])
-                get_quantity = blockchain.normalize_quantity(o['get_quantity'], base_asset_info['divisible'])
-                unit_price = float((D(give_quantity) / D(get_quantity)))
-                remaining = blockchain.normalize_quantity(o['get_remaining'], base_asset_info['divisible'])
-            id = "%s_%s_%s" % (base_asset, quote_asset, unit_price)
-            #^ key = {base}_{bid}_{unit_price}, values ref entries in book
-            book.setdefault(id, {'unit_price': unit_price, 'quantity': 0, 'count': 0})
-            book[id]['quantity'] += remaining  # base quantity outstanding
-            book[id]['count'] += 1  # num orders at this price level
-        book = sorted(iter(book.values()), key=operator.itemgetter('unit_price'), reverse=isBidBook)
-        #^ convert to list and sort -- bid book = descending, ask book = ascending
-        return book
-
-    # compile into a single book, at volume tiers
-    base_bid_book = make_book(filtered_base_bid_orders, True)
-    base_ask_book = make_book(filtered_base_ask_orders, False)
+    # compile into a single book, at volume tiers (out of the maintained price levels, unless they were filtered)
+    base_bid_book = order_book.get_levels(base_asset, quote_asset, True, filtered_base_bid_orders if is_fee_filtered else None)
+    base_ask_book = order_book.get_levels(base_asset, quote_asset, False, filtered_base_ask_orders if is_fee_filtered else None)
 
     # get stats like the spread and median
     if base_bid_book and base_ask_book:
         # don't do abs(), as this is "the amount by which the ask price exceeds the bid", so I guess it could be negative
         # if there is overlap in the book (right?)
-        bid_ask_spread = float((D(base_ask_book[0]['unit_price']) - D(base_bid_book[0]['unit_price'])))
-        bid_ask_median = float((D(max(base_ask_book[0]['unit_price'], base_bid_book[0]['unit_price'])) - (D(abs(bid_ask_spread)) / 2)))
+        spread = Fraction(base_ask_book[0]['unit_price']) - Fraction(base_bid_book[0]['unit_price'])
+        bid_ask_spread = numeric.to_float(spread)
+        bid_ask_median = numeric.to_float(Fraction(max(base_ask_book[0]['unit_price'], base_bid_book[0]['unit_price'])) - abs(spread) / 2)
     else:
         bid_ask_spread = 0
         bid_ask_median = 0
 
-    # compose depth and round out quantities
-    bid_depth = D(0)
-    for o in base_bid_book:
-        o['quantity'] = float(D(o['quantity']))
-        bid_depth += D(o['quantity'])
-        o['depth'] = float(D(bid_depth))
-    bid_depth = float(D(bid_depth))
-    ask_depth = D(0)
-    for o in base_ask_book:
-        o['quantity'] = float(D(o['quantity']))
-        ask_depth += D(o['quantity'])
-        o['depth'] = float(D(ask_depth))
-    ask_depth = float(D(ask_depth))
+    bid_depth = base_bid_book[-1]['depth'] if base_bid_book else 0.0
+    ask_depth = base_ask_book[-1]['depth'] if base_ask_book else 0.0
 
     # compose raw orders
     orders = filtered_base_bid_orders + filtered_base_ask_orders
     for o in orders:
         # add in the blocktime to help makes interfaces more user-friendly (i.e. avoid displaying block
         # indexes and display datetimes instead)
-        o['block_time'] = calendar.timegm(util.get_block_time(o['block_index']).timetuple()) * 1000
+        o['block_time'] = o['block_time'] * 1000 if o['block_time'] else None
 
     result = {
         'base_bid_book': base_bid_book,
@@ -521,12 +414,6 @@ def get_market_details(asset1, asset2, min_fee_provided=0.95, max_fee_required=0
     return dex.get_market_details(asset1, asset2, min_fee_provided, max_fee_required)
 
 
-def task_compile_asset_pair_market_info():
-    assets_trading.compile_asset_pair_market_info()
-    # all done for this run...call again in a bit
-    start_task(task_compile_asset_pair_market_info, delay=COMPILE_MARKET_PAIR_INFO_PERIOD)
-
-
 def task_compile_asset_market_info():
     assets_trading.compile_asset_market_info()
     # all done for this run...call again in a bit
@@ -544,20 +431,21 @@ def parse_trade_book(msg, msg_data):
 
         if msg['command'] == 'update' and msg_data['status'] == 'completed':
             # an order is being updated to a completed status (i.e. a BTCpay has completed)
-            tx0_hash, tx1_hash = msg_data['order_match_id'][:64], msg_data['order_match_id'][65:]
-            # get the order_match this btcpay settles
-            order_match = util.jsonrpc_api(
-                "get_order_matches",
-                {'filters': [
-                 {'field': 'tx0_hash', 'op': '==', 'value': tx0_hash},
-                 {'field': 'tx1_hash', 'op': '==', 'value': tx1_hash}]
-                 }, abort_on_error=False)['result'][0]
+            # get the order_match this btcpay settles (as stored when it was created), marking it resolved here, as
+            # the processing of this message stops below for matches under the dust limit
+            order_match = config.mongo_db.btc_order_matches.find_one_and_update(
+                {'order_match_id': msg_data['order_match_id']},
+                {"$set": {'resolved_block_index': config.state['cur_block']['block_index']}})
+            if order_match is None:  # (only after a rollback deeper than resolved matches are kept for)
+                logger.warn("Order match %s completed, but not found in btc_order_matches: not booking its trade"
+                            % msg_data['order_match_id'])
+                return
         else:
             assert msg_data['status'] == 'completed'  # should not enter a pending state for non BTC matches
             order_match = msg_data
 
-        forward_asset_info = config.mongo_db.tracked_assets.find_one({'asset': order_match['forward_asset']})
-        backward_asset_info = config.mongo_db.tracked_assets.find_one({'asset': order_match['backward_asset']})
+        forward_asset_info = asset_registry.get(order_match['forward_asset'])
+        backward_asset_info = asset_registry.get(order_match['backward_asset'])
         assert forward_asset_info and backward_asset_info
         base_asset, quote_asset = util.assets_to_asset_pair(order_match['forward_asset'], order_match['backward_asset'])
 
@@ -570,8 +458,8 @@ def parse_trade_book(msg, msg_data):
             return 'ABORT_THIS_MESSAGE_PROCESSING'
 
         # take divisible trade quantities to floating point
-        forward_quantity = blockchain.normalize_quantity(order_match['forward_quantity'], forward_asset_info['divisible'])
-        backward_quantity = blockchain.normalize_quantity(order_match['backward_quantity'], backward_asset_info['divisible'])
+        forward_quantity = blockchain.normalize_quantity(order_match['forward_quantity'], forward_asset_info.divisible)
+        backward_quantity = blockchain.normalize_quantity(order_match['backward_quantity'], backward_asset_info.divisible)
 
         # compose trade
         trade = {
@@ -590,58 +478,167 @@ def parse_trade_book(msg, msg_data):
             'base_quantity_normalized': forward_quantity if order_match['forward_asset'] == base_asset else backward_quantity,
             'quote_quantity_normalized': backward_quantity if order_match['forward_asset'] == base_asset else forward_quantity,
         }
-        d = D(trade['quote_quantity_normalized']) / D(trade['base_quantity_normalized'])
-        d = d.quantize(EIGHT_PLACES, rounding=decimal.ROUND_HALF_EVEN, context=decimal.Context(prec=30))
-        trade['unit_price'] = float(d)
-
-        d = D(trade['base_quantity_normalized']) / D(trade['quote_quantity_normalized'])
-        d = d.quantize(EIGHT_PLACES, rounding=decimal.ROUND_HALF_EVEN, context=decimal.Context(prec=30))
-        trade['unit_price_inverse'] = float(d)
+        unit_price = numeric.unit_price(
+            trade['base_quantity'], trade['quote_quantity'],
+            asset_registry.is_divisible(base_asset), asset_registry.is_divisible(quote_asset))
+        trade['unit_price'] = numeric.to_float(unit_price)
+        trade['unit_price_inverse'] = numeric.to_float(1 / unit_price)
 
         config.mongo_db.trades.insert(trade)
+        candles.add_trade(trade)
+        market_windows.add_trade(trade)
+        assets_trading.add_trade(trade)
+        config.mongo_db.market_summaries.update(
+            {'base_asset': base_asset, 'quote_asset': quote_asset}, {"$inc": {'volume': trade['quote_quantity'], 'base_volume': trade['base_quantity']}}, upsert=True)
+        market_summary_pairs.add((base_asset, quote_asset))
         logger.info("Procesed Trade from tx %s :: %s" % (msg['message_index'], trade))
 
 
-@StartUpProcessor.subscribe()
-def init():
-    # init db and indexes
-    # trades
-    config.mongo_db.trades.ensure_index(
-        [("base_asset", pymongo.ASCENDING),
-         ("quote_asset", pymongo.ASCENDING),
-         ("block_time", pymongo.DESCENDING)
-         ])
-    config.mongo_db.trades.ensure_index(  # tasks.py and elsewhere (for singlular block_index index access)
-        [("block_index", pymongo.ASCENDING),
-         ("base_asset", pymongo.ASCENDING),
-         ("quote_asset", pymongo.ASCENDING)
-         ])
-    # asset_market_info
-    config.mongo_db.asset_market_info.ensure_index('asset', unique=True)
-    # asset_marketcap_history
-    config.mongo_db.asset_marketcap_history.ensure_index('block_index')
-    config.mongo_db.asset_marketcap_history.ensure_index(  # tasks.py
-        [
-            ("market_cap_as", pymongo.ASCENDING),
-            ("asset", pymongo.ASCENDING),
-            ("block_index", pymongo.DESCENDING)
-        ])
-    config.mongo_db.asset_marketcap_history.ensure_index(  # api.py
-        [
-            ("market_cap_as", pymongo.ASCENDING),
-            ("block_time", pymongo.DESCENDING)
-        ])
-    # asset_pair_market_info
-    config.mongo_db.asset_pair_market_info.ensure_index(  # event.py, api.py
-        [("base_asset", pymongo.ASCENDING),
-         ("quote_asset", pymongo.ASCENDING)
-         ], unique=True)
-    config.mongo_db.asset_pair_market_info.ensure_index('last_updated')
+@MessageProcessor.subscribe(priority=DEX_PRIORITY_PARSE_TRADEBOOK)
+def parse_btc_order_matches(msg, msg_data):
+    # keep the pending (i.e. BTC) order matches, for parse_trade_book to book them once they are completed. Resolved
+    # matches are kept for a few blocks, in case the block resolving them is rolled back
+    if msg['category'] != 'order_matches':
+        return
+    if msg['command'] == 'insert':
+        if msg_data['status'] == 'pending':
+            order_match = {field: msg_data[field] for field in BTC_ORDER_MATCH_FIELDS}
+            order_match['order_match_id'] = msg_data['id']
+            order_match['block_index'] = config.state['cur_block']['block_index']
+            order_match['resolved_block_index'] = None
+            config.mongo_db.btc_order_matches.insert(order_match)
+    elif msg_data['status'] != 'pending':
+        config.mongo_db.btc_order_matches.update(
+            {'order_match_id': msg_data['order_match_id'], 'resolved_block_index': None},
+            {"$set": {'resolved_block_index': config.state['cur_block']['block_index']}})
+
+
+@MessageProcessor.subscribe(priority=DEX_PRIORITY_PARSE_TRADEBOOK)
+def parse_order_book(msg, msg_data):
+    if msg['category'] in ['orders', 'cancels', 'order_expirations']:
+        order_book.process_message(msg, msg_data)
+
+
+@MessageProcessor.subscribe(priority=DEX_PRIORITY_PARSE_TRADEBOOK)
+def parse_supply_change(msg, msg_data):
+    if msg['category'] in ['issuances', 'destructions'] and msg_data.get('status', 'valid') == 'valid':
+        market_summary_supply_changed_assets.add(msg_data['asset'])
+
+
+@BlockProcessor.subscribe()
+def refresh_market_summaries():
+    dex.update_market_summaries(
+        market_summary_pairs, market_summary_supply_changed_assets,
+        config.state['cur_block']['block_index'], config.state['cur_block']['block_time_obj'])
+    market_summary_pairs.clear()
+    market_summary_supply_changed_assets.clear()
+
+
+@BlockProcessor.subscribe()
+def fetch_reopened_orders():
+    if order_book.reopened_orders:
+        start_task(order_book.fetch_reopened_orders)
+
+
+@BlockProcessor.subscribe()
+def prune_btc_order_matches():
+    config.mongo_db.btc_order_matches.remove({'resolved_block_index': {
+        "$lt": config.state['cur_block']['block_index'] - config.MAX_FORCED_REORG_NUM_BLOCKS}})
+
+
+@BlockProcessor.subscribe()
+def publish_market_windows():
+    market_windows.process_block(config.state['cur_block']['block_time_obj'])
+
+    # update the asset_pair_market_info of the pairs whose order book or 24h trades changed with this block (once both
+    # the order book and the trade windows are loaded, and with all the pairs recomputed after they were (re)loaded)
+    if not order_book.state['loaded'] or not market_windows.state['loaded']:
+        return
+    if pair_market_info_state['refresh_all']:
+        pairs = assets_trading.get_asset_pair_market_info_pairs()
+        pair_market_info_state['refresh_all'] = False
+    else:
+        pairs = order_book.changed_pairs | market_windows.changed_pairs
+    order_book.changed_pairs.clear()
+    market_windows.changed_pairs.clear()
+    assets_trading.update_asset_pair_market_info(pairs, config.state['cur_block']['block_time_obj'])
+
+
+# trades
+database.register_index('trades', [
+    ("base_asset", pymongo.ASCENDING),
+    ("quote_asset", pymongo.ASCENDING),
+    ("block_time", pymongo.DESCENDING)
+])
+database.register_index('trades', [  # tasks.py and elsewhere (for singlular block_index index access)
+    ("block_index", pymongo.ASCENDING),
+    ("base_asset", pymongo.ASCENDING),
+    ("quote_asset", pymongo.ASCENDING)
+])
+database.register_index('trades', [  # dex.py (last trades of a pair)
+    ("base_asset", pymongo.ASCENDING),
+    ("quote_asset", pymongo.ASCENDING),
+    ("block_index", pymongo.DESCENDING),
+    ("message_index", pymongo.DESCENDING)
+])
+database.register_index('trades', 'block_time')  # assets_trading.py, market_windows.py (24h/7d stats)
+database.register_query_shape('trades', {'base_asset': config.XCP, 'quote_asset': config.BTC, 'block_time': {'$lt': datetime.datetime(2016, 1, 1)}}, [('block_time', pymongo.DESCENDING)])
+database.register_query_shape('trades', {'block_time': {'$gte': datetime.datetime(2016, 1, 1)}})
+database.register_query_shape('trades', {'block_index': {'$gt': 0}}, [('block_index', pymongo.ASCENDING)])
+# trade_candles
+database.register_index('trade_candles', [
+    ("base_asset", pymongo.ASCENDING),
+    ("quote_asset", pymongo.ASCENDING),
+    ("interval", pymongo.ASCENDING),
+    ("interval_time", pymongo.ASCENDING)
+], unique=True)
+database.register_index('trade_candles', 'last_block_index')  # candles.py (rollbacks)
+# asset_market_info
+database.register_index('asset_market_info', 'asset', unique=True)
+# market_info_leaderboard
+database.register_index('market_info_leaderboard', [
+    ("market", pymongo.ASCENDING),
+    ("rank", pymongo.ASCENDING)
+], unique=True)
+database.register_index('market_info_leaderboard', 'asset')  # market_windows.py
+# asset_marketcap_history
+database.register_index('asset_marketcap_history', 'block_index')
+database.register_index('asset_marketcap_history', [  # tasks.py
+    ("market_cap_as", pymongo.ASCENDING),
+    ("asset", pymongo.ASCENDING),
+    ("block_index", pymongo.DESCENDING)
+])
+database.register_index('asset_marketcap_history', [  # api.py
+    ("market_cap_as", pymongo.ASCENDING),
+    ("block_time", pymongo.DESCENDING)
+])
+# asset_pair_market_info
+database.register_index('asset_pair_market_info', [  # event.py, api.py
+    ("base_asset", pymongo.ASCENDING),
+    ("quote_asset", pymongo.ASCENDING)
+], unique=True)
+# market_summaries
+database.register_index('market_summaries', [
+    ("base_asset", pymongo.ASCENDING),
+    ("quote_asset", pymongo.ASCENDING)
+], unique=True)
+database.register_index('market_summaries', 'window_changes_at')
+database.register_index('market_summaries', 'block_index')  # for rollbacks
+for field in ['volume_24h', 'volume', 'price', 'progression', 'supply', 'market_cap']:  # dex.py (get_markets_list, get_pairs)
+    database.register_index('market_summaries', [
+        ("quote_asset", pymongo.ASCENDING),
+        (field, pymongo.DESCENDING)
+    ])
+database.register_index('asset_pair_market_info', 'completed_trades_count')
+# btc_order_matches
+database.register_index('btc_order_matches', 'order_match_id', unique=True)
+database.register_index('btc_order_matches', 'block_index')
+database.register_index('btc_order_matches', 'resolved_block_index')
 
 
 @CaughtUpProcessor.subscribe()
 def start_tasks():
-    start_task(task_compile_asset_pair_market_info)
+    start_task(order_book.ensure_loaded)
     start_task(task_compile_asset_market_info)
 
 
@@ -650,8 +647,45 @@ def process_rollback(max_block_index):
     if not max_block_index:  # full reparse
         config.mongo_db.trades.drop()
         config.mongo_db.asset_market_info.drop()
+        config.mongo_db.market_info_leaderboard.drop()
         config.mongo_db.asset_marketcap_history.drop()
         config.mongo_db.pair_market_info.drop()
+        config.mongo_db.market_summaries.drop()
+        config.mongo_db.trade_candles.drop()
+        config.mongo_db.btc_order_matches.drop()
     else:  # rollback
         config.mongo_db.trades.remove({"block_index": {"$gt": max_block_index}})
+        candles.process_rollback(max_block_index)
+        config.mongo_db.btc_order_matches.remove({'block_index': {"$gt": max_block_index}})
+        config.mongo_db.btc_order_matches.update(
+            {'resolved_block_index': {"$gt": max_block_index}}, {"$set": {'resolved_block_index': None}}, multi=True)
         config.mongo_db.asset_marketcap_history.remove({"block_index": {"$gt": max_block_index}})
+        # have the market cap history of the rolled back blocks compiled again
+        config.mongo_db.app_config.update(
+            {'last_block_assets_compiled': {"$gt": max_block_index}}, {"$set": {'last_block_assets_compiled': max_block_index}})
+
+        # the market summaries computed after the block we are pruning back to (as of a later block time, with trades
+        # or supply changes since rolled back) have their total volumes recomputed, and are refreshed with the next
+        # block processed (along with any summary from before summaries recorded their block)
+        for summary in config.mongo_db.market_summaries.find(
+                {'$or': [{'block_index': {'$gt': max_block_index}}, {'block_index': {'$exists': False}}]},
+                {'_id': 0, 'base_asset': 1, 'quote_asset': 1}):
+            pair_query = {'base_asset': summary['base_asset'], 'quote_asset': summary['quote_asset']}
+            volume = list(config.mongo_db.trades.aggregate([
+                {"$match": pair_query},
+                {"$group": {"_id": None, "volume": {"$sum": "$quote_quantity"}, "base_volume": {"$sum": "$base_quantity"}}}
+            ]))
+            config.mongo_db.market_summaries.update(pair_query, {"$set": {
+                'volume': volume[0]['volume'] if volume else 0,
+                'base_volume': volume[0]['base_volume'] if volume else 0,
+                'window_changes_at': datetime.datetime(1970, 1, 1)}})
+    market_summary_pairs.clear()
+    market_summary_supply_changed_assets.clear()
+    market_windows.clear()  # reloaded with the next block processed
+    assets_trading.process_rollback(max_block_index)
+    pair_market_info_state['refresh_all'] = True
+
+    # the order book is reloaded from counterparty-server (which has already rolled back on its end)
+    order_book.clear()
+    if config.state['caught_up']:
+        start_task(order_book.ensure_loaded)
@@ -6,17 +6,26 @@ import logging
 import datetime
 import time
 import copy
+import collections
 import decimal
 import cgi
-import calendar
 
 import pymongo
 
-from counterblock.lib import config, database, util, blockchain
+from counterblock.lib import config, database, util, asset_registry, blockchain
+from . import market_windows, order_book
 
 D = decimal.Decimal
 logger = logging.getLogger(__name__)
 
+PRICE_BUFFER_SIZE = 30  # the number of last trades kept per pair (the max with_last_trades of get_market_price_summary)
+LEADERBOARD_MAX_RANKS = 100  # the number of top ranks kept per market (the max limit of get_market_info_leaderboard)
+TRADE_POINT_FIELDS = ['block_index', 'message_index', 'block_time', 'unit_price', 'base_quantity_normalized', 'quote_quantity_normalized']
+TRADE_POINT_PROJECTION = dict([('_id', 0)] + [(field, 1) for field in TRADE_POINT_FIELDS])
+TradePoint = collections.namedtuple('TradePoint', TRADE_POINT_FIELDS)
+
+pair_price_states = {}  # (base_asset, quote_asset) -> PairPriceState of the pair's last PRICE_BUFFER_SIZE trades
+
 
 def get_market_price(price_data, vol_data):
     assert len(price_data) == len(vol_data)
@@ -25,41 +34,98 @@ def get_market_price(price_data, vol_data):
     return market_price
 
 
+class PairPriceState(object):
+    """A ring buffer of the last trades of an asset pair (as TradePoint records, oldest first), to derive the pair's
+    market price from without going through the trades collection"""
+    __slots__ = ('trades',)
+
+    def __init__(self, base_asset, quote_asset, max_block_index=None, size=config.MARKET_PRICE_DERIVE_NUM_POINTS):
+        query = {'base_asset': base_asset, 'quote_asset': quote_asset}
+        if max_block_index is not None:
+            query['block_index'] = {"$lte": max_block_index}
+        last_trades = list(config.mongo_db.trades.find(
+            query, TRADE_POINT_PROJECTION
+        ).sort([("block_index", pymongo.DESCENDING), ("message_index", pymongo.DESCENDING)]).limit(size))
+        self.trades = collections.deque(maxlen=size)
+        for t in reversed(last_trades):
+            self.add_trade(t)
+
+    def add_trade(self, t):
+        if self.trades and (self.trades[-1].block_index, self.trades[-1].message_index) >= (t['block_index'], t['message_index']):
+            return  # already in the buffer (e.g. booked while the buffer was being seeded)
+        self.trades.append(TradePoint(*[t[field] for field in TRADE_POINT_FIELDS]))
+
+    def get_last_trades(self, start_dt, end_dt=None):
+        return [p for p in self.trades if p.block_time >= start_dt and (end_dt is None or p.block_time <= end_dt)]
+
+    def get_market_price(self, end_dt):
+        """Returns the market price as of end_dt (out of the trades of the 10 days before it), or None"""
+        last_trades = self.get_last_trades(end_dt - datetime.timedelta(days=10), end_dt)[-config.MARKET_PRICE_DERIVE_NUM_POINTS:]
+        return util.weighted_average([(p.unit_price, p.base_quantity_normalized + p.quote_quantity_normalized)
+                                      for p in last_trades]) if last_trades else None
+
+
+def get_pair_price_state(base_asset, quote_asset):
+    """Returns the buffer of the last trades of the given pair (seeded out of the trades collection on first use, and
+    then fed the pair's new trades)"""
+    state = pair_price_states.get((base_asset, quote_asset), None)
+    if state is None:
+        state = pair_price_states[(base_asset, quote_asset)] = PairPriceState(base_asset, quote_asset, size=PRICE_BUFFER_SIZE)
+    return state
+
+
+def add_trade(trade):
+    state = pair_price_states.get((trade['base_asset'], trade['quote_asset']), None)
+    if state is not None:
+        state.add_trade(trade)
+
+
+def process_rollback(max_block_index):
+    """Drops the buffers that hold trades from after the given block (or all of them, on a full reparse)"""
+    for pair, state in list(pair_price_states.items()):
+        if not max_block_index or (state.trades and state.trades[-1].block_index > max_block_index):
+            del pair_price_states[pair]
+
+
 def get_market_price_summary(asset1, asset2, with_last_trades=0, start_dt=None, end_dt=None):
     """Gets a synthesized trading "market price" for a specified asset pair (if available), as well as additional info.
-    If no price is available, False is returned.
+    If no price is available, False is returned. Unless a (historical) end_dt is given, this is answered out of the
+    pair's buffer of last trades.
     """
-    if not end_dt:
-        end_dt = datetime.datetime.utcnow()
-    if not start_dt:
-        start_dt = end_dt - datetime.timedelta(days=10)  # default to 10 days in the past
-
     # look for the last max 6 trades within the past 10 day window
     base_asset, quote_asset = util.assets_to_asset_pair(asset1, asset2)
-    base_asset_info = config.mongo_db.tracked_assets.find_one({'asset': base_asset})
-    quote_asset_info = config.mongo_db.tracked_assets.find_one({'asset': quote_asset})
+    base_asset_info = asset_registry.get(base_asset)
+    quote_asset_info = asset_registry.get(quote_asset)
 
-    if not isinstance(with_last_trades, int) or with_last_trades < 0 or with_last_trades > 30:
+    if not isinstance(with_last_trades, int) or with_last_trades < 0 or with_last_trades > PRICE_BUFFER_SIZE:
         raise Exception("Invalid with_last_trades")
 
     if not base_asset_info or not quote_asset_info:
         raise Exception("Invalid asset(s)")
 
-    last_trades = config.mongo_db.trades.find({
-        "base_asset": base_asset,
-        "quote_asset": quote_asset,
-        'block_time': {"$gte": start_dt, "$lte": end_dt}
-    },
-        {'_id': 0, 'block_index': 1, 'block_time': 1, 'unit_price': 1, 'base_quantity_normalized': 1, 'quote_quantity_normalized': 1}
-    ).sort("block_time", pymongo.DESCENDING).limit(max(config.MARKET_PRICE_DERIVE_NUM_POINTS, with_last_trades))
-    if not last_trades.count():
+    num_trades = max(config.MARKET_PRICE_DERIVE_NUM_POINTS, with_last_trades)
+    if not end_dt:
+        if not start_dt:
+            start_dt = datetime.datetime.utcnow() - datetime.timedelta(days=10)  # default to 10 days in the past
+        last_trades = get_pair_price_state(base_asset, quote_asset).get_last_trades(start_dt)[-num_trades:]
+    else:
+        if not start_dt:
+            start_dt = end_dt - datetime.timedelta(days=10)  # default to 10 days in the past
+        last_trades = list(config.mongo_db.trades.find({
+            "base_asset": base_asset,
+            "quote_asset": quote_asset,
+            'block_time': {"$gte": start_dt, "$lte": end_dt}
+        }, TRADE_POINT_PROJECTION
+        ).sort([("block_index", pymongo.DESCENDING), ("message_index", pymongo.DESCENDING)]).limit(num_trades))
+        last_trades = [TradePoint(*[t[field] for field in TRADE_POINT_FIELDS]) for t in reversed(last_trades)]  # oldest first
+    if not last_trades:
         return None  # no suitable trade data to form a market price (return None, NOT False here)
-    last_trades = list(last_trades)
-    last_trades.reverse()  # from newest to oldest
 
+    # the market price is derived from the (up to) MARKET_PRICE_DERIVE_NUM_POINTS latest trades
+    price_trades = last_trades[-config.MARKET_PRICE_DERIVE_NUM_POINTS:]
     market_price = get_market_price(
-        [last_trades[i]['unit_price'] for i in range(min(len(last_trades), config.MARKET_PRICE_DERIVE_NUM_POINTS))],
-        [(last_trades[i]['base_quantity_normalized'] + last_trades[i]['quote_quantity_normalized']) for i in range(min(len(last_trades), config.MARKET_PRICE_DERIVE_NUM_POINTS))])
+        [p.unit_price for p in price_trades],
+        [p.base_quantity_normalized + p.quote_quantity_normalized for p in price_trades])
     result = {
         'market_price': float(D(market_price)),
         'base_asset': base_asset,
@@ -68,12 +134,12 @@ def get_market_price_summary(asset1, asset2, with_last_trades=0, start_dt=None,
     if with_last_trades:
         #[0]=block_time, [1]=unit_price, [2]=base_quantity_normalized, [3]=quote_quantity_normalized, [4]=block_index
         result['last_trades'] = [[
-            t['block_time'],
-            t['unit_price'],
-            t['base_quantity_normalized'],
-            t['quote_quantity_normalized'],
-            t['block_index']
-        ] for t in last_trades]
+            p.block_time,
+            p.unit_price,
+            p.base_quantity_normalized,
+            p.quote_quantity_normalized,
+            p.block_index
+        ] for p in last_trades]
     else:
         result['last_trades'] = []
     return result
@@ -99,13 +165,10 @@ def get_asset_info(asset, at_dt=None):
 
     if asset not in (config.XCP, config.BTC) and at_dt and asset_info['_at_block_time'] > at_dt:
         # get the asset info at or before the given at_dt datetime
-        for e in reversed(asset_info['_history']):  # newest to oldest
-            if e['_at_block_time'] <= at_dt:
-                asset_info = e
-                break
-        else:  # asset was created AFTER at_dt
-            asset_info = None
-        if asset_info is None:
+        asset_info = config.mongo_db.tracked_asset_versions.find_one(
+            {'asset': asset, '_at_block_time': {"$lte": at_dt}},
+            sort=[("_at_block", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+        if asset_info is None:  # asset was created AFTER at_dt
             return None
         assert asset_info['_at_block_time'] <= at_dt
 
@@ -122,7 +185,7 @@ def get_asset_info(asset, at_dt=None):
         # BUG: this does not take end_dt (if specified) into account. however, the deviation won't be too big
         # as XCP doesn't deflate quickly at all, and shouldn't matter that much since there weren't any/much trades
         # before the end of the burn period (which is what is involved with how we use at_dt with currently)
-        asset_info['total_issued'] = util.call_jsonrpc_api("get_supply", {'asset': config.XCP}, abort_on_error=True)['result']
+        asset_info['total_issued'] = blockchain.get_xcp_supply(normalize=False)
         asset_info['total_issued_normalized'] = blockchain.normalize_quantity(asset_info['total_issued'])
     if not asset_info:
         raise Exception("Invalid asset: %s" % asset)
@@ -217,276 +280,26 @@ def compile_summary_market_info(asset, mps_xcp_btc, xcp_btc_price, btc_xcp_price
     }
 
 
-def compile_24h_market_info(asset):
-    asset_data = {}
-    start_dt_1d = datetime.datetime.utcnow() - datetime.timedelta(days=1)
-
-    # perform aggregation to get 24h statistics
-    # TOTAL volume and count across all trades for the asset (on ALL markets, not just XCP and BTC pairings)
-    _24h_vols = {'vol': 0, 'count': 0}
-    _24h_vols_as_base = config.mongo_db.trades.aggregate([
-        {"$match": {
-            "base_asset": asset,
-            "block_time": {"$gte": start_dt_1d}}},
-        {"$project": {
-            "base_quantity_normalized": 1  # to derive volume
-        }},
-        {"$group": {
-            "_id":   1,
-            "vol":   {"$sum": "$base_quantity_normalized"},
-            "count": {"$sum": 1},
-        }}
-    ])
-    _24h_vols_as_base = list(_24h_vols_as_base)
-    _24h_vols_as_base = {} if not len(_24h_vols_as_base) else _24h_vols_as_base[0]
-    _24h_vols_as_quote = config.mongo_db.trades.aggregate([
-        {"$match": {
-            "quote_asset": asset,
-            "block_time": {"$gte": start_dt_1d}}},
-        {"$project": {
-            "quote_quantity_normalized": 1  # to derive volume
-        }},
-        {"$group": {
-            "_id":   1,
-            "vol":   {"$sum": "quote_quantity_normalized"},
-            "count": {"$sum": 1},
-        }}
-    ])
-    _24h_vols_as_quote = list(_24h_vols_as_quote)
-    _24h_vols_as_quote = {} if not len(_24h_vols_as_quote) else _24h_vols_as_quote[0]
-    _24h_vols['vol'] = _24h_vols_as_base.get('vol', 0) + _24h_vols_as_quote.get('vol', 0)
-    _24h_vols['count'] = _24h_vols_as_base.get('count', 0) + _24h_vols_as_quote.get('count', 0)
-
-    # XCP market volume with stats
-    if asset != config.XCP:
-        _24h_ohlc_in_xcp = config.mongo_db.trades.aggregate(
-            [{"$match": {
-                "base_asset": config.XCP,
-                "quote_asset": asset,
-                "block_time": {"$gte": start_dt_1d}}},
-             {"$project": {
-                 "unit_price": 1,
-                 "base_quantity_normalized": 1  # to derive volume
-             }},
-                {"$group": {
-                    "_id":   1,
-                    "open":  {"$first": "$unit_price"},
-                    "high":  {"$max": "$unit_price"},
-                    "low":   {"$min": "$unit_price"},
-                    "close": {"$last": "$unit_price"},
-                    "vol":   {"$sum": "$base_quantity_normalized"},
-                    "count": {"$sum": 1},
-                }}
-             ])
-        _24h_ohlc_in_xcp = list(_24h_ohlc_in_xcp)
-        _24h_ohlc_in_xcp = {} if not len(_24h_ohlc_in_xcp) else _24h_ohlc_in_xcp[0]
-        if _24h_ohlc_in_xcp:
-            del _24h_ohlc_in_xcp['_id']
-    else:
-        _24h_ohlc_in_xcp = {}
-
-    # BTC market volume with stats
-    if asset != config.BTC:
-        _24h_ohlc_in_btc = config.mongo_db.trades.aggregate([
-            {"$match": {
-                "base_asset": config.BTC,
-                "quote_asset": asset,
-                "block_time": {"$gte": start_dt_1d}}},
-            {"$project": {
-                "unit_price": 1,
-                "base_quantity_normalized": 1  # to derive volume
-            }},
-            {"$group": {
-                "_id":   1,
-                "open":  {"$first": "$unit_price"},
-                "high":  {"$max": "$unit_price"},
-                "low":   {"$min": "$unit_price"},
-                "close": {"$last": "$unit_price"},
-                "vol":   {"$sum": "$base_quantity_normalized"},
-                "count": {"$sum": 1},
-            }}
-        ])
-        _24h_ohlc_in_btc = list(_24h_ohlc_in_btc)
-        _24h_ohlc_in_btc = {} if not len(_24h_ohlc_in_btc) else _24h_ohlc_in_btc[0]
-        if _24h_ohlc_in_btc:
-            del _24h_ohlc_in_btc['_id']
-    else:
-        _24h_ohlc_in_btc = {}
-
-    return {
-        '24h_summary': _24h_vols,
-        #^ total quantity traded of that asset in all markets in last 24h
-        '24h_ohlc_in_{}'.format(config.XCP.lower()): _24h_ohlc_in_xcp,
-        #^ quantity of asset traded with BTC in last 24h
-        '24h_ohlc_in_{}'.format(config.BTC.lower()): _24h_ohlc_in_btc,
-        #^ quantity of asset traded with XCP in last 24h
-        '24h_vol_price_change_in_{}'.format(config.XCP.lower()): calc_price_change(_24h_ohlc_in_xcp['open'], _24h_ohlc_in_xcp['close'])
-        if _24h_ohlc_in_xcp else None,
-        #^ aggregated price change from 24h ago to now, expressed as a signed float (e.g. .54 is +54%, -1.12 is -112%)
-        '24h_vol_price_change_in_{}'.format(config.BTC.lower()): calc_price_change(_24h_ohlc_in_btc['open'], _24h_ohlc_in_btc['close'])
-        if _24h_ohlc_in_btc else None,
-    }
-
-
-def compile_7d_market_info(asset):
-    start_dt_7d = datetime.datetime.utcnow() - datetime.timedelta(days=7)
-
-    # get XCP and BTC market summarized trades over a 7d period (quantize to hour long slots)
-    _7d_history_in_xcp = None  # xcp/asset market (or xcp/btc for xcp or btc)
-    _7d_history_in_btc = None  # btc/asset market (or btc/xcp for xcp or btc)
-    if asset not in [config.BTC, config.XCP]:
-        for a in [config.XCP, config.BTC]:
-            _7d_history = config.mongo_db.trades.aggregate([
-                {"$match": {
-                    "base_asset": a,
-                    "quote_asset": asset,
-                    "block_time": {"$gte": start_dt_7d}
-                }},
-                {"$project": {
-                    "year":  {"$year": "$block_time"},
-                    "month": {"$month": "$block_time"},
-                    "day":   {"$dayOfMonth": "$block_time"},
-                    "hour":  {"$hour": "$block_time"},
-                    "unit_price": 1,
-                    "base_quantity_normalized": 1  # to derive volume
-                }},
-                {"$sort": {"block_time": pymongo.ASCENDING}},
-                {"$group": {
-                    "_id":   {"year": "$year", "month": "$month", "day": "$day", "hour": "$hour"},
-                    "price": {"$avg": "$unit_price"},
-                    "vol":   {"$sum": "$base_quantity_normalized"},
-                }},
-            ])
-            _7d_history = list(_7d_history)
-            if a == config.XCP:
-                _7d_history_in_xcp = _7d_history
-            else:
-                _7d_history_in_btc = _7d_history
-    else:  # get the XCP/BTC market and invert for BTC/XCP (_7d_history_in_btc)
-        _7d_history = config.mongo_db.trades.aggregate([
-            {"$match": {
-                "base_asset": config.XCP,
-                "quote_asset": config.BTC,
-                "block_time": {"$gte": start_dt_7d}
-            }},
-            {"$project": {
-                "year":  {"$year": "$block_time"},
-                "month": {"$month": "$block_time"},
-                "day":   {"$dayOfMonth": "$block_time"},
-                "hour":  {"$hour": "$block_time"},
-                "unit_price": 1,
-                "base_quantity_normalized": 1  # to derive volume
-            }},
-            {"$sort": {"block_time": pymongo.ASCENDING}},
-            {"$group": {
-                "_id":   {"year": "$year", "month": "$month", "day": "$day", "hour": "$hour"},
-                "price": {"$avg": "$unit_price"},
-                "vol":   {"$sum": "$base_quantity_normalized"},
-            }},
-        ])
-        _7d_history_in_xcp = list(_7d_history)
-        _7d_history_in_btc = copy.deepcopy(_7d_history_in_xcp)
-        for i in range(len(_7d_history_in_btc)):
-            _7d_history_in_btc[i]['price'] = calc_inverse(_7d_history_in_btc[i]['price'])
-            _7d_history_in_btc[i]['vol'] = calc_inverse(_7d_history_in_btc[i]['vol'])
-
-    for l in [_7d_history_in_xcp, _7d_history_in_btc]:
-        for e in l:  # convert our _id field out to be an epoch ts (in ms), and delete _id
-            e['when'] = calendar.timegm(datetime.datetime(e['_id']['year'], e['_id']['month'], e['_id']['day'], e['_id']['hour']).timetuple()) * 1000
-            del e['_id']
-
-    return {
-        '7d_history_in_{}'.format(config.XCP.lower()): [[e['when'], e['price']] for e in _7d_history_in_xcp],
-        '7d_history_in_{}'.format(config.BTC.lower()): [[e['when'], e['price']] for e in _7d_history_in_btc],
-    }
-
-
-def compile_asset_pair_market_info():
-    """Compiles the pair-level statistics that show on the View Prices page of counterwallet, for instance"""
-    # loop through all open orders, and compile a listing of pairs, with a count of open orders for each pair
-    end_dt = datetime.datetime.utcnow()
-    start_dt = end_dt - datetime.timedelta(days=1)
-    start_block_index, end_block_index = database.get_block_indexes_for_dates(start_dt=start_dt, end_dt=end_dt)
-    open_orders = util.call_jsonrpc_api(
-        "get_orders",
-        {'filters': [
-            {'field': 'give_remaining', 'op': '>', 'value': 0},
-            {'field': 'get_remaining', 'op': '>', 'value': 0},
-            {'field': 'fee_required_remaining', 'op': '>=', 'value': 0},
-            {'field': 'fee_provided_remaining', 'op': '>=', 'value': 0},
-        ],
-            'status': 'open',
-            'show_expired': False,
-        }, abort_on_error=True)['result']
-    pair_data = {}
-    asset_info = {}
-
-    def get_price(base_quantity_normalized, quote_quantity_normalized):
-        return float(D(quote_quantity_normalized / base_quantity_normalized))
-
-    # COMPOSE order depth, lowest ask, and highest bid column data
-    for o in open_orders:
-        (base_asset, quote_asset) = util.assets_to_asset_pair(o['give_asset'], o['get_asset'])
-        pair = '%s/%s' % (base_asset, quote_asset)
-        base_asset_info = asset_info.get(base_asset, config.mongo_db.tracked_assets.find_one({'asset': base_asset}))
-        if base_asset not in asset_info:
-            asset_info[base_asset] = base_asset_info
-        quote_asset_info = asset_info.get(quote_asset, config.mongo_db.tracked_assets.find_one({'asset': quote_asset}))
-        if quote_asset not in asset_info:
-            asset_info[quote_asset] = quote_asset_info
-
-        pair_data.setdefault(
-            pair,
-            {'open_orders_count': 0, 'lowest_ask': None, 'highest_bid': None,
-             'completed_trades_count': 0, 'vol_base': 0, 'vol_quote': 0})
-        #^ highest ask = open order selling base, highest bid = open order buying base
-        #^ we also initialize completed_trades_count, vol_base, vol_quote because every pair inited here may
-        # not have cooresponding data out of the trades_data_by_pair aggregation below
-        pair_data[pair]['open_orders_count'] += 1
-        base_quantity_normalized = blockchain.normalize_quantity(o['give_quantity'] if base_asset == o['give_asset'] else o['get_quantity'], base_asset_info['divisible'])
-        quote_quantity_normalized = blockchain.normalize_quantity(o['give_quantity'] if quote_asset == o['give_asset'] else o['get_quantity'], quote_asset_info['divisible'])
-        order_price = get_price(base_quantity_normalized, quote_quantity_normalized)
-        if base_asset == o['give_asset']:  # selling base
-            if pair_data[pair]['lowest_ask'] is None or order_price < pair_data[pair]['lowest_ask']:
-                pair_data[pair]['lowest_ask'] = order_price
-        elif base_asset == o['get_asset']:  # buying base
-            if pair_data[pair]['highest_bid'] is None or order_price > pair_data[pair]['highest_bid']:
-                pair_data[pair]['highest_bid'] = order_price
-
-    # COMPOSE volume data (in XCP and BTC), and % change data
-    # loop through all trade volume over the past 24h, and match that to the open orders
-    trades_data_by_pair = config.mongo_db.trades.aggregate([
-        {"$match": {
-            "block_time": {"$gte": start_dt, "$lte": end_dt}}
-         },
-        {"$project": {
-            "base_asset": 1,
-            "quote_asset": 1,
-            "base_quantity_normalized": 1,  # to derive base volume
-            "quote_quantity_normalized": 1  # to derive quote volume
-        }},
-        {"$group": {
-            "_id":   {"base_asset": "$base_asset", "quote_asset": "$quote_asset"},
-            "vol_base":   {"$sum": "$base_quantity_normalized"},
-            "vol_quote":   {"$sum": "$quote_quantity_normalized"},
-            "count": {"$sum": 1},
-        }}
-    ])
-    for e in trades_data_by_pair:
-        pair = '%s/%s' % (e['_id']['base_asset'], e['_id']['quote_asset'])
-        pair_data.setdefault(pair, {'open_orders_count': 0, 'lowest_ask': None, 'highest_bid': None})
-        #^ initialize an empty pair in the event there are no open orders for that pair, but there ARE completed trades for it
-        pair_data[pair]['completed_trades_count'] = e['count']
-        pair_data[pair]['vol_base'] = e['vol_base']
-        pair_data[pair]['vol_quote'] = e['vol_quote']
-
-    # compose price data, relative to BTC and XCP
+def update_asset_pair_market_info(pairs, now):
+    """Updates the pair-level statistics that show on the View Prices page of counterwallet (for instance) of the given
+    pairs, out of their order book (open orders count, lowest ask and highest bid) and their 24h window of trades (see
+    market_windows.py). Pairs with neither open orders nor trades in the last 24h are removed."""
+    start_dt = now - datetime.timedelta(days=1)
     mps_xcp_btc, xcp_btc_price, btc_xcp_price = get_price_primitives()
-    for pair, e in pair_data.items():
-        base_asset, quote_asset = pair.split('/')
+    updated_pairs = []
+    for base_asset, quote_asset in pairs:
+        pair_query = {'base_asset': base_asset, 'quote_asset': quote_asset}
+        open_orders_count, lowest_ask, highest_bid = order_book.get_summary(base_asset, quote_asset)
+        e = market_windows.get_pair_stats(base_asset, quote_asset)
+        if not open_orders_count and not e['completed_trades_count']:
+            config.mongo_db.asset_pair_market_info.remove(pair_query)
+            continue
+        e.update({'open_orders_count': open_orders_count, 'lowest_ask': lowest_ask, 'highest_bid': highest_bid})
+        #^ lowest ask = open order selling base, highest bid = open order buying base
+
+        # derive asset price data, expressed in BTC and XCP, for the given volumes
         _24h_vol_in_btc = None
         _24h_vol_in_xcp = None
-        # derive asset price data, expressed in BTC and XCP, for the given volumes
         if base_asset == config.XCP:
             _24h_vol_in_xcp = e['vol_base']
             _24h_vol_in_btc = blockchain.round_out(e['vol_base'] * xcp_btc_price) if xcp_btc_price else 0
@@ -495,7 +308,7 @@ def compile_asset_pair_market_info():
             _24h_vol_in_btc = e['vol_base']
         else:  # base is not XCP or BTC
             price_summary_in_xcp, price_summary_in_btc, price_in_xcp, price_in_btc, aggregated_price_in_xcp, aggregated_price_in_btc = \
-                get_xcp_btc_price_info(base_asset, mps_xcp_btc, xcp_btc_price, btc_xcp_price, with_last_trades=0, start_dt=start_dt, end_dt=end_dt)
+                get_xcp_btc_price_info(base_asset, mps_xcp_btc, xcp_btc_price, btc_xcp_price, with_last_trades=0, start_dt=start_dt)
             if price_in_xcp:
                 _24h_vol_in_xcp = blockchain.round_out(e['vol_base'] * price_in_xcp)
             if price_in_btc:
@@ -504,37 +317,151 @@ def compile_asset_pair_market_info():
             if _24h_vol_in_xcp is None or _24h_vol_in_btc is None:
                 # the base asset didn't have price data against BTC or XCP, or both...try against the quote asset instead
                 price_summary_in_xcp, price_summary_in_btc, price_in_xcp, price_in_btc, aggregated_price_in_xcp, aggregated_price_in_btc = \
-                    get_xcp_btc_price_info(quote_asset, mps_xcp_btc, xcp_btc_price, btc_xcp_price, with_last_trades=0, start_dt=start_dt, end_dt=end_dt)
+                    get_xcp_btc_price_info(quote_asset, mps_xcp_btc, xcp_btc_price, btc_xcp_price, with_last_trades=0, start_dt=start_dt)
                 if _24h_vol_in_xcp is None and price_in_xcp:
                     _24h_vol_in_xcp = blockchain.round_out(e['vol_quote'] * price_in_xcp)
                 if _24h_vol_in_btc is None and price_in_btc:
                     _24h_vol_in_btc = blockchain.round_out(e['vol_quote'] * price_in_btc)
-            pair_data[pair]['24h_vol_in_{}'.format(config.XCP.lower())] = _24h_vol_in_xcp  # might still be None
-            pair_data[pair]['24h_vol_in_{}'.format(config.BTC.lower())] = _24h_vol_in_btc  # might still be None
-
-        # get % change stats -- start by getting the first trade directly before the 24h period starts
-        prev_trade = config.mongo_db.trades.find({
-            "base_asset": base_asset,
-            "quote_asset": quote_asset,
-            "block_time": {'$lt': start_dt}}).sort('block_time', pymongo.DESCENDING).limit(1)
-        latest_trade = config.mongo_db.trades.find({
-            "base_asset": base_asset,
-            "quote_asset": quote_asset}).sort('block_time', pymongo.DESCENDING).limit(1)
-        if not prev_trade.count():  # no previous trade before this 24hr period
-            pair_data[pair]['24h_pct_change'] = None
-        else:
-            prev_trade = prev_trade[0]
-            latest_trade = latest_trade[0]
-            prev_trade_price = get_price(prev_trade['base_quantity_normalized'], prev_trade['quote_quantity_normalized'])
-            latest_trade_price = get_price(latest_trade['base_quantity_normalized'], latest_trade['quote_quantity_normalized'])
-            pair_data[pair]['24h_pct_change'] = ((latest_trade_price - prev_trade_price) / prev_trade_price) * 100
-        pair_data[pair]['last_updated'] = end_dt
-        # print "PRODUCED", pair, pair_data[pair]
-        config.mongo_db.asset_pair_market_info.update({'base_asset': base_asset, 'quote_asset': quote_asset}, {"$set": pair_data[pair]}, upsert=True)
-
-    # remove any old pairs that were not just updated
-    config.mongo_db.asset_pair_market_info.remove({'last_updated': {'$lt': end_dt}})
-    logger.info("Recomposed 24h trade statistics for %i asset pairs: %s" % (len(pair_data), ', '.join(list(pair_data.keys()))))
+        e['24h_vol_in_{}'.format(config.XCP.lower())] = _24h_vol_in_xcp  # might still be None
+        e['24h_vol_in_{}'.format(config.BTC.lower())] = _24h_vol_in_btc  # might still be None
+        e['last_updated'] = now
+        config.mongo_db.asset_pair_market_info.update(pair_query, {"$set": e}, upsert=True)
+        updated_pairs.append('%s/%s' % (base_asset, quote_asset))
+    if updated_pairs:
+        logger.debug("Updated 24h trade statistics for %i asset pairs: %s" % (len(updated_pairs), ', '.join(updated_pairs)))
+
+
+def get_asset_pair_market_info_pairs():
+    """Returns the pairs to (re)compute the asset_pair_market_info of after the order book or the trade windows were
+    (re)loaded: the pairs with open orders or recent trades, and those with a (possibly stale) document"""
+    pairs = set(order_book.get_pairs()) | set(market_windows.get_pairs())
+    pairs.update((e['base_asset'], e['quote_asset']) for e in config.mongo_db.asset_pair_market_info.find(
+        {}, {'_id': 0, 'base_asset': 1, 'quote_asset': 1}))
+    return pairs
+
+
+def compile_market_cap_history(last_block_assets_compiled, current_block_index):
+    """Adds asset_marketcap_history points for the assets traded in the blocks after last_block_assets_compiled, in a
+    single pass over these trades (keeping the pairs' last trades, the assets' supply changes and their last market
+    caps in memory), with the new points written in bulk"""
+    pair_states = {}  # (base_asset, quote_asset) -> PairPriceState
+    supply_versions = {}  # asset -> list of (_at_block, total_issued_normalized), ordered by _at_block
+    last_market_caps = {}  # (asset, market_cap_as) -> last market cap in asset_marketcap_history
+
+    def get_pair_state(asset1, asset2):
+        pair = util.assets_to_asset_pair(asset1, asset2)
+        if pair not in pair_states:
+            pair_states[pair] = PairPriceState(pair[0], pair[1], last_block_assets_compiled)
+        return pair_states[pair]
+
+    def get_supply(asset, block_index):
+        if asset == config.XCP:  # (see get_asset_info for this not being the supply as of block_index)
+            return blockchain.get_xcp_supply(normalize=True)
+        elif asset == config.BTC:
+            return blockchain.get_btc_supply(normalize=True, at_block_index=block_index)
+        if asset not in supply_versions:
+            versions = list(config.mongo_db.tracked_asset_versions.find(
+                {'asset': asset, '_at_block': {"$gt": last_block_assets_compiled}},
+                {'_id': 0, '_at_block': 1, 'total_issued_normalized': 1}).sort([("_at_block", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]))
+            prev_version = config.mongo_db.tracked_asset_versions.find_one(
+                {'asset': asset, '_at_block': {"$lte": last_block_assets_compiled}},
+                {'_id': 0, '_at_block': 1, 'total_issued_normalized': 1}, sort=[("_at_block", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+            supply_versions[asset] = ([prev_version] if prev_version else []) + versions
+        supply = None
+        for version in supply_versions[asset]:
+            if version['_at_block'] > block_index:
+                break
+            supply = version['total_issued_normalized']
+        return supply
+
+    def get_last_market_cap(asset, market_cap_as):
+        if (asset, market_cap_as) not in last_market_caps:
+            prev_market_cap_history = config.mongo_db.asset_marketcap_history.find_one(
+                {'market_cap_as': market_cap_as, 'asset': asset, 'block_index': {"$lte": last_block_assets_compiled}},
+                sort=[("block_index", pymongo.DESCENDING)])
+            last_market_caps[(asset, market_cap_as)] = prev_market_cap_history['market_cap'] if prev_market_cap_history else None
+        return last_market_caps[(asset, market_cap_as)]
+
+    new_points = []
+
+    def compile_block(block_index, block_time, assets):
+        xcp_btc_price = get_pair_state(config.XCP, config.BTC).get_market_price(block_time)
+        for asset in assets:
+            if asset == config.XCP:
+                price_in_xcp, price_in_btc = 1.0, calc_inverse(xcp_btc_price) if xcp_btc_price else None
+            elif asset == config.BTC:
+                price_in_xcp, price_in_btc = xcp_btc_price, 1.0
+            else:
+                price_in_xcp = get_pair_state(asset, config.XCP).get_market_price(block_time)
+                price_in_btc = get_pair_state(asset, config.BTC).get_market_price(block_time)
+            supply = get_supply(asset, block_index)
+            if supply is None:  # asset didn't exist yet
+                continue
+            market_cap_in_xcp, market_cap_in_btc = calc_market_cap({'total_issued_normalized': supply}, price_in_xcp, price_in_btc)
+
+            for market_cap_as, market_cap in ((config.XCP, market_cap_in_xcp), (config.BTC, market_cap_in_btc)):
+                # add a new history point only if the market cap differs from the previous one
+                if market_cap and get_last_market_cap(asset, market_cap_as) != market_cap:
+                    new_points.append({
+                        'block_index': block_index,
+                        'block_time': block_time,
+                        'asset': asset,
+                        'market_cap': market_cap,
+                        'market_cap_as': market_cap_as,
+                    })
+                    last_market_caps[(asset, market_cap_as)] = market_cap
+
+    # stream through the trades, a block at a time: the trades of a block are all taken into account for the market
+    # prices as of that block, and each asset traded in the block gets (at most) one point per block
+    cur_block = None
+    trades = config.mongo_db.trades.find(
+        {'block_index': {"$gt": last_block_assets_compiled, "$lte": current_block_index}},
+        {'_id': 0, 'block_index': 1, 'message_index': 1, 'block_time': 1, 'base_asset': 1, 'quote_asset': 1, 'unit_price': 1,
+         'base_quantity_normalized': 1, 'quote_quantity_normalized': 1}
+    ).sort([("block_index", pymongo.ASCENDING), ("message_index", pymongo.ASCENDING)])
+    for t in trades:
+        if cur_block is None or cur_block['block_index'] != t['block_index']:
+            if cur_block is not None:
+                compile_block(**cur_block)
+            cur_block = {'block_index': t['block_index'], 'block_time': t['block_time'], 'assets': set()}
+        get_pair_state(t['base_asset'], t['quote_asset']).add_trade(t)
+        cur_block['assets'].update([t['base_asset'], t['quote_asset']])
+    if cur_block is not None:
+        compile_block(**cur_block)
+
+    for i in range(0, len(new_points), 1000):
+        config.mongo_db.asset_marketcap_history.insert_many(new_points[i:i + 1000])
+    logger.info("Compiled %i market cap history points for blocks %i to %i" % (len(new_points), last_block_assets_compiled + 1, current_block_index))
+
+
+def compile_market_info_leaderboard():
+    """Ranks the assets by their market cap in XCP and in BTC (among the assets with a price on that market), and stores
+    the top LEADERBOARD_MAX_RANKS of each ranking in market_info_leaderboard, with the asset_market_info documents and
+    their extended info flags"""
+    assets_market_info = list(config.mongo_db.asset_market_info.find({}, {'_id': 0}))
+    extended_asset_info_dict = {}
+    for e in config.mongo_db.asset_extended_info.find({'asset': {'$in': [a['asset'] for a in assets_market_info]}}):
+        if not e.get('disabled', False) and e.get('processed', False):  # skip assets marked disabled, or not yet processed
+            extended_asset_info_dict[e['asset']] = e
+    for a in assets_market_info:
+        extended_info = extended_asset_info_dict.get(a['asset'], {})
+        a['extended_image'] = bool(extended_info.get('image', '')) if extended_info else ''
+        a['extended_description'] = extended_info.get('description', '')
+        a['extended_website'] = extended_info.get('website', '')
+
+    for market in (config.XCP.lower(), config.BTC.lower()):
+        ranked = sorted(
+            [a for a in assets_market_info if a.get('price_in_{}'.format(market), None)],
+            key=lambda a: a.get('market_cap_in_{}'.format(market), None) or 0,
+            reverse=True)[:LEADERBOARD_MAX_RANKS]
+        # entries are replaced in place (rather than the whole leaderboard being dropped and rebuilt), so that a
+        # leaderboard is never seen empty
+        if ranked:
+            config.mongo_db.market_info_leaderboard.bulk_write([
+                pymongo.ReplaceOne({'market': market, 'rank': rank}, dict(a, market=market, rank=rank), upsert=True)
+                for rank, a in enumerate(ranked)], ordered=False)
+        config.mongo_db.market_info_leaderboard.remove({'market': market, 'rank': {"$gte": len(ranked)}})
+    logger.info("Compiled the market info leaderboards")
 
 
 def compile_asset_market_info():
@@ -556,47 +483,6 @@ def compile_asset_market_info():
         return True
 
     mps_xcp_btc, xcp_btc_price, btc_xcp_price = get_price_primitives()
-    all_traded_assets = list(set(list([config.BTC, config.XCP]) + list(config.mongo_db.trades.find({}, {'quote_asset': 1, '_id': 0}).distinct('quote_asset'))))
-
-    #######################
-    # get a list of all assets with a trade within the last 24h (not necessarily just against XCP and BTC)
-    # ^ this is important because compiled market info has a 24h vol parameter that designates total volume for the asset across ALL pairings
-    start_dt_1d = datetime.datetime.utcnow() - datetime.timedelta(days=1)
-
-    assets = list(set(
-        list(config.mongo_db.trades.find({'block_time': {'$gte': start_dt_1d}}).distinct('quote_asset'))
-        + list(config.mongo_db.trades.find({'block_time': {'$gte': start_dt_1d}}).distinct('base_asset'))
-    ))
-    for asset in assets:
-        market_info_24h = compile_24h_market_info(asset)
-        config.mongo_db.asset_market_info.update({'asset': asset}, {"$set": market_info_24h})
-    # for all others (i.e. no trade in the last 24 hours), zero out the 24h trade data
-    non_traded_assets = list(set(all_traded_assets) - set(assets))
-    config.mongo_db.asset_market_info.update({'asset': {'$in': non_traded_assets}}, {"$set": {
-        '24h_summary': {'vol': 0, 'count': 0},
-        '24h_ohlc_in_{}'.format(config.XCP.lower()): {},
-        '24h_ohlc_in_{}'.format(config.BTC.lower()): {},
-        '24h_vol_price_change_in_{}'.format(config.XCP.lower()): None,
-        '24h_vol_price_change_in_{}'.format(config.BTC.lower()): None,
-    }}, multi=True)
-    logger.info("Block: %s -- Calculated 24h stats for: %s" % (current_block_index, ', '.join(assets)))
-
-    #######################
-    # get a list of all assets with a trade within the last 7d up against XCP and BTC
-    start_dt_7d = datetime.datetime.utcnow() - datetime.timedelta(days=7)
-    assets = list(set(
-        list(config.mongo_db.trades.find({'block_time': {'$gte': start_dt_7d}, 'base_asset': {'$in': [config.XCP, config.BTC]}}).distinct('quote_asset'))
-        + list(config.mongo_db.trades.find({'block_time': {'$gte': start_dt_7d}}).distinct('base_asset'))
-    ))
-    for asset in assets:
-        market_info_7d = compile_7d_market_info(asset)
-        config.mongo_db.asset_market_info.update({'asset': asset}, {"$set": market_info_7d})
-    non_traded_assets = list(set(all_traded_assets) - set(assets))
-    config.mongo_db.asset_market_info.update({'asset': {'$in': non_traded_assets}}, {"$set": {
-        '7d_history_in_{}'.format(config.XCP.lower()): [],
-        '7d_history_in_{}'.format(config.BTC.lower()): [],
-    }}, multi=True)
-    logger.info("Block: %s -- Calculated 7d stats for: %s" % (current_block_index, ', '.join(assets)))
 
     #######################
     # update summary market data for assets traded since last_block_assets_compiled
@@ -610,70 +496,17 @@ def compile_asset_market_info():
         logger.info("Block: %s -- Updating asset market info for %s ..." % (current_block_index, asset))
         summary_info = compile_summary_market_info(asset, mps_xcp_btc, xcp_btc_price, btc_xcp_price)
         config.mongo_db.asset_market_info.update({'asset': asset}, {"$set": summary_info}, upsert=True)
+    # the 24h and 7d statistics are maintained block by block (see market_windows.py): have them published for any
+    # newly created asset_market_info documents
+    market_windows.mark_changed(assets)
 
     #######################
-    # next, compile market cap historicals (and get the market price data that we can use to update assets with new trades)
-    # NOTE: this algoritm still needs to be fleshed out some...I'm not convinced it's laid out/optimized like it should be
-    # start by getting all trades from when we last compiled this data
-    trades = config.mongo_db.trades.find({'block_index': {'$gt': last_block_assets_compiled}}).sort('block_index', pymongo.ASCENDING)
-    trades_by_block = []  # tracks assets compiled per block, as we only want to analyze any given asset once per block
-    trades_by_block_mapping = {}
-    # organize trades by block
-    for t in trades:
-        if t['block_index'] in trades_by_block_mapping:
-            assert trades_by_block_mapping[t['block_index']]['block_index'] == t['block_index']
-            assert trades_by_block_mapping[t['block_index']]['block_time'] == t['block_time']
-            trades_by_block_mapping[t['block_index']]['trades'].append(t)
-        else:
-            e = {'block_index': t['block_index'], 'block_time': t['block_time'], 'trades': [t, ]}
-            trades_by_block.append(e)
-            trades_by_block_mapping[t['block_index']] = e
-
-    for t_block in trades_by_block:
-        # reverse the tradelist per block, and ensure that we only process an asset that hasn't already been processed for this block
-        # (as there could be multiple trades in a single block for any specific asset). we reverse the list because
-        # we'd rather process a later trade for a given asset, as the market price for that will take into account
-        # the earlier trades on that same block for that asset, and we don't want/need multiple cap points per block
-        assets_in_block = {}
-        mps_xcp_btc, xcp_btc_price, btc_xcp_price = get_price_primitives(end_dt=t_block['block_time'])
-        for t in reversed(t_block['trades']):
-            assets = []
-            if t['base_asset'] not in assets_in_block:
-                assets.append(t['base_asset'])
-                assets_in_block[t['base_asset']] = True
-            if t['quote_asset'] not in assets_in_block:
-                assets.append(t['quote_asset'])
-                assets_in_block[t['quote_asset']] = True
-            if not len(assets):
-                continue
+    # next, compile market cap historicals
+    compile_market_cap_history(last_block_assets_compiled, current_block_index)
 
-            for asset in assets:
-                # recalculate the market cap for the asset this trade is for
-                asset_info = get_asset_info(asset, at_dt=t['block_time'])
-                (price_summary_in_xcp, price_summary_in_btc, price_in_xcp, price_in_btc, aggregated_price_in_xcp, aggregated_price_in_btc
-                 ) = get_xcp_btc_price_info(asset, mps_xcp_btc, xcp_btc_price, btc_xcp_price, with_last_trades=0, end_dt=t['block_time'])
-                market_cap_in_xcp, market_cap_in_btc = calc_market_cap(asset_info, price_in_xcp, price_in_btc)
-                #^ this will get price data from the block time of this trade back the standard number of days and trades
-                # to determine our standard market price, relative (anchored) to the time of this trade
-
-                for market_cap_as in (config.XCP, config.BTC):
-                    market_cap = market_cap_in_xcp if market_cap_as == config.XCP else market_cap_in_btc
-                    # if there is a previously stored market cap for this asset, add a new history point only if the two caps differ
-                    prev_market_cap_history = config.mongo_db.asset_marketcap_history.find(
-                        {'market_cap_as': market_cap_as, 'asset': asset,
-                         'block_index': {'$lt': t['block_index']}}).sort('block_index', pymongo.DESCENDING).limit(1)
-                    prev_market_cap_history = list(prev_market_cap_history)[0] if prev_market_cap_history.count() == 1 else None
-
-                    if market_cap and (not prev_market_cap_history or prev_market_cap_history['market_cap'] != market_cap):
-                        config.mongo_db.asset_marketcap_history.insert(
-                            {
-                                'block_index': t['block_index'],
-                                'block_time': t['block_time'],
-                                'asset': asset,
-                                'market_cap': market_cap,
-                                'market_cap_as': market_cap_as,
-                            })
-                        logger.info("Block %i -- Calculated market cap history point for %s as %s (mID: %s)" % (t['block_index'], asset, market_cap_as, t['message_index']))
+    #######################
+    # and rank the assets for the leaderboards
+    compile_market_info_leaderboard()
 
     config.mongo_db.app_config.update({}, {'$set': {'last_block_assets_compiled': current_block_index}})
     return True
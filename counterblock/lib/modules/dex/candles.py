@@ -0,0 +1,101 @@
+"""
+OHLCV candles of the booked trades, per asset pair and at several resolutions, in the trade_candles collection.
+
+A trade's candles are updated as it is booked. On a rollback, the candles touched by the rolled back blocks are
+recomputed out of the remaining trades.
+"""
+import logging
+import datetime
+import calendar
+
+import pymongo
+
+from counterblock.lib import config
+
+logger = logging.getLogger(__name__)
+
+INTERVALS = {  # interval name -> length (in seconds)
+    '5m': 5 * 60,
+    '1h': 60 * 60,
+    '1d': 24 * 60 * 60,
+}
+
+
+def get_interval_time(dt, interval):
+    """Returns the start time of the given interval's candle that the given (UTC) datetime falls into"""
+    ts = calendar.timegm(dt.timetuple())
+    return datetime.datetime.utcfromtimestamp(ts - ts % INTERVALS[interval])
+
+
+def add_trade(trade):
+    for interval in INTERVALS:
+        config.mongo_db.trade_candles.update({
+            'base_asset': trade['base_asset'],
+            'quote_asset': trade['quote_asset'],
+            'interval': interval,
+            'interval_time': get_interval_time(trade['block_time'], interval),
+        }, {
+            "$setOnInsert": {'open': trade['unit_price']},
+            "$set": {'close': trade['unit_price']},
+            "$max": {'high': trade['unit_price'], 'last_block_index': trade['block_index']},
+            "$min": {'low': trade['unit_price']},
+            "$inc": {
+                'vol': trade['base_quantity_normalized'],
+                'quote_vol': trade['quote_quantity_normalized'],
+                'price_sum': trade['unit_price'],  # to derive the average price
+                'count': 1,
+            },
+        }, upsert=True)
+
+
+def rebuild_candle(candle):
+    """Recomputes the given candle out of the trades in its interval (removing it if there are none left)"""
+    candle_query = {k: candle[k] for k in ('base_asset', 'quote_asset', 'interval', 'interval_time')}
+    trades = list(config.mongo_db.trades.find({
+        'base_asset': candle['base_asset'],
+        'quote_asset': candle['quote_asset'],
+        'block_time': {
+            "$gte": candle['interval_time'],
+            "$lt": candle['interval_time'] + datetime.timedelta(seconds=INTERVALS[candle['interval']])}
+    }, {'_id': 0, 'block_index': 1, 'message_index': 1, 'unit_price': 1,
+        'base_quantity_normalized': 1, 'quote_quantity_normalized': 1}))
+    if not trades:
+        config.mongo_db.trade_candles.remove(candle_query)
+        return
+    trades.sort(key=lambda t: (t['block_index'], t['message_index']))
+    prices = [t['unit_price'] for t in trades]
+    config.mongo_db.trade_candles.update(candle_query, {"$set": {
+        'open': prices[0],
+        'close': prices[-1],
+        'high': max(prices),
+        'low': min(prices),
+        'last_block_index': trades[-1]['block_index'],
+        'vol': sum(t['base_quantity_normalized'] for t in trades),
+        'quote_vol': sum(t['quote_quantity_normalized'] for t in trades),
+        'price_sum': sum(prices),
+        'count': len(trades),
+    }})
+
+
+def process_rollback(max_block_index):
+    """Recomputes the candles that included trades from after the given block (which must have already been removed
+    from the trades collection)"""
+    candles = list(config.mongo_db.trade_candles.find({'last_block_index': {"$gt": max_block_index}}, {'_id': 0}))
+    for candle in candles:
+        rebuild_candle(candle)
+    logger.info("Recomputed %i trade candles" % len(candles))
+
+
+def get_candles(base_asset, quote_asset, interval, start_dt, end_dt=None):
+    """Returns the given pair's candles at the given interval, for the candles starting from the one including
+    start_dt, up to end_dt (if specified). Candles are ordered by their interval_time"""
+    interval_time_filter = {"$gte": get_interval_time(start_dt, interval)}
+    if end_dt is not None:
+        interval_time_filter["$lte"] = end_dt
+    return list(config.mongo_db.trade_candles.find({
+        'base_asset': base_asset,
+        'quote_asset': quote_asset,
+        'interval': interval,
+        'interval_time': interval_time_filter,
+    }, {'_id': 0}).sort('interval_time', pymongo.ASCENDING))
+
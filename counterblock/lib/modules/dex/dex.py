@@ -1,67 +1,38 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from fractions import Fraction
 import logging
-import decimal
 import base64
 import json
 import calendar
 import time
 
-from counterblock.lib import cache, config, util
-
-decimal.setcontext(decimal.Context(prec=8, rounding=decimal.ROUND_HALF_EVEN))
-D = decimal.Decimal
-logger = logging.getLogger(__name__)
+import pymongo
 
+from counterblock.lib import asset_registry, cache, config, numeric, util
+from . import order_book
 
-def calculate_price(base_quantity, quote_quantity, base_divisibility, quote_divisibility, order_type=None):
-    if not base_divisibility:
-        base_quantity *= config.UNIT
-    if not quote_divisibility:
-        quote_quantity *= config.UNIT
+logger = logging.getLogger(__name__)
 
-    try:
-        if order_type == 'BUY':
-            decimal.setcontext(decimal.Context(prec=8, rounding=decimal.ROUND_DOWN))
-        elif order_type == 'SELL':
-            decimal.setcontext(decimal.Context(prec=8, rounding=decimal.ROUND_UP))
 
-        price = format(D(quote_quantity) / D(base_quantity), '.8f')
+PRICE_ROUNDING = {'BUY': numeric.ROUND_DOWN, 'SELL': numeric.ROUND_UP, None: numeric.ROUND_HALF_EVEN}
 
-        decimal.setcontext(decimal.Context(prec=8, rounding=decimal.ROUND_HALF_EVEN))
-        return price
 
-    except Exception as e:
-        logging.exception(e)
-        decimal.setcontext(decimal.Context(prec=8, rounding=decimal.ROUND_HALF_EVEN))
-        raise(e)
+def calculate_price(base_quantity, quote_quantity, base_divisibility, quote_divisibility, order_type=None):
+    return numeric.format_price(base_quantity, quote_quantity, base_divisibility, quote_divisibility, PRICE_ROUNDING[order_type])
 
 
 def get_pairs_with_orders(addresses=[], max_pairs=12):
-
+    """Returns the pairs the given addresses have the most open orders in (out of the order book)"""
     pairs_with_orders = []
+    order_book.ensure_loaded()
 
-    sources = '''AND source IN ({})'''.format(','.join(['?' for e in range(0, len(addresses))]))
-
-    sql = '''SELECT (MIN(give_asset, get_asset) || '/' || MAX(give_asset, get_asset)) AS pair,
-                    COUNT(*) AS order_count
-             FROM orders
-             WHERE give_asset != get_asset AND status = ? {} 
-             GROUP BY pair 
-             ORDER BY order_count DESC
-             LIMIT ?'''.format(sources)
-
-    bindings = ['open'] + addresses + [max_pairs]
-
-    my_pairs = util.call_jsonrpc_api('sql', {'query': sql, 'bindings': bindings})['result']
-
-    for my_pair in my_pairs:
-        base_asset, quote_asset = util.assets_to_asset_pair(*tuple(my_pair['pair'].split("/")))
+    for (base_asset, quote_asset), order_count in order_book.get_address_order_counts(addresses)[:max_pairs]:
         top_pair = {
             'base_asset': base_asset,
             'quote_asset': quote_asset,
-            'my_order_count': my_pair['order_count']
+            'my_order_count': order_count
         }
-        if my_pair['pair'] == config.BTC_TO_XCP:  # XCP/BTC always in first
+        if (base_asset, quote_asset) == (config.XCP, config.BTC):  # XCP/BTC always in first
             pairs_with_orders.insert(0, top_pair)
         else:
             pairs_with_orders.append(top_pair)
@@ -69,83 +40,63 @@ def get_pairs_with_orders(addresses=[], max_pairs=12):
     return pairs_with_orders
 
 
-def get_pairs(quote_asset=config.XCP, exclude_pairs=[], max_pairs=12, from_time=None):
-
-    bindings = []
-
-    sql = '''SELECT (CASE
-                        WHEN forward_asset = ? THEN backward_asset
-                        ELSE forward_asset
-                    END) AS base_asset,
-                    (CASE
-                        WHEN backward_asset = ? THEN backward_asset
-                        ELSE forward_asset
-                    END) AS quote_asset,
-                    (CASE
-                        WHEN backward_asset = ? THEN (forward_asset || '/' || backward_asset)
-                        ELSE (backward_asset || '/' || forward_asset)
-                    END) AS pair,
-                    (CASE
-                        WHEN forward_asset = ? THEN backward_quantity
-                        ELSE forward_quantity
-                    END) AS bq,
-                    (CASE
-                        WHEN backward_asset = ? THEN backward_quantity
-                        ELSE forward_quantity
-                    END) AS qq '''
-    if from_time:
-        sql += ''', block_time '''
-
-    sql += '''FROM order_matches '''
-    bindings += [quote_asset, quote_asset, quote_asset, quote_asset, quote_asset]
-
+def get_pairs(quote_asset=config.XCP, exclude_pairs=[], max_pairs=12, from_time=None, last_24h=False):
+    """Returns the pairs quoted in the given asset with the most traded quote quantity, overall or (if last_24h is
+    set) over the last 24h, out of the market summaries. (from_time, a unix timestamp to only count the trades after, is
+    deprecated in favor of last_24h: these pairs are ranked out of the trades collection instead)"""
+    query = {'quote_asset': quote_asset}
+    exclude_base_assets = [pair.split('/')[0] for pair in exclude_pairs if pair.split('/')[1] == quote_asset]
+    if exclude_base_assets:
+        query['base_asset'] = {'$nin': exclude_base_assets}
     if from_time:
-        sql += '''INNER JOIN blocks ON order_matches.block_index = blocks.block_index '''
-
-    priority_quote_assets = []
-    for priority_quote_asset in config.QUOTE_ASSETS:
-        if priority_quote_asset != quote_asset:
-            priority_quote_assets.append(priority_quote_asset)
-        else:
-            break
+        return _get_pairs_since(query, datetime.utcfromtimestamp(from_time), max_pairs)
+    base_volume_field, volume_field = ('base_volume_24h', 'volume_24h') if last_24h else ('base_volume', 'volume')
+    query[volume_field] = {'$gt': 0}
+    query['price'] = {'$exists': True}  # (see get_markets_list)
 
-    if len(priority_quote_assets) > 0:
-        asset_bindings = ','.join(['?' for e in range(0, len(priority_quote_assets))])
-        sql += '''WHERE ((forward_asset = ? AND backward_asset NOT IN ({})) 
-                         OR (forward_asset NOT IN ({}) AND backward_asset = ?)) '''.format(asset_bindings, asset_bindings)
-        bindings += [quote_asset] + priority_quote_assets + priority_quote_assets + [quote_asset]
-    else:
-        sql += '''WHERE ((forward_asset = ?) OR (backward_asset = ?)) '''
-        bindings += [quote_asset, quote_asset]
-
-    if len(exclude_pairs) > 0:
-        sql += '''AND pair NOT IN ({}) '''.format(','.join(['?' for e in range(0, len(exclude_pairs))]))
-        bindings += exclude_pairs
-
-    if from_time:
-        sql += '''AND block_time > ? '''
-        bindings += [from_time]
-
-    sql += '''AND forward_asset != backward_asset
-              AND status = ?'''
-
-    bindings += ['completed', max_pairs]
+    pairs = []
+    for summary in config.mongo_db.market_summaries.find(
+            query, {'_id': 0, 'base_asset': 1, 'quote_asset': 1, base_volume_field: 1, volume_field: 1}
+    ).sort(volume_field, pymongo.DESCENDING).limit(max_pairs):
+        pairs.append({
+            'base_asset': summary['base_asset'],
+            'quote_asset': summary['quote_asset'],
+            'pair': summary['base_asset'] + '/' + summary['quote_asset'],
+            'base_quantity': summary.get(base_volume_field, 0),
+            'quote_quantity': summary[volume_field],
+        })
+    return pairs
 
-    sql = '''SELECT base_asset, quote_asset, pair, SUM(bq) AS base_quantity, SUM(qq) AS quote_quantity 
-             FROM ({}) 
-             GROUP BY pair 
-             ORDER BY quote_quantity DESC
-             LIMIT ?'''.format(sql)
 
-    return util.call_jsonrpc_api('sql', {'query': sql, 'bindings': bindings})['result']
+def _get_pairs_since(query, start_dt, max_pairs):
+    pairs = []
+    for e in config.mongo_db.trades.aggregate([
+        {"$match": dict(query, block_time={'$gt': start_dt})},
+        {"$group": {
+            "_id": "$base_asset",
+            "base_quantity": {"$sum": "$base_quantity"},
+            "quote_quantity": {"$sum": "$quote_quantity"}
+        }},
+        {"$sort": {"quote_quantity": pymongo.DESCENDING}},
+        {"$limit": max_pairs}
+    ]):
+        pairs.append({
+            'base_asset': e['_id'],
+            'quote_asset': query['quote_asset'],
+            'pair': e['_id'] + '/' + query['quote_asset'],
+            'base_quantity': e['base_quantity'],
+            'quote_quantity': e['quote_quantity'],
+        })
+    return pairs
 
 
-def get_quotation_pairs(exclude_pairs=[], max_pairs=12, from_time=None, include_currencies=[]):
+def get_quotation_pairs(exclude_pairs=[], max_pairs=12, from_time=None, include_currencies=[], last_24h=False):
     all_pairs = []
     currencies = include_currencies if len(include_currencies) > 0 else config.MARKET_LIST_QUOTE_ASSETS
 
     for currency in currencies:
-        currency_pairs = get_pairs(quote_asset=currency, exclude_pairs=exclude_pairs, max_pairs=max_pairs, from_time=from_time)
+        currency_pairs = get_pairs(quote_asset=currency, exclude_pairs=exclude_pairs, max_pairs=max_pairs,
+                                   from_time=from_time, last_24h=last_24h)
         max_pairs = max_pairs - len(currency_pairs)
         for currency_pair in currency_pairs:
             if currency_pair['pair'] == config.XCP_TO_BTC:
@@ -158,7 +109,6 @@ def get_quotation_pairs(exclude_pairs=[], max_pairs=12, from_time=None, include_
 
 def get_users_pairs(addresses=[], max_pairs=12, quote_assets=config.MARKET_LIST_QUOTE_ASSETS):
     top_pairs = []
-    all_assets = []
     exclude_pairs = []
 
     if len(addresses) > 0:
@@ -166,7 +116,6 @@ def get_users_pairs(addresses=[], max_pairs=12, quote_assets=config.MARKET_LIST_
 
     for p in top_pairs:
         exclude_pairs += [p['base_asset'] + '/' + p['quote_asset']]
-        all_assets += [p['base_asset'], p['quote_asset']]
 
     for currency in quote_assets:
         if len(top_pairs) < max_pairs:
@@ -181,29 +130,27 @@ def get_users_pairs(addresses=[], max_pairs=12, quote_assets=config.MARKET_LIST_
                     top_pairs.insert(0, top_pair)
                 else:
                     top_pairs.append(top_pair)
-                all_assets += [currency_pair['base_asset'], currency_pair['quote_asset']]
 
     if (config.BTC in quote_assets) and (config.XCP_TO_BTC not in [p['base_asset'] + '/' + p['quote_asset'] for p in top_pairs]):
         top_pairs.insert(0, {
             'base_asset': config.XCP,
             'quote_asset': config.BTC
         })
-        all_assets += [config.XCP, config.BTC]
 
     top_pairs = top_pairs[:max_pairs]
-    all_assets = list(set(all_assets))
-    supplies = get_assets_supply(all_assets)
+    summaries = {}
+    if top_pairs:
+        for summary in config.mongo_db.market_summaries.find({
+                '$or': [{'base_asset': p['base_asset'], 'quote_asset': p['quote_asset']} for p in top_pairs],
+                'price': {'$exists': True}}, {'_id': 0}):
+            summaries[(summary['base_asset'], summary['quote_asset'])] = summary
 
     for p in range(len(top_pairs)):
-        price, trend, price24h, progression = get_price_movement(top_pairs[p]['base_asset'], top_pairs[p]['quote_asset'], supplies=supplies)
-        top_pairs[p]['price'] = format(price, ".8f")
-        top_pairs[p]['trend'] = trend
-        top_pairs[p]['progression'] = format(progression, ".2f")
-        top_pairs[p]['price_24h'] = format(price24h, ".8f")
+        _format_market_summary(top_pairs[p], summaries.get((top_pairs[p]['base_asset'], top_pairs[p]['quote_asset']), None))
 
         # add asset longnames too
-        top_pairs[p]['base_asset_longname'] = config.mongo_db.tracked_assets.find_one({'asset': top_pairs[p]['base_asset']})['asset_longname']
-        top_pairs[p]['quote_asset_longname'] = config.mongo_db.tracked_assets.find_one({'asset': top_pairs[p]['quote_asset']})['asset_longname']
+        top_pairs[p]['base_asset_longname'] = asset_registry.get_longname(top_pairs[p]['base_asset'])
+        top_pairs[p]['quote_asset_longname'] = asset_registry.get_longname(top_pairs[p]['quote_asset'])
 
     return top_pairs
 
@@ -211,10 +158,10 @@ def get_users_pairs(addresses=[], max_pairs=12, quote_assets=config.MARKET_LIST_
 def merge_same_price_orders(orders):
     if len(orders) > 1:
         merged_orders = []
-        orders = sorted(orders, key=lambda x: D(x['price']))
+        orders = sorted(orders, key=lambda x: Fraction(x['price']))
         merged_orders.append(orders[0])
         for o in range(1, len(orders)):
-            if D(orders[o]['price']) == D(merged_orders[-1]['price']):
+            if orders[o]['price'] == merged_orders[-1]['price']:  # (prices are all formatted to 8 decimal places)
                 merged_orders[-1]['amount'] += orders[o]['amount']
                 merged_orders[-1]['total'] += orders[o]['total']
             else:
@@ -234,22 +181,9 @@ def get_market_orders(asset1, asset2, addresses=[], supplies=None, min_fee_provi
     buy_orders = []
     sell_orders = []
 
-    sql = '''SELECT orders.*, blocks.block_time FROM orders INNER JOIN blocks ON orders.block_index=blocks.block_index 
-             WHERE  status = ? '''
-    bindings = ['open']
-
-    if len(addresses) > 0:
-        sql += '''AND source IN ({}) '''.format(','.join(['?' for e in range(0, len(addresses))]))
-        bindings += addresses
-
-    sql += '''AND give_remaining > 0 
-              AND give_asset IN (?, ?) 
-              AND get_asset IN (?, ?) 
-              ORDER BY tx_index DESC'''
-
-    bindings += [asset1, asset2, asset1, asset2]
-
-    orders = util.call_jsonrpc_api('sql', {'query': sql, 'bindings': bindings})['result']
+    order_book.ensure_loaded()
+    orders = [o for o in reversed(order_book.get_orders(base_asset, quote_asset))
+              if o['give_remaining'] > 0 and (not addresses or o['source'] in addresses)]
 
     for order in orders:
         market_order = {}
@@ -258,7 +192,7 @@ def get_market_orders(asset1, asset2, addresses=[], supplies=None, min_fee_provi
         if order['give_asset'] == config.BTC:
             try:
                 fee_provided = order['fee_provided'] / (order['give_quantity'] / 100)
-                market_order['fee_provided'] = format(D(order['fee_provided']) / (D(order['give_quantity']) / D(100)), '.2f')
+                market_order['fee_provided'] = numeric.format_number(Fraction(order['fee_provided'] * 100, order['give_quantity']), 2)
             except Exception as e:
                 fee_provided = min_fee_provided - 1  # exclude
 
@@ -267,7 +201,7 @@ def get_market_orders(asset1, asset2, addresses=[], supplies=None, min_fee_provi
         elif order['get_asset'] == config.BTC:
             try:
                 fee_required = order['fee_required'] / (order['get_quantity'] / 100)
-                market_order['fee_required'] = format(D(order['fee_required']) / (D(order['get_quantity']) / D(100)), '.2f')
+                market_order['fee_required'] = numeric.format_number(Fraction(order['fee_required'] * 100, order['get_quantity']), 2)
             except Exception as e:
                 fee_required = max_fee_required + 1  # exclude
 
@@ -281,7 +215,7 @@ def get_market_orders(asset1, asset2, addresses=[], supplies=None, min_fee_provi
                     continue
                 market_order['type'] = 'SELL'
                 market_order['amount'] = order['give_remaining']
-                market_order['total'] = D(order['give_remaining']) * D(price)
+                market_order['total'] = order['give_remaining'] * Fraction(price)
                 if not supplies[order['give_asset']][1] and supplies[order['get_asset']][1]:
                     market_order['total'] = int(market_order['total'] * config.UNIT)
                 elif supplies[order['give_asset']][1] and not supplies[order['get_asset']][1]:
@@ -293,11 +227,11 @@ def get_market_orders(asset1, asset2, addresses=[], supplies=None, min_fee_provi
                     price = calculate_price(order['get_quantity'], order['give_quantity'], supplies[order['get_asset']][1], supplies[order['give_asset']][1], 'BUY')
                 except:
                     continue
-                if D(price) == 0:
+                if Fraction(price) == 0:
                     continue
                 market_order['type'] = 'BUY'
                 market_order['total'] = order['give_remaining']
-                market_order['amount'] = D(order['give_remaining']) / D(price)
+                market_order['amount'] = order['give_remaining'] / Fraction(price)
                 if supplies[order['give_asset']][1] and not supplies[order['get_asset']][1]:
                     market_order['amount'] = int(market_order['amount'] / config.UNIT)
                 elif not supplies[order['give_asset']][1] and supplies[order['get_asset']][1]:
@@ -308,7 +242,7 @@ def get_market_orders(asset1, asset2, addresses=[], supplies=None, min_fee_provi
             market_order['price'] = price
 
             if len(addresses) > 0:
-                completed = format(((D(order['give_quantity']) - D(order['give_remaining'])) / D(order['give_quantity'])) * D(100), '.2f')
+                completed = numeric.format_number(Fraction((order['give_quantity'] - order['give_remaining']) * 100, order['give_quantity']), 2)
                 market_order['completion'] = "{}%".format(completed)
                 market_order['tx_index'] = order['tx_index']
                 market_order['tx_hash'] = order['tx_hash']
@@ -334,6 +268,7 @@ def get_market_trades(asset1, asset2, addresses=[], limit=50, supplies=None):
     if not supplies:
         supplies = get_assets_supply([asset1, asset2])
     market_trades = []
+    price_rows = []  # the (base_quantity, quote_quantity, base_divisible, quote_divisible, rounding) of each trade
 
     sources = ''
     bindings = ['expired']
@@ -365,12 +300,12 @@ def get_market_trades(asset1, asset2, addresses=[], limit=50, supplies=None):
             trade['status'] = order_match['status']
             if order_match['forward_asset'] == base_asset:
                 trade['type'] = 'SELL'
-                trade['price'] = calculate_price(order_match['forward_quantity'], order_match['backward_quantity'], supplies[order_match['forward_asset']][1], supplies[order_match['backward_asset']][1], 'SELL')
+                price_rows.append((order_match['forward_quantity'], order_match['backward_quantity'], supplies[order_match['forward_asset']][1], supplies[order_match['backward_asset']][1], PRICE_ROUNDING['SELL']))
                 trade['amount'] = order_match['forward_quantity']
                 trade['total'] = order_match['backward_quantity']
             else:
                 trade['type'] = 'BUY'
-                trade['price'] = calculate_price(order_match['backward_quantity'], order_match['forward_quantity'], supplies[order_match['backward_asset']][1], supplies[order_match['forward_asset']][1], 'BUY')
+                price_rows.append((order_match['backward_quantity'], order_match['forward_quantity'], supplies[order_match['backward_asset']][1], supplies[order_match['forward_asset']][1], PRICE_ROUNDING['BUY']))
                 trade['amount'] = order_match['backward_quantity']
                 trade['total'] = order_match['forward_quantity']
             market_trades.append(trade)
@@ -385,157 +320,148 @@ def get_market_trades(asset1, asset2, addresses=[], limit=50, supplies=None):
             trade['status'] = order_match['status']
             if order_match['backward_asset'] == base_asset:
                 trade['type'] = 'SELL'
-                trade['price'] = calculate_price(order_match['backward_quantity'], order_match['forward_quantity'], supplies[order_match['backward_asset']][1], supplies[order_match['forward_asset']][1], 'SELL')
+                price_rows.append((order_match['backward_quantity'], order_match['forward_quantity'], supplies[order_match['backward_asset']][1], supplies[order_match['forward_asset']][1], PRICE_ROUNDING['SELL']))
                 trade['amount'] = order_match['backward_quantity']
                 trade['total'] = order_match['forward_quantity']
             else:
                 trade['type'] = 'BUY'
-                trade['price'] = calculate_price(order_match['forward_quantity'], order_match['backward_quantity'], supplies[order_match['forward_asset']][1], supplies[order_match['backward_asset']][1], 'BUY')
+                price_rows.append((order_match['forward_quantity'], order_match['backward_quantity'], supplies[order_match['forward_asset']][1], supplies[order_match['backward_asset']][1], PRICE_ROUNDING['BUY']))
                 trade['amount'] = order_match['forward_quantity']
                 trade['total'] = order_match['backward_quantity']
             market_trades.append(trade)
 
+    for trade, price in zip(market_trades, numeric.format_prices(price_rows)):
+        trade['price'] = price
     return market_trades
 
 
 def get_assets_supply(assets=[]):
-
+    """Returns the (supply, divisible) of each of the given assets (that exist), out of the asset registry"""
     supplies = {}
-
-    if config.XCP in assets:
-        supplies[config.XCP] = (util.call_jsonrpc_api("get_supply", {'asset': config.XCP})['result'], True)
-        assets.remove(config.XCP)
-
-    if config.BTC in assets:
-        supplies[config.BTC] = (0, True)
-        assets.remove(config.BTC)
-
-    if len(assets) > 0:
-        sql = '''SELECT asset, SUM(quantity) AS supply, divisible FROM issuances 
-                 WHERE asset IN ({}) 
-                 AND status = ?
-                 GROUP BY asset
-                 ORDER BY asset'''.format(','.join(['?' for e in range(0, len(assets))]))
-        bindings = assets + ['valid']
-
-        issuances = util.call_jsonrpc_api('sql', {'query': sql, 'bindings': bindings})['result']
-        for issuance in issuances:
-            supplies[issuance['asset']] = (issuance['supply'], issuance['divisible'])
-
+    for asset in assets:
+        record = asset_registry.get(asset)
+        if record is not None:
+            supplies[asset] = (asset_registry.get_supply(asset, 0), record.divisible)
     return supplies
 
 
-def get_pair_price(base_asset, quote_asset, max_block_time=None, supplies=None):
-
-    if not supplies:
-        supplies = get_assets_supply([base_asset, quote_asset])
-
-    sql = '''SELECT *, MAX(tx0_index, tx1_index) AS tx_index, blocks.block_time 
-             FROM order_matches INNER JOIN blocks ON order_matches.block_index = blocks.block_index
-             WHERE 
-                forward_asset IN (?, ?) AND
-                backward_asset IN (?, ?) '''
-    bindings = [base_asset, quote_asset, base_asset, quote_asset]
-
-    if max_block_time:
-        sql += '''AND block_time <= ? '''
-        bindings += [max_block_time]
-
-    sql += '''ORDER BY tx_index DESC
-             LIMIT 2'''
-
-    order_matches = util.call_jsonrpc_api('sql', {'query': sql, 'bindings': bindings})['result']
-
-    if len(order_matches) == 0:
-        last_price = D(0.0)
-    elif order_matches[0]['forward_asset'] == base_asset:
-        last_price = calculate_price(order_matches[0]['forward_quantity'], order_matches[0]['backward_quantity'], supplies[order_matches[0]['forward_asset']][1], supplies[order_matches[0]['backward_asset']][1])
-    else:
-        last_price = calculate_price(order_matches[0]['backward_quantity'], order_matches[0]['forward_quantity'], supplies[order_matches[0]['backward_asset']][1], supplies[order_matches[0]['forward_asset']][1])
-
-    trend = 0
-    if len(order_matches) == 2:
-        if order_matches[1]['forward_asset'] == base_asset:
-            before_last_price = calculate_price(order_matches[0]['forward_quantity'], order_matches[0]['backward_quantity'], supplies[order_matches[0]['forward_asset']][1], supplies[order_matches[0]['backward_asset']][1])
-        else:
-            before_last_price = calculate_price(order_matches[0]['backward_quantity'], order_matches[0]['forward_quantity'], supplies[order_matches[0]['backward_asset']][1], supplies[order_matches[0]['forward_asset']][1])
-        if last_price < before_last_price:
-            trend = -1
-        elif last_price > before_last_price:
-            trend = 1
-
-    return D(last_price), trend
+def update_market_summary(base_asset, quote_asset, block_index, block_time):
+    """Recomputes the market_summaries document of the given pair from the pair's booked trades, as of the given
+    block. (The pair's cumulative `volume` and `base_volume` are maintained as the trades are booked, and not touched
+    here.)"""
+    pair_query = {'base_asset': base_asset, 'quote_asset': quote_asset}
+    yesterday = block_time - timedelta(days=1)
+    last_trades = list(config.mongo_db.trades.find(pair_query, {'_id': 0, 'unit_price': 1, 'block_index': 1}).sort(
+        [('block_index', pymongo.DESCENDING), ('message_index', pymongo.DESCENDING)]).limit(2))
+    if not last_trades:  # all of the pair's trades were rolled back
+        config.mongo_db.market_summaries.remove(pair_query)
+        return
+    trade_24h = config.mongo_db.trades.find_one(
+        dict(pair_query, block_time={'$lte': yesterday}), {'_id': 0, 'unit_price': 1},
+        sort=[('block_index', pymongo.DESCENDING), ('message_index', pymongo.DESCENDING)])
+    volumes_24h = list(config.mongo_db.trades.aggregate([
+        {"$match": dict(pair_query, block_time={'$gt': yesterday})},
+        {"$group": {
+            "_id": None,
+            "volume_24h": {"$sum": "$quote_quantity"},
+            "base_volume_24h": {"$sum": "$base_quantity"},
+            "first_block_time": {"$min": "$block_time"}
+        }}
+    ]))
+
+    price = last_trades[0]['unit_price']
+    prev_price = last_trades[1]['unit_price'] if len(last_trades) == 2 else price
+    price_24h = trade_24h['unit_price'] if trade_24h else 0
+    supply = asset_registry.get_supply(base_asset, 0)
+    summary = {
+        'price': price,
+        'trend': 1 if price > prev_price else (-1 if price < prev_price else 0),
+        'price_24h': price_24h,
+        'progression': (price - price_24h) / (price_24h / 100) if price_24h else 0,
+        'volume_24h': volumes_24h[0]['volume_24h'] if volumes_24h else 0,
+        'base_volume_24h': volumes_24h[0]['base_volume_24h'] if volumes_24h else 0,
+        'supply': supply,
+        'base_divisibility': asset_registry.is_divisible(base_asset, True),
+        'quote_divisibility': asset_registry.is_divisible(quote_asset, True),
+        'market_cap': supply * price,
+        'last_trade_block': last_trades[0]['block_index'],
+        'block_index': block_index,  # the block the summary was computed at (for rollbacks)
+        # when the oldest trade in the 24h window slides out of it (and the 24h figures have to be recomputed)
+        'window_changes_at': (volumes_24h[0]['first_block_time'] + timedelta(days=1)
+                              if volumes_24h and volumes_24h[0]['first_block_time'] else None),
+    }
+    config.mongo_db.market_summaries.update(pair_query, {"$set": summary}, upsert=True)
 
 
-def get_price_movement(base_asset, quote_asset, supplies=None):
-    yesterday = int(calendar.timegm(config.state['my_latest_block']['block_time'].timetuple()) - (24 * 60 * 60))
-    if not supplies:
-        supplies = get_assets_supply([base_asset, quote_asset])
+def update_market_summaries(pairs, supply_changed_assets, block_index, block_time):
+    """Refreshes the market summaries of the given (base_asset, quote_asset) pairs, along with those whose 24h window
+    changed as of the given block, and those with one of the given assets (with a changed supply) as base asset"""
+    pairs = set(pairs)
+    for summary in config.mongo_db.market_summaries.find(
+            {'$or': [{'window_changes_at': {'$lte': block_time}}, {'base_asset': {'$in': list(supply_changed_assets)}}]},
+            {'_id': 0, 'base_asset': 1, 'quote_asset': 1}):
+        pairs.add((summary['base_asset'], summary['quote_asset']))
+    for base_asset, quote_asset in pairs:
+        update_market_summary(base_asset, quote_asset, block_index, block_time)
 
-    price, trend = get_pair_price(base_asset, quote_asset, supplies=supplies)
-    price24h, trend24h = get_pair_price(base_asset, quote_asset, max_block_time=yesterday, supplies=supplies)
-    try:
-        progression = (price - price24h) / (price24h / D(100))
-    except:
-        progression = D(0)
 
-    return price, trend, price24h, progression
+def _format_market_summary(market, summary):
+    market['price'] = format(summary['price'], ".8f") if summary else format(0, ".8f")
+    market['trend'] = summary['trend'] if summary else 0
+    market['progression'] = format(summary['progression'], ".2f") if summary else format(0, ".2f")
+    market['price_24h'] = format(summary['price_24h'], ".8f") if summary else format(0, ".8f")
+    return market
 
 
 def get_markets_list(quote_asset=None, order_by=None):
-    yesterday = int(calendar.timegm(config.state['my_latest_block']['block_time'].timetuple()) - (24 * 60 * 60))
-    markets = []
-    pairs = []
     currencies = [config.XCP, config.XBTC] if not quote_asset else [quote_asset]
+    max_markets = 500
+    summaries = []
 
-    # pairs with volume last 24h
-    pairs += get_quotation_pairs(exclude_pairs=[], max_pairs=500, from_time=yesterday, include_currencies=currencies)
-    pair_with_volume = [p['pair'] for p in pairs]
-
-    # pairs without volume last 24h
-    pairs += get_quotation_pairs(exclude_pairs=pair_with_volume, max_pairs=500 - len(pair_with_volume), include_currencies=currencies)
-
-    base_assets = [p['base_asset'] for p in pairs]
-    quote_assets = [p['quote_asset'] for p in pairs]
-    all_assets = list(set(base_assets + quote_assets))
-    supplies = get_assets_supply(all_assets)
-
+    if order_by in ['price', 'progression', 'supply', 'market_cap']:
+        # (skipping the summaries of pairs with a first trade booked in the block being processed, which only have
+        # their volumes until the summaries are refreshed at the end of the block)
+        summaries = list(config.mongo_db.market_summaries.find(
+            {'quote_asset': {'$in': currencies}, 'price': {'$exists': True}}, {'_id': 0}).sort(
+            order_by, pymongo.DESCENDING).limit(max_markets))
+    else:
+        # pairs with volume in the last 24h first (by that volume), then the others (by their total volume)
+        for with_volume in (True, False):
+            for currency in currencies:
+                if len(summaries) >= max_markets:
+                    break
+                summaries += list(config.mongo_db.market_summaries.find(
+                    {'quote_asset': currency, 'volume_24h': {'$gt': 0} if with_volume else 0}, {'_id': 0}).sort(
+                    'volume_24h' if with_volume else 'volume', pymongo.DESCENDING).limit(max_markets - len(summaries)))
+
+    all_assets = list(set([s['base_asset'] for s in summaries] + [s['quote_asset'] for s in summaries]))
     asset_with_image = {}
     infos = config.mongo_db.asset_extended_info.find({'asset': {'$in': all_assets}}, {'_id': 0})
     for info in infos:
         if 'info_data' in info and 'valid_image' in info['info_data'] and info['info_data']['valid_image']:
             asset_with_image[info['asset']] = True
-    assets = config.mongo_db.tracked_assets.find({'asset': {'$in': all_assets}}, {'_id': 0})
-    longnames = {}
-    for e in assets:
-        longnames[e['asset']] = e['asset_longname']
 
-    for pair in pairs:
-        price, trend, price24h, progression = get_price_movement(pair['base_asset'], pair['quote_asset'], supplies=supplies)
+    markets = []
+    for summary in summaries:
         market = {}
-        market['base_asset'] = pair['base_asset']
-        market['base_asset_longname'] = longnames.get(pair['base_asset'], pair['base_asset'])
-        market['quote_asset'] = pair['quote_asset']
-        market['quote_asset_longname'] = longnames.get(pair['quote_asset'], pair['quote_asset'])
-        market['volume'] = pair['quote_quantity'] if pair['pair'] in pair_with_volume else 0
-        market['price'] = format(price, ".8f")
-        market['trend'] = trend
-        market['progression'] = format(progression, ".2f")
-        market['price_24h'] = format(price24h, ".8f")
-        market['supply'] = supplies[pair['base_asset']][0]
-        market['base_divisibility'] = supplies[pair['base_asset']][1]
-        market['quote_divisibility'] = supplies[pair['quote_asset']][1]
-        market['market_cap'] = format(D(market['supply']) * D(market['price']), ".4f")
-        market['with_image'] = True if pair['base_asset'] in asset_with_image else False
-        if market['base_asset'] == config.XCP and market['quote_asset'] == config.BTC:
+        market['base_asset'] = summary['base_asset']
+        market['base_asset_longname'] = asset_registry.get_longname(summary['base_asset'], summary['base_asset'])
+        market['quote_asset'] = summary['quote_asset']
+        market['quote_asset_longname'] = asset_registry.get_longname(summary['quote_asset'], summary['quote_asset'])
+        market['volume'] = summary['volume_24h']
+        _format_market_summary(market, summary)
+        market['supply'] = summary['supply']
+        market['base_divisibility'] = summary['base_divisibility']
+        market['quote_divisibility'] = summary['quote_divisibility']
+        market['market_cap'] = format(summary['market_cap'], ".4f")
+        market['with_image'] = True if summary['base_asset'] in asset_with_image else False
+        if market['base_asset'] == config.XCP and market['quote_asset'] == config.BTC and not order_by:
             markets.insert(0, market)
         else:
             markets.append(market)
 
-    if order_by in ['price', 'progression', 'supply', 'market_cap']:
-        markets = sorted(markets, key=lambda x: D(x[order_by]), reverse=True)
-    elif order_by in ['base_asset', 'quote_asset']:
-        markets = sorted(markets, key=lambda x: x['order_by'])
+    if order_by in ['base_asset', 'quote_asset']:
+        markets = sorted(markets, key=lambda x: x[order_by])
 
     for m in range(len(markets)):
         markets[m]['pos'] = m + 1
@@ -545,12 +471,11 @@ def get_markets_list(quote_asset=None, order_by=None):
 
 def get_market_details(asset1, asset2, min_fee_provided=0.95, max_fee_required=0.95):
 
-    yesterday = int(calendar.timegm(config.state['my_latest_block']['block_time'].timetuple()) - (24 * 60 * 60))
     base_asset, quote_asset = util.assets_to_asset_pair(asset1, asset2)
 
     supplies = get_assets_supply([base_asset, quote_asset])
-
-    price, trend, price24h, progression = get_price_movement(base_asset, quote_asset, supplies=supplies)
+    summary = config.mongo_db.market_summaries.find_one(
+        {'base_asset': base_asset, 'quote_asset': quote_asset, 'price': {'$exists': True}}, {'_id': 0})
 
     buy_orders = []
     sell_orders = []
@@ -574,15 +499,15 @@ def get_market_details(asset1, asset2, min_fee_provided=0.95, max_fee_required=0
     return {
         'base_asset': base_asset,
         'quote_asset': quote_asset,
-        'price': format(price, ".8f"),
-        'trend': trend,
-        'progression': format(progression, ".2f"),
-        'price_24h': format(price24h, ".8f"),
+        'price': format(summary['price'] if summary else 0, ".8f"),
+        'trend': summary['trend'] if summary else 0,
+        'progression': format(summary['progression'] if summary else 0, ".2f"),
+        'price_24h': format(summary['price_24h'] if summary else 0, ".8f"),
         'supply': supplies[base_asset][0],
         'base_asset_divisible': supplies[base_asset][1],
         'quote_asset_divisible': supplies[quote_asset][1],
-        'buy_orders': sorted(buy_orders, key=lambda x: D(x['price']), reverse=True),
-        'sell_orders': sorted(sell_orders, key=lambda x: D(x['price'])),
+        'buy_orders': sorted(buy_orders, key=lambda x: Fraction(x['price']), reverse=True),
+        'sell_orders': sorted(sell_orders, key=lambda x: Fraction(x['price'])),
         'last_trades': last_trades,
         'base_asset_infos': ext_info
     }
@@ -0,0 +1,227 @@
+"""
+Rolling 24h and 7d trade statistics of the assets (the 24h_* and 7d_history_* fields of asset_market_info), kept in
+memory and published to asset_market_info as each block is processed.
+
+The trades of the last 7 days are loaded once counterblock is caught up. From then on, the windows are fed the trades
+booked in each block, and the trades (and hourly price slots) falling out of a window are expired against the block
+time. Only the assets whose statistics changed in a block are written out. A rollback drops the windows, which are then
+reloaded.
+
+The per pair 24h windows also back the (per block maintained) trade statistics of asset_pair_market_info, see
+assets_trading.update_asset_pair_market_info.
+"""
+import logging
+import datetime
+import calendar
+import collections
+
+import pymongo
+
+from counterblock.lib import config
+from . import candles
+
+logger = logging.getLogger(__name__)
+
+WINDOW_24H = datetime.timedelta(days=1)
+WINDOW_7D = datetime.timedelta(days=7)
+
+trades_24h = collections.deque()  # (block_time, (base_asset, quote_asset)) of the windowed trades, in booking order
+asset_trades = {}  # asset -> deque of (block_time, traded quantity of the asset) of its windowed trades
+pair_trades = {}  # (base_asset, quote_asset) -> deque of (block_time, unit_price, base quantity, quote quantity)
+pair_hours = {}  # (base_asset, quote_asset) -> {hour start time: [unit price sum, trade count]}, over the 7d window
+prev_prices = {}  # (base_asset, quote_asset) -> unit price of the pair's last trade before the 24h window (or None)
+changed_assets = set()  # assets whose statistics are to be published with the next block
+changed_pairs = set()  # pairs whose 24h window changed (consumed by assets_trading.update_asset_pair_market_info)
+state = {'loaded': False, 'window_start': None, 'window_start_hour': None}
+
+
+def _is_published_pair(base_asset):
+    """Only the XCP/asset and BTC/asset markets have their OHLC and price history published"""
+    return base_asset in (config.XCP, config.BTC)
+
+
+def _add_trade(t):
+    pair = (t['base_asset'], t['quote_asset'])
+    trades_24h.append((t['block_time'], pair))
+    asset_trades.setdefault(t['base_asset'], collections.deque()).append((t['block_time'], t['base_quantity_normalized']))
+    asset_trades.setdefault(t['quote_asset'], collections.deque()).append((t['block_time'], t['quote_quantity_normalized']))
+    pair_trades.setdefault(pair, collections.deque()).append(
+        (t['block_time'], t['unit_price'], t['base_quantity_normalized'], t['quote_quantity_normalized']))
+    if _is_published_pair(t['base_asset']):
+        hour_slot = pair_hours.setdefault(pair, {}).setdefault(candles.get_interval_time(t['block_time'], '1h'), [0, 0])
+        hour_slot[0] += t['unit_price']
+        hour_slot[1] += 1
+    changed_assets.update(pair)
+    changed_pairs.add(pair)
+
+
+def add_trade(trade):
+    if state['loaded']:
+        _add_trade(trade)
+
+
+def mark_changed(assets):
+    """Has the statistics of the given assets published with the next block (e.g. as their asset_market_info
+    documents were just created)"""
+    if state['loaded']:
+        changed_assets.update(assets)
+
+
+def expire(now):
+    # trades are expired in the order they were booked (block times are not strictly increasing, so a trade may
+    # linger for a few blocks more than its exact 24h)
+    start_dt_1d = state['window_start'] = now - WINDOW_24H
+    while trades_24h and trades_24h[0][0] < start_dt_1d:
+        block_time, pair = trades_24h.popleft()
+        for asset in pair:
+            asset_trades[asset].popleft()
+            if not asset_trades[asset]:
+                del asset_trades[asset]
+        prev_prices[pair] = pair_trades[pair].popleft()[1]
+        if not pair_trades[pair]:
+            del pair_trades[pair]
+        changed_assets.update(pair)
+        changed_pairs.add(pair)
+
+    start_hour_7d = candles.get_interval_time(now - WINDOW_7D, '1h')
+    if state['window_start_hour'] != start_hour_7d:
+        for pair, hours in list(pair_hours.items()):
+            expired_hours = [hour for hour in hours if hour < start_hour_7d]
+            if not expired_hours:
+                continue
+            for hour in expired_hours:
+                del hours[hour]
+            if not hours:
+                del pair_hours[pair]
+            changed_assets.update(pair)
+        state['window_start_hour'] = start_hour_7d
+
+
+def _get_ohlc(pair):
+    trades = pair_trades.get(pair, None)
+    if not trades:
+        return {}
+    prices = [t[1] for t in trades]
+    return {
+        'open': prices[0],
+        'high': max(prices),
+        'low': min(prices),
+        'close': prices[-1],
+        'vol': sum(t[2] for t in trades),
+        'count': len(trades),
+    }
+
+
+def get_pair_stats(base_asset, quote_asset):
+    """Returns the number of trades and the base and quote volumes of the given pair over the 24h window, along with the
+    % change from the price of the last trade before the window to the latest one (None if there was no trade before)"""
+    pair = (base_asset, quote_asset)
+    if pair not in prev_prices:
+        prev_trade = config.mongo_db.trades.find_one(
+            {'base_asset': base_asset, 'quote_asset': quote_asset, 'block_time': {"$lt": state['window_start']}},
+            {'_id': 0, 'unit_price': 1}, sort=[("block_time", pymongo.DESCENDING)])
+        prev_prices[pair] = prev_trade['unit_price'] if prev_trade else None
+    trades = pair_trades.get(pair, ())
+    prev_price = prev_prices[pair]
+    if prev_price is None:  # no previous trade before this 24hr period
+        pct_change = None
+    else:
+        latest_price = trades[-1][1] if trades else prev_price
+        pct_change = ((latest_price - prev_price) / prev_price) * 100
+    return {
+        'completed_trades_count': len(trades),
+        'vol_base': sum(t[2] for t in trades),
+        'vol_quote': sum(t[3] for t in trades),
+        '24h_pct_change': pct_change,
+    }
+
+
+def get_pairs():
+    """Returns the pairs with trades in the 24h window"""
+    return list(pair_trades.keys())
+
+
+def _get_history(pair, invert=False):
+    # the average trade price of each hour long slot
+    return [[calendar.timegm(hour.timetuple()) * 1000, count / price_sum if invert else price_sum / count]
+            for hour, (price_sum, count) in sorted(pair_hours.get(pair, {}).items())]
+
+
+def _get_price_change(ohlc):
+    return 100 * (ohlc['close'] - ohlc['open']) / ohlc['open'] if ohlc else None
+
+
+def compile_market_info(asset):
+    """Returns the 24h and 7d statistics of the given asset, out of the windows"""
+    asset_vols = asset_trades.get(asset, ())
+    _24h_ohlc_in_xcp = _get_ohlc((config.XCP, asset)) if asset != config.XCP else {}
+    _24h_ohlc_in_btc = _get_ohlc((config.BTC, asset)) if asset != config.BTC else {}
+    if asset not in [config.BTC, config.XCP]:
+        _7d_history_in_xcp = _get_history((config.XCP, asset))  # xcp/asset market
+        _7d_history_in_btc = _get_history((config.BTC, asset))  # btc/asset market
+    else:  # get the XCP/BTC market and invert for BTC/XCP (_7d_history_in_btc)
+        _7d_history_in_xcp = _get_history((config.XCP, config.BTC))
+        _7d_history_in_btc = _get_history((config.XCP, config.BTC), invert=True)
+
+    return {
+        '24h_summary': {'vol': sum(quantity for block_time, quantity in asset_vols), 'count': len(asset_vols)},
+        #^ total quantity traded of that asset in all markets in last 24h
+        '24h_ohlc_in_{}'.format(config.XCP.lower()): _24h_ohlc_in_xcp,
+        '24h_ohlc_in_{}'.format(config.BTC.lower()): _24h_ohlc_in_btc,
+        '24h_vol_price_change_in_{}'.format(config.XCP.lower()): _get_price_change(_24h_ohlc_in_xcp),
+        #^ aggregated price change from 24h ago to now, expressed as a signed float (e.g. .54 is +54%, -1.12 is -112%)
+        '24h_vol_price_change_in_{}'.format(config.BTC.lower()): _get_price_change(_24h_ohlc_in_btc),
+        '7d_history_in_{}'.format(config.XCP.lower()): _7d_history_in_xcp,
+        '7d_history_in_{}'.format(config.BTC.lower()): _7d_history_in_btc,
+    }
+
+
+def publish():
+    for asset in changed_assets:
+        market_info = compile_market_info(asset)
+        config.mongo_db.asset_market_info.update({'asset': asset}, {"$set": market_info})
+        config.mongo_db.market_info_leaderboard.update({'asset': asset}, {"$set": market_info}, multi=True)
+    if changed_assets:
+        logger.debug("Published 24h/7d market statistics for: %s" % ', '.join(sorted(changed_assets)))
+    changed_assets.clear()
+
+
+def load(now):
+    """(Re)loads the windows out of the trades of the 7 days up to the given (block) time, and zeroes out the
+    statistics of the assets not traded over that period"""
+    clear()
+    trades = config.mongo_db.trades.find(
+        {'block_time': {"$gte": now - WINDOW_7D}},
+        {'_id': 0, 'block_index': 1, 'message_index': 1, 'block_time': 1, 'base_asset': 1, 'quote_asset': 1,
+         'unit_price': 1, 'base_quantity_normalized': 1, 'quote_quantity_normalized': 1}
+    ).sort([("block_index", pymongo.ASCENDING), ("message_index", pymongo.ASCENDING)])
+    for t in trades:
+        _add_trade(t)
+    state['loaded'] = True
+    for collection in (config.mongo_db.asset_market_info, config.mongo_db.market_info_leaderboard):
+        collection.update({'asset': {'$nin': list(changed_assets)}}, {"$set": compile_market_info(None)}, multi=True)
+    logger.info("Loaded %i trades into the 24h/7d market statistics windows" % len(trades_24h))
+
+
+def clear():
+    trades_24h.clear()
+    asset_trades.clear()
+    pair_trades.clear()
+    pair_hours.clear()
+    prev_prices.clear()
+    changed_assets.clear()
+    changed_pairs.clear()
+    state['loaded'] = False
+    state['window_start'] = None
+    state['window_start_hour'] = None
+
+
+def process_block(block_time):
+    """Moves the windows up to the given block time, and publishes the statistics that changed (the windows are only
+    loaded, and the statistics published, once counterblock is caught up)"""
+    if not state['loaded']:
+        if not config.state['caught_up']:
+            return
+        load(block_time)
+    expire(block_time)
+    publish()
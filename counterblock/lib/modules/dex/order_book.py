@@ -0,0 +1,314 @@
+"""
+In-process order book of the open DEX orders, per asset pair.
+
+The book is loaded from counterparty-server's open orders (once counterblock is caught up, or on first use), and then
+maintained from the orders, cancels and order_expirations messages. Each side of a pair's book keeps its price levels
+sorted, with the (raw) base quantity and number of orders at each level. As applying a message is idempotent, the
+messages of blocks already reflected in the loaded orders can safely be applied on top of them. A rollback drops the
+book, which is then reloaded.
+
+The pairs whose book changed are collected in changed_pairs, for their asset_pair_market_info to be updated (see
+assets_trading.update_asset_pair_market_info).
+"""
+import logging
+import bisect
+import calendar
+
+import gevent.event
+
+from counterblock.lib import config, util, blockchain, asset_registry, database, numeric
+
+logger = logging.getLogger(__name__)
+
+books = {}  # (base_asset, quote_asset) -> PairBook
+order_pairs = {}  # tx_hash -> (base_asset, quote_asset), for each order in the books
+state = {'loaded': False, 'loading': False}
+load_done = gevent.event.Event()  # set once the (latest) load of the book is over, for ensure_loaded to wait on
+buffered_messages = []  # (msg, msg_data) tuples received while the book was being loaded
+reopened_orders = set()  # tx_hash of the reopened orders not in the book, to be fetched (see fetch_reopened_orders)
+changed_pairs = set()  # (base_asset, quote_asset) of the books changed since the set was last consumed
+address_order_counts = {}  # source address -> {(base_asset, quote_asset): number of open orders}
+
+
+class PriceLevels(object):
+    """The price levels of one side of a pair's book, sorted by unit price"""
+    __slots__ = ('prices', 'levels')
+
+    def __init__(self):
+        self.prices = []  # sorted unit prices
+        self.levels = {}  # unit price -> [base quantity (raw), order count]
+
+    def add(self, unit_price, quantity):
+        level = self.levels.get(unit_price, None)
+        if level is None:
+            bisect.insort(self.prices, unit_price)
+            level = self.levels[unit_price] = [0, 0]
+        level[0] += quantity
+        level[1] += 1
+
+    def remove(self, unit_price, quantity):
+        level = self.levels[unit_price]
+        level[0] -= quantity
+        level[1] -= 1
+        if not level[1]:
+            del self.levels[unit_price]
+            del self.prices[bisect.bisect_left(self.prices, unit_price)]
+
+    def snapshot(self, base_divisible, descending):
+        """Returns the price levels as a list of dicts (with the normalized quantity and the cumulative depth at each
+        level), ordered from the best price out"""
+        result = []
+        depth = 0
+        for unit_price in (reversed(self.prices) if descending else self.prices):
+            quantity, count = self.levels[unit_price]
+            depth += quantity
+            result.append({
+                'unit_price': unit_price,
+                'quantity': blockchain.normalize_quantity(quantity, base_divisible),
+                'count': count,
+                'depth': blockchain.normalize_quantity(depth, base_divisible)})
+        return result
+
+
+class PairBook(object):
+    __slots__ = ('base_asset', 'quote_asset', 'orders', 'entries', 'bids', 'asks')
+
+    def __init__(self, base_asset, quote_asset):
+        self.base_asset = base_asset
+        self.quote_asset = quote_asset
+        self.orders = {}  # tx_hash -> open order (as returned by counterparty-server's get_orders)
+        self.entries = {}  # tx_hash -> (PriceLevels, unit price, base quantity) of the orders shown in the price levels
+        self.bids = PriceLevels()  # orders buying the base asset
+        self.asks = PriceLevels()  # orders selling the base asset
+
+    def price_entry(self, o):
+        """Returns the (unit price, base quantity) the given order adds to its side of the book"""
+        base_divisible = asset_registry.is_divisible(self.base_asset, True)
+        quote_divisible = asset_registry.is_divisible(self.quote_asset, True)
+        if o['give_asset'] == self.base_asset:
+            unit_price = numeric.unit_price(o['give_quantity'], o['get_quantity'], base_divisible, quote_divisible)
+            return float(unit_price), o['give_remaining']
+        else:
+            unit_price = numeric.unit_price(o['get_quantity'], o['give_quantity'], base_divisible, quote_divisible)
+            return float(unit_price), o['get_remaining']
+
+    def add_to_levels(self, levels, o):
+        if o['give_asset'] == config.BTC and o['give_quantity'] <= config.ORDER_BTC_DUST_LIMIT_CUTOFF:
+            return None  # filter dust orders
+        unit_price, quantity = self.price_entry(o)
+        levels.add(unit_price, quantity)
+        return (levels, unit_price, quantity)
+
+    def get_summary(self):
+        """Returns the number of orders shown in the book, and its lowest ask and highest bid prices (or None)"""
+        return (len(self.entries),
+                self.asks.prices[0] if self.asks.prices else None,
+                self.bids.prices[-1] if self.bids.prices else None)
+
+    def set_order(self, o):
+        self.remove_order(o['tx_hash'])
+        if o['status'] != 'open':
+            return
+        self.orders[o['tx_hash']] = o
+        order_pairs[o['tx_hash']] = (self.base_asset, self.quote_asset)
+        changed_pairs.add((self.base_asset, self.quote_asset))
+        pair_counts = address_order_counts.setdefault(o['source'], {})
+        pair_counts[(self.base_asset, self.quote_asset)] = pair_counts.get((self.base_asset, self.quote_asset), 0) + 1
+        if is_shown(o):
+            entry = self.add_to_levels(self.asks if o['give_asset'] == self.base_asset else self.bids, o)
+            if entry is not None:
+                self.entries[o['tx_hash']] = entry
+
+    def remove_order(self, tx_hash):
+        o = self.orders.pop(tx_hash, None)
+        if o is None:
+            return
+        order_pairs.pop(tx_hash, None)
+        changed_pairs.add((self.base_asset, self.quote_asset))
+        pair_counts = address_order_counts[o['source']]
+        pair_counts[(self.base_asset, self.quote_asset)] -= 1
+        if not pair_counts[(self.base_asset, self.quote_asset)]:
+            del pair_counts[(self.base_asset, self.quote_asset)]
+            if not pair_counts:
+                del address_order_counts[o['source']]
+        entry = self.entries.pop(tx_hash, None)
+        if entry is not None:
+            levels, unit_price, quantity = entry
+            levels.remove(unit_price, quantity)
+
+
+def is_shown(o):
+    """Orders involving BTC are only shown in the book while they have a remaining quantity on both ends"""
+    if o['give_asset'] != config.BTC and o['get_asset'] != config.BTC:
+        return True
+    return (o['give_remaining'] > 0 and o['get_remaining'] > 0 and
+            o['fee_required_remaining'] >= 0 and o['fee_provided_remaining'] >= 0)
+
+
+def set_order(o):
+    base_asset, quote_asset = util.assets_to_asset_pair(o['give_asset'], o['get_asset'])
+    if order_pairs.get(o['tx_hash'], (base_asset, quote_asset)) != (base_asset, quote_asset):
+        remove_order(o['tx_hash'])
+    book = books.get((base_asset, quote_asset), None)
+    if book is None:
+        if o['status'] != 'open':
+            return
+        book = books[(base_asset, quote_asset)] = PairBook(base_asset, quote_asset)
+    book.set_order(o)
+
+
+def remove_order(tx_hash):
+    pair = order_pairs.get(tx_hash, None)
+    if pair is not None:
+        books[pair].remove_order(tx_hash)
+
+
+def load():
+    """(Re)loads the book from counterparty-server's open orders"""
+    state['loading'] = True
+    load_done.clear()
+    del buffered_messages[:]
+    try:
+        open_orders = util.call_jsonrpc_api(
+            "get_orders", {'status': 'open', 'show_expired': False}, abort_on_error=True)['result']
+        books.clear()
+        order_pairs.clear()
+        address_order_counts.clear()
+        for o in open_orders:
+            if o['give_asset'] != o['get_asset']:
+                set_order(o)
+        state['loaded'] = True
+    except Exception:
+        state['loading'] = False
+        load_done.set()
+        raise
+    state['loading'] = False
+    # apply the messages processed while the orders were being fetched
+    try:
+        for msg, msg_data in buffered_messages:
+            _apply_message(msg, msg_data)
+        del buffered_messages[:]
+    finally:
+        load_done.set()
+    logger.info("Loaded %i open orders (in %i pairs) into the order book" % (len(order_pairs), len(books)))
+
+
+def ensure_loaded():
+    """Loads the book if it isn't, or waits for it to be loaded if another greenlet is loading it"""
+    if state['loading']:
+        load_done.wait()
+    elif not state['loaded']:
+        load()
+
+
+def clear():
+    books.clear()
+    order_pairs.clear()
+    address_order_counts.clear()
+    del buffered_messages[:]
+    reopened_orders.clear()
+    changed_pairs.clear()
+    state['loaded'] = False
+
+
+def process_message(msg, msg_data):
+    if state['loading']:
+        buffered_messages.append((msg, msg_data))
+    elif state['loaded']:
+        _apply_message(msg, msg_data)
+
+
+def _apply_message(msg, msg_data):
+    if msg['category'] == 'orders':
+        if msg['command'] == 'insert':
+            o = dict(msg_data)
+            o['block_time'] = config.state['cur_block']['block_time']
+            if o['give_asset'] != o['get_asset']:
+                set_order(o)
+        elif msg['command'] == 'update':
+            pair = order_pairs.get(msg_data['tx_hash'], None)
+            if pair is not None:
+                o = dict(books[pair].orders[msg_data['tx_hash']])
+                o.update(msg_data)
+                set_order(o)
+            elif msg_data.get('status', None) == 'open':
+                # an order we don't have in the book was reopened (e.g. after a BTC order match expired): the whole of
+                # it is fetched once the block is processed, out of the message processing
+                reopened_orders.add(msg_data['tx_hash'])
+    elif msg['category'] == 'cancels' and msg_data.get('status', 'valid') == 'valid':
+        remove_order(msg_data['offer_hash'])
+    elif msg['category'] == 'order_expirations':
+        remove_order(msg_data['order_hash'])
+
+
+def fetch_reopened_orders():
+    """Fetches the reopened orders from counterparty-server, and adds them to the book. As counterparty-server is at
+    least as far along as the messages processed, the orders fetched reflect any later message about them (which the
+    book ignored, not having them). Orders that couldn't be fetched are retried with the next block."""
+    tx_hashes = list(reopened_orders)
+    reopened_orders.clear()
+    try:
+        orders = util.call_jsonrpc_api(
+            "get_orders", {'filters': [{'field': 'tx_hash', 'op': 'IN', 'value': tx_hashes}]},
+            abort_on_error=True)['result']
+    except Exception as e:
+        logger.warn("Could not fetch reopened orders %s (will retry): %s" % (', '.join(tx_hashes), e))
+        if state['loaded']:
+            reopened_orders.update(tx_hashes)
+        return
+    if not state['loaded']:  # the book was dropped in the meantime
+        return
+    for o in orders:
+        if o['give_asset'] != o['get_asset']:
+            set_order(o)
+
+
+def get_orders(base_asset, quote_asset, give_asset=None):
+    """Returns (copies of) the open orders shown in the given pair's book, optionally only those giving the given
+    asset, ordered by tx_index"""
+    book = books.get((base_asset, quote_asset), None)
+    if book is None:
+        return []
+    orders = []
+    for o in book.orders.values():
+        if not is_shown(o) or (give_asset is not None and o['give_asset'] != give_asset):
+            continue
+        if o.get('block_time', None) is None:  # loaded from counterparty-server, and not yet looked up
+            block_time = database.get_block_time(o['block_index'])
+            o['block_time'] = calendar.timegm(block_time.timetuple()) if block_time else None
+        orders.append(dict(o))
+    orders.sort(key=lambda o: o['tx_index'])
+    return orders
+
+
+def get_pairs():
+    """Returns the pairs with open orders"""
+    return [pair for pair, book in books.items() if book.orders]
+
+
+def get_address_order_counts(addresses):
+    """Returns the number of open orders the given addresses have in each pair, as a list of ((base_asset, quote_asset),
+    order count) tuples, ordered by decreasing order count"""
+    counts = {}
+    for address in set(addresses):
+        for pair, count in address_order_counts.get(address, {}).items():
+            counts[pair] = counts.get(pair, 0) + count
+    return sorted(counts.items(), key=lambda e: e[1], reverse=True)
+
+
+def get_summary(base_asset, quote_asset):
+    book = books.get((base_asset, quote_asset), None)
+    return book.get_summary() if book is not None else (0, None, None)
+
+
+def get_levels(base_asset, quote_asset, is_bid_book, orders=None):
+    """Returns the price levels of the bid (or ask) side of the given pair's book, from the best price out. If `orders`
+    is given, the levels are built out of these orders (e.g. a filtered subset of the book's orders) instead"""
+    book = books.get((base_asset, quote_asset), None) or PairBook(base_asset, quote_asset)
+    if orders is None:
+        levels = book.bids if is_bid_book else book.asks
+    else:
+        levels = PriceLevels()
+        for o in orders:
+            book.add_to_levels(levels, o)
+    return levels.snapshot(asset_registry.is_divisible(base_asset, True), is_bid_book)
@@ -17,7 +17,7 @@ import pymongo
 from bson.son import SON
 import dateutil.parser
 
-from counterblock.lib import config, util, blockfeed, blockchain
+from counterblock.lib import config, util, blockfeed, blockchain, database
 from counterblock.lib.processor import MessageProcessor, MempoolMessageProcessor, BlockProcessor, StartUpProcessor, CaughtUpProcessor, RollbackProcessor, API, start_task, CORE_FIRST_PRIORITY
 
 logger = logging.getLogger(__name__)
@@ -87,15 +87,13 @@ def get_transaction_stats(start_ts=None, end_ts=None):
     return categories_list
 
 
-@StartUpProcessor.subscribe()
-def init():
-    # init db and indexes
-    # transaction_stats
-    config.mongo_db.transaction_stats.ensure_index([  # blockfeed.py, api.py
-        ("when", pymongo.ASCENDING),
-        ("category", pymongo.DESCENDING)
-    ])
-    config.mongo_db.transaction_stats.ensure_index('block_index')
+# transaction_stats
+database.register_index('transaction_stats', [  # blockfeed.py, api.py
+    ("block_time", pymongo.ASCENDING),
+    ("category", pymongo.DESCENDING)
+])
+database.register_index('transaction_stats', 'block_index')
+database.register_query_shape('transaction_stats', {'block_time': {'$gte': datetime.datetime(2016, 1, 1)}})
 
 
 @CaughtUpProcessor.subscribe()
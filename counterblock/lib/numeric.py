@@ -0,0 +1,63 @@
+"""
+Exact price and quantity math, done on integer (satoshi) quantities and rationals (fractions.Fraction), with the
+rounding mode given explicitly on each call. Unlike Decimal arithmetic, this doesn't depend on the (process wide)
+decimal context, so it can't be affected by (or affect) other greenlets.
+"""
+from fractions import Fraction
+
+from counterblock.lib import config
+
+ROUND_DOWN = 'down'  # towards zero
+ROUND_UP = 'up'  # away from zero
+ROUND_HALF_EVEN = 'half_even'
+
+
+def to_satoshis(quantity, divisible):
+    """Returns the given raw quantity in satoshi units (i.e. scaled up by config.UNIT if the asset is indivisible)"""
+    return quantity if divisible else quantity * config.UNIT
+
+
+def unit_price(base_quantity, quote_quantity, base_divisible, quote_divisible):
+    """Returns the exact price of the base asset, expressed in the quote asset, for the given raw quantities"""
+    return Fraction(to_satoshis(quote_quantity, quote_divisible), to_satoshis(base_quantity, base_divisible))
+
+
+def quantize(value, places=8, rounding=ROUND_HALF_EVEN):
+    """Rounds the given number to `places` decimal places, returning the result as an integer count of 10**-places"""
+    value = Fraction(value) * 10 ** places
+    sign = -1 if value < 0 else 1
+    value = abs(value)
+    result, remainder = divmod(value.numerator, value.denominator)
+    if remainder:
+        if rounding == ROUND_UP:
+            result += 1
+        elif rounding == ROUND_HALF_EVEN:
+            twice_remainder = 2 * remainder
+            if twice_remainder > value.denominator or (twice_remainder == value.denominator and result % 2):
+                result += 1
+        else:
+            assert rounding == ROUND_DOWN
+    return sign * result
+
+
+def to_float(value, places=8, rounding=ROUND_HALF_EVEN):
+    return quantize(value, places, rounding) / 10 ** places
+
+
+def format_number(value, places=8, rounding=ROUND_HALF_EVEN):
+    """Formats the given number as a string with exactly `places` decimal places"""
+    units = quantize(value, places, rounding)
+    digits = str(abs(units)).rjust(places + 1, '0')
+    result = digits[:-places] + '.' + digits[-places:] if places else digits
+    return '-' + result if units < 0 else result
+
+
+def format_price(base_quantity, quote_quantity, base_divisible, quote_divisible, rounding=ROUND_HALF_EVEN):
+    return format_number(unit_price(base_quantity, quote_quantity, base_divisible, quote_divisible), 8, rounding)
+
+
+def format_prices(rows):
+    """Batch version of format_price: takes an iterable of (base_quantity, quote_quantity, base_divisible,
+    quote_divisible, rounding) tuples, and returns the list of the formatted prices"""
+    return [format_price(base_quantity, quote_quantity, base_divisible, quote_divisible, rounding)
+            for base_quantity, quote_quantity, base_divisible, quote_divisible, rounding in rows]
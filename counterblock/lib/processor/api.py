@@ -4,7 +4,6 @@ import re
 import time
 import datetime
 import base64
-import decimal
 import operator
 import logging
 import copy
@@ -21,14 +20,12 @@ import flask
 import jsonrpc
 import pymongo
 
-from counterblock.lib import config, cache, database, util, blockchain, blockfeed, messages
+from counterblock.lib import config, asset_registry, cache, database, util, blockchain, blockfeed, messages
 from counterblock.lib.processor import API
 
 API_MAX_LOG_SIZE = 10 * 1024 * 1024  # max log size of 20 MB before rotation (make configurable later)
 API_MAX_LOG_COUNT = 10
 
-decimal.setcontext(decimal.Context(prec=8, rounding=decimal.ROUND_HALF_EVEN))
-D = decimal.Decimal
 logger = logging.getLogger(__name__)
 
 
@@ -394,7 +391,8 @@ def serve_api():
         if config.RPC_ALLOW_CORS:
             response.headers['Access-Control-Allow-Origin'] = '*'
             response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'DNT,X-Mx-ReqToken,Keep-Alive,User-Agent,X-Requested-With,If-Modified-Since,Cache-Control,Content-Type'
+            response.headers['Access-Control-Allow-Headers'] = 'DNT,X-Mx-ReqToken,Keep-Alive,User-Agent,X-Requested-With,If-Modified-Since,If-None-Match,Cache-Control,Content-Type'
+            response.headers['Access-Control-Expose-Headers'] = 'ETag'
 
     @app.route('/', methods=["OPTIONS", ])
     @app.route('/api/', methods=["OPTIONS", ])
@@ -497,6 +495,17 @@ def serve_api():
         _set_cors_headers(response)
         return response
 
+    @app.route('/api/assets/names', methods=["GET", ])
+    def handle_get_asset_names():
+        # the (precomputed) listing of all asset names and longnames, as returned by get_assets_names_and_longnames,
+        # with an ETag, so that repeat callers get a 304 if the listing didn't change
+        listing = asset_registry.get_listing()
+        response = flask.Response(listing['data'], 200, mimetype='application/json')
+        response.set_etag(listing['etag'])
+        response = response.make_conditional(flask.request)
+        _set_cors_headers(response)
+        return response
+
     @app.route('/', methods=["POST", ])
     @app.route('/api/', methods=["POST", ])
     def handle_post():
@@ -2,9 +2,19 @@ import gevent
 import logging
 import time
 
-from counterblock.lib import config
+from counterblock.lib import config, database
 from counterblock.lib.processor import CaughtUpProcessor, CORE_FIRST_PRIORITY, CORE_LAST_PRIORITY, start_task
 
+AUDIT_INDEXES_PERIOD = 6 * 60 * 60  # in seconds (this is every 6 hours currently)
+
 logger = logging.getLogger(__name__)
 
-# TODO: Place any core CaughtUpProcessor tasks here
+
+def task_audit_indexes():
+    database.audit_indexes()
+    start_task(task_audit_indexes, delay=AUDIT_INDEXES_PERIOD)
+
+
+@CaughtUpProcessor.subscribe(priority=CORE_LAST_PRIORITY - 0)
+def start_audit_indexes():
+    start_task(task_audit_indexes)
@@ -4,7 +4,7 @@ import json
 import time
 import logging
 
-from counterblock.lib import blockfeed, blockchain, config, cache, database, util
+from counterblock.lib import asset_registry, blockfeed, blockchain, config, cache, database, util
 from counterblock.lib.processor import StartUpProcessor, CORE_FIRST_PRIORITY, CORE_LAST_PRIORITY, api, start_task
 
 logger = logging.getLogger(__name__)
@@ -13,7 +13,12 @@ logger = logging.getLogger(__name__)
 @StartUpProcessor.subscribe(priority=CORE_FIRST_PRIORITY - 0)
 def init_mongo():
     config.mongo_db = database.get_connection()  # should be able to access fine across greenlets, etc
-    database.init_base_indexes()
+    # unique indexes must be there before any document is written (or duplicates could get in, and make their build
+    # fail), the others are built in the background
+    database.build_indexes(background=False, unique=True)
+    start_task(database.build_indexes)
+    database.init_block_times()
+    asset_registry.load()
 
 
 @StartUpProcessor.subscribe(priority=CORE_FIRST_PRIORITY - 1)
@@ -0,0 +1,61 @@
+# as in server.py, have grequests monkey patch (before anything else is imported)
+import grequests  # this will monkey patch
+
+import datetime
+
+import mongomock
+import pytest
+
+from counterblock.lib import config, asset_registry
+
+FIRST_BLOCK_INDEX = 400000
+FIRST_BLOCK_TIME = datetime.datetime(2016, 1, 1)
+
+
+@pytest.fixture
+def set_block(monkeypatch):
+    """Returns a function that sets the block being processed (its block time defaults to 10 minutes per block on from
+    FIRST_BLOCK_TIME)"""
+    def set_block(block_index, block_time=None):
+        if block_time is None:
+            block_time = FIRST_BLOCK_TIME + datetime.timedelta(minutes=10 * (block_index - FIRST_BLOCK_INDEX))
+        monkeypatch.setitem(config.state, 'cur_block', {'block_index': block_index, 'block_time_obj': block_time})
+    return set_block
+
+
+@pytest.fixture
+def mongo_db(monkeypatch, set_block):
+    """An empty in-memory database as config.mongo_db, with FIRST_BLOCK_INDEX as the block being processed"""
+    db = mongomock.MongoClient().counterblockd_test
+    monkeypatch.setattr(config, 'mongo_db', db)
+    set_block(FIRST_BLOCK_INDEX)
+    return db
+
+
+@pytest.fixture
+def register_asset():
+    """Returns a function that adds an asset to the asset registry (which is emptied out again after the test)"""
+    def register_asset(asset, divisible=True, total_issued=None, asset_longname=None):
+        return asset_registry.update(
+            {'asset': asset, 'asset_longname': asset_longname, 'divisible': divisible, 'total_issued': total_issued})
+    asset_registry.clear()
+    yield register_asset
+    asset_registry.clear()
+
+
+@pytest.fixture
+def book_trade():
+    """Returns a function that books a (non BTC, completed) order match as a trade in the current block, selling
+    forward_quantity of forward_asset for backward_quantity of backward_asset"""
+    from counterblock.lib.modules import dex
+
+    def book_trade(message_index, forward_asset, forward_quantity, backward_asset, backward_quantity):
+        dex.parse_trade_book({'category': 'order_matches', 'command': 'insert', 'message_index': message_index}, {
+            'status': 'completed', 'tx0_hash': '%064x' % (2 * message_index), 'tx1_hash': '%064x' % (2 * message_index + 1),
+            'tx0_index': 2 * message_index, 'tx1_index': 2 * message_index + 1,
+            'tx0_address': 'seller_address', 'tx1_address': 'buyer_address',
+            'forward_asset': forward_asset, 'forward_quantity': forward_quantity,
+            'backward_asset': backward_asset, 'backward_quantity': backward_quantity})
+    yield book_trade
+    dex.market_summary_pairs.clear()
+    dex.market_summary_supply_changed_assets.clear()
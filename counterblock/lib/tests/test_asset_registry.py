@@ -0,0 +1,69 @@
+import pytest
+
+from counterblock.lib import config, asset_registry
+
+
+@pytest.fixture(autouse=True)
+def registry(mongo_db):
+    config.mongo_db.tracked_assets.insert([
+        {'asset': 'BETA', 'asset_longname': None, 'divisible': True, 'total_issued': 100},
+        {'asset': 'A1000000000000000001', 'asset_longname': 'BETA.sub', 'divisible': False, 'total_issued': 5},
+        {'asset': 'ALPHA', 'asset_longname': None, 'divisible': True, 'total_issued': 200}])
+    asset_registry.load()
+    yield
+    asset_registry.clear()
+
+
+def test_load():
+    assert asset_registry.get('ALPHA').supply == 200
+    assert asset_registry.is_divisible('A1000000000000000001') is False
+    assert asset_registry.resolve('BETA.sub').asset == 'A1000000000000000001'
+    assert asset_registry.get_longname('A1000000000000000001') == 'BETA.sub'
+    assert asset_registry.get('GAMMA') is None
+    assert asset_registry.get_supply('GAMMA', 0) == 0
+    assert asset_registry.get_supply(config.BTC) == 0
+
+
+def test_search():
+    # names and longnames both match, and each asset is returned once
+    assert [r.asset for r in asset_registry.search('be')] == ['BETA', 'A1000000000000000001']
+    assert [r.asset for r in asset_registry.search('a')] == ['A1000000000000000001', 'ALPHA']
+    assert [r.asset for r in asset_registry.search('a', limit=1)] == ['A1000000000000000001']
+    assert asset_registry.search('Z') == []
+
+
+def test_update():
+    asset_registry.update(
+        {'asset': 'A1000000000000000001', 'asset_longname': 'ALPHA.sub', 'divisible': False, 'total_issued': 5})
+    assert asset_registry.get_by_longname('BETA.sub') is None
+    assert asset_registry.resolve('ALPHA.sub').asset == 'A1000000000000000001'
+    assert [r.asset for r in asset_registry.search('BE')] == ['BETA']
+
+    # a supply change updates the record in place
+    record = asset_registry.get('ALPHA')
+    asset_registry.update({'asset': 'ALPHA', 'asset_longname': None, 'divisible': True, 'total_issued': 300})
+    assert asset_registry.get('ALPHA') is record and record.supply == 300
+
+
+def test_listing():
+    listing = asset_registry.get_listing()
+    etag = listing['etag']
+    assert sorted(e['asset'] for e in listing['entries']) == ['A1000000000000000001', 'ALPHA', 'BETA']
+
+    # a supply change doesn't change the listing, while a new asset does
+    asset_registry.update({'asset': 'ALPHA', 'asset_longname': None, 'divisible': True, 'total_issued': 300})
+    assert asset_registry.get_listing()['etag'] == etag
+    asset_registry.update({'asset': 'GAMMA', 'asset_longname': None, 'divisible': True, 'total_issued': 1})
+    assert asset_registry.get_listing()['etag'] != etag
+    assert 'GAMMA' in asset_registry.get_listing()['data']
+
+
+def test_reload():
+    config.mongo_db.tracked_assets.remove({'asset': 'A1000000000000000001'})
+    config.mongo_db.tracked_assets.update({'asset': 'ALPHA'}, {'$set': {'total_issued': 50}})
+    asset_registry.reload(['A1000000000000000001', 'ALPHA'])
+
+    assert asset_registry.get('A1000000000000000001') is None
+    assert asset_registry.resolve('BETA.sub') is None
+    assert [r.asset for r in asset_registry.search('BE')] == ['BETA']
+    assert asset_registry.get_supply('ALPHA') == 50
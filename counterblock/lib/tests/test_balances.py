@@ -0,0 +1,112 @@
+import pytest
+
+from counterblock.lib.modules import assets
+
+
+@pytest.fixture(autouse=True)
+def balances(mongo_db, register_asset, monkeypatch):
+    register_asset('TESTASSET', total_issued=1000)
+    monkeypatch.setattr(assets, 'balance_cache_complete', False)
+    assets.balance_cache.clear()
+    yield
+    assets.balance_cache.clear()
+
+
+def parse_credit(address, quantity, asset='TESTASSET', category='credits'):
+    assets.parse_balance_change(
+        {'category': category, 'message_index': 0}, {'address': address, 'asset': asset, 'quantity': quantity})
+
+
+def parse_debit(address, quantity, asset='TESTASSET'):
+    parse_credit(address, quantity, asset=asset, category='debits')
+
+
+def get_balance_changes(mongo_db, address):
+    return [(e['block_index'], e['quantity'], e['new_balance'])
+            for e in mongo_db.balance_changes.find({'address': address}).sort('block_index')]
+
+
+def test_balance_changes(mongo_db, set_block):
+    parse_credit('address_a', 100)
+    parse_debit('address_a', 30)  # (merged into the block's balance change)
+    set_block(400001)
+    parse_debit('address_a', 20)
+    assert get_balance_changes(mongo_db, 'address_a') == [(400000, 70, 70), (400001, -20, 50)]
+    assert mongo_db.current_balances.find_one({'address': 'address_a'})['quantity'] == 50
+
+
+def test_balance_cache(mongo_db, set_block):
+    parse_credit('address_a', 100)
+    assert assets.get_last_balance_change('address_a', 'TESTASSET')['new_balance'] == 100
+
+    # the last balance change is served from the cache, rather than looked up again
+    mongo_db.balance_changes.remove({})
+    set_block(400001)
+    parse_credit('address_a', 5)
+    assert get_balance_changes(mongo_db, 'address_a') == [(400001, 5, 105)]
+
+    # a miss is looked up in balance_changes, unless the cache is known to hold every (address, asset) pair
+    mongo_db.balance_changes.insert({'address': 'address_b', 'asset': 'TESTASSET', 'block_index': 400000, 'new_balance': 7})
+    assert assets.get_last_balance_change('address_b', 'TESTASSET')['new_balance'] == 7
+    assets.balance_cache_complete = True
+    assert assets.get_last_balance_change('address_b', 'TESTASSET') is None
+
+
+def test_balance_cache_eviction(monkeypatch):
+    monkeypatch.setattr(assets, 'BALANCE_CACHE_MAX_ENTRIES', 2)
+    assets.balance_cache_complete = True
+    parse_credit('address_a', 1)
+    parse_credit('address_b', 1)
+    assets.get_last_balance_change('address_a', 'TESTASSET')  # (address_a is now the most recently used)
+    parse_credit('address_c', 1)
+
+    # the least recently used entry is evicted, and the cache is no longer complete
+    assert list(assets.balance_cache) == [('address_a', 'TESTASSET'), ('address_c', 'TESTASSET')]
+    assert assets.balance_cache_complete is False
+    assert assets.get_last_balance_change('address_b', 'TESTASSET')['new_balance'] == 1
+
+
+def test_unknown_asset(mongo_db):
+    parse_credit('address_a', 1, asset='UNKNOWN')
+    assert mongo_db.balance_changes.count() == 0
+    assert mongo_db.current_balances.count() == 0
+
+
+def test_rollback(mongo_db, set_block):
+    parse_credit('address_a', 100)
+    set_block(400001)
+    parse_debit('address_a', 40)
+    parse_credit('address_b', 10)
+    set_block(400002)
+    parse_debit('address_a', 60)
+
+    assets.process_rollback(400000)
+    assert get_balance_changes(mongo_db, 'address_a') == [(400000, 100, 100)]
+    assert [(e['address'], e['quantity'], e['block_index']) for e in mongo_db.current_balances.find()] == [
+        ('address_a', 100, 400000)]
+    assert assets.balance_cache == {}
+
+    # the balances carry on from the restored ones
+    set_block(400001)
+    parse_debit('address_a', 1)
+    assert get_balance_changes(mongo_db, 'address_a') == [(400000, 100, 100), (400001, -1, 99)]
+
+
+def test_holder_counts(mongo_db, set_block):
+    parse_credit('address_a', 100)
+    parse_credit('address_b', 300)
+    parse_debit('address_a', 100)  # (address_a no longer holds any)
+    assert assets.get_asset_holder_counts(['TESTASSET', 'OTHERASSET']) == {'TESTASSET': 1, 'OTHERASSET': 0}
+    set_block(400001)
+    parse_credit('address_a', 50)
+    parse_credit('address_c', 150)
+    assert assets.get_asset_holder_counts(['TESTASSET']) == {'TESTASSET': 3}
+
+    top_holders = assets.get_asset_top_holders('TESTASSET', limit=2)
+    assert top_holders['holder_count'] == 3
+    assert [(h['address'], h['quantity'], h['pct_of_supply']) for h in top_holders['top_holders']] == [
+        ('address_b', 300, 30.0), ('address_c', 150, 15.0)]
+
+    # the holders of the rolled back balances are recounted
+    assets.process_rollback(400000)
+    assert assets.get_asset_holder_counts(['TESTASSET']) == {'TESTASSET': 1}
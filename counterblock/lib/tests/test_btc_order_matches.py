@@ -0,0 +1,85 @@
+import pytest
+
+from counterblock.lib import config
+from counterblock.lib.modules import dex
+
+
+@pytest.fixture(autouse=True)
+def market(mongo_db, register_asset, monkeypatch):
+    register_asset(config.XCP)
+    register_asset(config.BTC)
+    monkeypatch.setitem(config.state, 'caught_up', False)
+    yield
+    dex.market_summary_pairs.clear()
+
+
+def order_match_id(n):
+    return '%064x_%064x' % (2 * n, 2 * n + 1)
+
+
+def parse_order_match(command, msg_data):
+    msg = {'category': 'order_matches', 'command': command, 'message_index': 0}
+    dex.parse_btc_order_matches(msg, msg_data)
+    dex.parse_trade_book(msg, msg_data)
+
+
+def insert_match(n):
+    # selling 100 XCP for 1 BTC
+    parse_order_match('insert', {
+        'id': order_match_id(n), 'status': 'pending',
+        'tx0_hash': '%064x' % (2 * n), 'tx1_hash': '%064x' % (2 * n + 1), 'tx0_index': 2 * n, 'tx1_index': 2 * n + 1,
+        'tx0_address': 'seller_address', 'tx1_address': 'buyer_address',
+        'forward_asset': config.XCP, 'forward_quantity': 100 * config.UNIT,
+        'backward_asset': config.BTC, 'backward_quantity': config.UNIT})
+
+
+def resolve_match(n, status='completed'):
+    parse_order_match('update', {'order_match_id': order_match_id(n), 'status': status})
+
+
+def get_resolved_block_indexes(mongo_db):
+    return dict((e['order_match_id'], e['resolved_block_index']) for e in mongo_db.btc_order_matches.find())
+
+
+def test_btc_order_match_booked(mongo_db, set_block):
+    insert_match(1)
+    insert_match(2)
+    assert mongo_db.trades.count() == 0
+    assert get_resolved_block_indexes(mongo_db) == {order_match_id(1): None, order_match_id(2): None}
+
+    # the trade is booked out of the stored match once it is completed
+    set_block(400001)
+    resolve_match(1)
+    resolve_match(2, status='expired')
+    assert [(t['order_match_id'], t['base_asset'], t['quote_asset'], t['base_quantity'], t['quote_quantity'], t['block_index'])
+            for t in mongo_db.trades.find()] == [
+        (order_match_id(1), config.XCP, config.BTC, 100 * config.UNIT, config.UNIT, 400001)]
+    assert get_resolved_block_indexes(mongo_db) == {order_match_id(1): 400001, order_match_id(2): 400001}
+
+    # the resolved matches are kept for as deep as a reorg may go
+    set_block(400001 + config.MAX_FORCED_REORG_NUM_BLOCKS)
+    dex.prune_btc_order_matches()
+    assert mongo_db.btc_order_matches.count() == 2
+    set_block(400002 + config.MAX_FORCED_REORG_NUM_BLOCKS)
+    dex.prune_btc_order_matches()
+    assert mongo_db.btc_order_matches.count() == 0
+
+
+def test_btc_order_match_rollback(mongo_db, set_block):
+    insert_match(1)
+    set_block(400001)
+    resolve_match(1)
+    insert_match(2)
+
+    # the matches resolved after the rollback point are pending again, and the ones created after it are dropped
+    dex.process_rollback(400000)
+    assert get_resolved_block_indexes(mongo_db) == {order_match_id(1): None}
+    assert mongo_db.trades.count() == 0
+    resolve_match(1)
+    assert [t['order_match_id'] for t in mongo_db.trades.find()] == [order_match_id(1)]
+
+
+def test_btc_order_match_not_found(mongo_db):
+    # (e.g. after a rollback deeper than the resolved matches are kept for)
+    resolve_match(1)
+    assert mongo_db.trades.count() == 0
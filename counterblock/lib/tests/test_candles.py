@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+from counterblock.lib import config
+from counterblock.lib.modules import dex
+from counterblock.lib.modules.dex import candles
+
+ASSET = 'TESTASSET'
+
+
+@pytest.fixture(autouse=True)
+def market(mongo_db, register_asset):
+    register_asset(config.XCP)
+    register_asset(ASSET, total_issued=1000 * config.UNIT)
+
+
+def get_candles(mongo_db, interval):
+    return [(c['interval_time'], c['open'], c['high'], c['low'], c['close'], c['vol'], c['count'])
+            for c in mongo_db.trade_candles.find({'interval': interval}).sort('interval_time')]
+
+
+def book_trades(set_block, book_trade):
+    # TESTASSET/XCP trades at 2 (00:00), 3 (00:10) and 4 (01:00) XCP
+    for message_index, (block_index, price) in enumerate([(400000, 2), (400001, 3), (400006, 4)]):
+        set_block(block_index)
+        book_trade(message_index, ASSET, 10 * config.UNIT, config.XCP, price * 10 * config.UNIT)
+
+
+def test_get_interval_time():
+    dt = datetime.datetime(2016, 5, 3, 14, 37, 12)
+    assert candles.get_interval_time(dt, '5m') == datetime.datetime(2016, 5, 3, 14, 35, 0)
+    assert candles.get_interval_time(dt, '1h') == datetime.datetime(2016, 5, 3, 14, 0, 0)
+    assert candles.get_interval_time(dt, '1d') == datetime.datetime(2016, 5, 3, 0, 0, 0)
+    # a time on an interval boundary starts that interval
+    assert candles.get_interval_time(datetime.datetime(2016, 5, 3, 14, 0, 0), '1h') == datetime.datetime(2016, 5, 3, 14, 0, 0)
+    assert candles.get_interval_time(datetime.datetime(2016, 12, 31, 23, 59, 59), '1h') == datetime.datetime(2016, 12, 31, 23, 0, 0)
+
+
+def test_add_trade(mongo_db, set_block, book_trade):
+    book_trades(set_block, book_trade)
+    day = datetime.datetime(2016, 1, 1)
+    assert get_candles(mongo_db, '5m') == [
+        (day, 2.0, 2.0, 2.0, 2.0, 10.0, 1),
+        (day.replace(minute=10), 3.0, 3.0, 3.0, 3.0, 10.0, 1),
+        (day.replace(hour=1), 4.0, 4.0, 4.0, 4.0, 10.0, 1)]
+    assert get_candles(mongo_db, '1h') == [
+        (day, 2.0, 3.0, 2.0, 3.0, 20.0, 2),
+        (day.replace(hour=1), 4.0, 4.0, 4.0, 4.0, 10.0, 1)]
+    assert get_candles(mongo_db, '1d') == [(day, 2.0, 4.0, 2.0, 4.0, 30.0, 3)]
+    candle = mongo_db.trade_candles.find_one({'interval': '1d'})
+    assert candle['quote_vol'] == 90.0
+    assert candle['price_sum'] == 9.0
+    assert candle['last_block_index'] == 400006
+
+
+def test_process_rollback(mongo_db, set_block, book_trade):
+    book_trades(set_block, book_trade)
+    mongo_db.trades.remove({'block_index': {'$gt': 400000}})
+    candles.process_rollback(400000)
+    day = datetime.datetime(2016, 1, 1)
+    assert get_candles(mongo_db, '5m') == [(day, 2.0, 2.0, 2.0, 2.0, 10.0, 1)]
+    assert get_candles(mongo_db, '1h') == [(day, 2.0, 2.0, 2.0, 2.0, 10.0, 1)]
+    assert get_candles(mongo_db, '1d') == [(day, 2.0, 2.0, 2.0, 2.0, 10.0, 1)]
+    assert mongo_db.trade_candles.find({'last_block_index': {'$gt': 400000}}).count() == 0
+
+
+def test_rebuild_candle(mongo_db, set_block, book_trade):
+    book_trades(set_block, book_trade)
+    candle = mongo_db.trade_candles.find_one({'interval': '1h', 'interval_time': datetime.datetime(2016, 1, 1)})
+    mongo_db.trade_candles.update({'_id': candle['_id']}, {'$set': {'count': 0, 'high': 0}})
+    candles.rebuild_candle(candle)
+    assert get_candles(mongo_db, '1h')[0] == (datetime.datetime(2016, 1, 1), 2.0, 3.0, 2.0, 3.0, 20.0, 2)
+
+
+def test_get_market_price_history(set_block, book_trade):
+    book_trades(set_block, book_trade)
+    start_ts = 1451606400  # 2016-01-01
+    assert dex.get_market_price_history(ASSET, config.XCP, start_ts=start_ts, end_ts=start_ts + 3600) == [
+        [start_ts * 1000, 2.0, 3.0, 2.0, 3.0, 20.0, 2, 2.5],
+        [(start_ts + 3600) * 1000, 4.0, 4.0, 4.0, 4.0, 10.0, 1, 4.0]]
+    history = dex.get_market_price_history(config.XCP, ASSET, start_ts=start_ts + 3600, end_ts=start_ts + 7200, as_dict=True)
+    assert history == [{'interval_time': (start_ts + 3600) * 1000, 'open': 4.0, 'high': 4.0, 'low': 4.0, 'close': 4.0,
+                        'vol': 10.0, 'count': 1, 'midline': 4.0}]
+    assert dex.get_market_price_history(ASSET, config.XCP, start_ts=start_ts + 7200, end_ts=start_ts + 9000) is False
@@ -0,0 +1,57 @@
+from counterblock.lib import config, database
+from counterblock.lib.modules import assets
+
+ORDER_HASH = 'a' * 64
+
+
+def parse_order(command, **msg_data):
+    msg_data['tx_hash'] = ORDER_HASH
+    assets.parse_escrow({'category': 'orders', 'command': command}, msg_data)
+
+
+def get_escrows(mongo_db):
+    return list(mongo_db.escrows.find({}, {'_id': 0, 'escrow_id': 1, 'address': 1, 'asset': 1, 'quantity': 1}))
+
+
+def test_order_escrow(mongo_db, set_block):
+    parse_order('insert', status='open', source='source_address', give_asset=config.XCP, give_remaining=100)
+    assert get_escrows(mongo_db) == [
+        {'escrow_id': 'order_' + ORDER_HASH, 'address': 'source_address', 'asset': config.XCP, 'quantity': 100}]
+    assert assets.get_escrowed_balances(['source_address']) == {'source_address': {config.XCP: 100}}
+
+    set_block(400001)
+    parse_order('update', status='open', give_remaining=60)
+    assert get_escrows(mongo_db)[0]['quantity'] == 60
+
+    set_block(400002)
+    parse_order('update', status='cancelled', give_remaining=60)
+    assert get_escrows(mongo_db) == []
+    assert assets.get_escrowed_balances(['source_address']) == {}
+
+
+def test_btc_order_not_escrowed(mongo_db):
+    parse_order('insert', status='open', source='source_address', give_asset=config.BTC, give_remaining=100)
+    parse_order('update', status='open', give_remaining=50)
+    assert get_escrows(mongo_db) == []
+    assert mongo_db.escrow_versions.count() == 0
+
+
+def test_order_reopened(mongo_db, set_block):
+    parse_order('insert', status='open', source='source_address', give_asset=config.XCP, give_remaining=100)
+    # filled by a (pending) BTC match
+    set_block(400001)
+    parse_order('update', status='filled', give_remaining=0)
+    assert get_escrows(mongo_db) == []
+    # the match expires, and the order is reopened
+    set_block(400002)
+    parse_order('update', status='open', give_remaining=100)
+    assert get_escrows(mongo_db) == [
+        {'escrow_id': 'order_' + ORDER_HASH, 'address': 'source_address', 'asset': config.XCP, 'quantity': 100}]
+
+    # rolling back the reopening (and then the fill) restores each previous state
+    database.rollback_versioned_collection(
+        mongo_db.escrows, mongo_db.escrow_versions, 'escrow_id', 400001, is_live=lambda escrow: escrow['quantity'] > 0)
+    assert get_escrows(mongo_db) == []
+    database.rollback_versioned_collection(
+        mongo_db.escrows, mongo_db.escrow_versions, 'escrow_id', 400000, is_live=lambda escrow: escrow['quantity'] > 0)
+    assert get_escrows(mongo_db)[0]['quantity'] == 100
@@ -0,0 +1,51 @@
+from counterblock.lib import config
+from counterblock.lib.modules import dex
+from counterblock.lib.modules.dex import assets_trading
+
+
+def add_market_info(asset, market_cap_in_xcp, market_cap_in_btc=None):
+    config.mongo_db.asset_market_info.insert({
+        'asset': asset,
+        'price_in_xcp': 1.0 if market_cap_in_xcp is not None else None,
+        'market_cap_in_xcp': market_cap_in_xcp,
+        'price_in_btc': 1.0 if market_cap_in_btc is not None else None,
+        'market_cap_in_btc': market_cap_in_btc})
+
+
+def test_leaderboard_ranking(mongo_db):
+    add_market_info('AAA', 10, 5)
+    add_market_info('BBB', 30)
+    add_market_info('CCC', 20, 50)
+    add_market_info('DDD', None)  # (no price on either market)
+    config.mongo_db.asset_extended_info.insert(
+        {'asset': 'CCC', 'processed': True, 'image': 'http://example.com/ccc.png', 'description': 'ccc'})
+    assets_trading.compile_market_info_leaderboard()
+
+    leaderboard = dex.get_market_info_leaderboard()
+    assert [a['asset'] for a in leaderboard['xcp']] == ['BBB', 'CCC', 'AAA']
+    assert [a['asset'] for a in leaderboard['btc']] == ['CCC', 'AAA']
+    ccc = leaderboard['xcp'][1]
+    assert ccc['extended_image'] is True and ccc['extended_description'] == 'ccc'
+    assert [a['asset'] for a in dex.get_market_info_leaderboard(limit=1)['xcp']] == ['BBB']
+
+
+def test_leaderboard_recompile(mongo_db):
+    for i in range(3):
+        add_market_info('A%d' % i, i + 1)
+    assets_trading.compile_market_info_leaderboard()
+    config.mongo_db.asset_market_info.remove({'asset': 'A2'})
+    assets_trading.compile_market_info_leaderboard()
+
+    # the stale third rank is removed, rather than left behind
+    assert config.mongo_db.market_info_leaderboard.count({'market': 'xcp'}) == 2
+    assert [a['asset'] for a in dex.get_market_info_leaderboard()['xcp']] == ['A1', 'A0']
+
+
+def test_leaderboard_max_ranks(mongo_db, monkeypatch):
+    monkeypatch.setattr(assets_trading, 'LEADERBOARD_MAX_RANKS', 2)
+    for i in range(4):
+        add_market_info('A%d' % i, i + 1)
+    assets_trading.compile_market_info_leaderboard()
+
+    assert config.mongo_db.market_info_leaderboard.count({'market': 'xcp'}) == 2
+    assert [a['asset'] for a in dex.get_market_info_leaderboard()['xcp']] == ['A3', 'A2']
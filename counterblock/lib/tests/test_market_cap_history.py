@@ -0,0 +1,45 @@
+import pytest
+
+from counterblock.lib import config, blockchain
+from counterblock.lib.modules.dex import assets_trading
+
+ASSET = 'TESTASSET'
+
+
+@pytest.fixture(autouse=True)
+def market(mongo_db, register_asset, monkeypatch):
+    register_asset(config.XCP)
+    register_asset(ASSET, total_issued=1000 * config.UNIT)
+    monkeypatch.setattr(blockchain, 'get_xcp_supply', lambda normalize=False: 100.0)
+    # TESTASSET is issued at block 400000, and its supply doubled at block 400002
+    mongo_db.tracked_asset_versions.insert([
+        {'asset': ASSET, '_at_block': 400000, 'total_issued_normalized': 1000.0},
+        {'asset': ASSET, '_at_block': 400002, 'total_issued_normalized': 2000.0}])
+
+
+def get_market_cap_history(mongo_db, asset):
+    return [(e['block_index'], e['market_cap']) for e in mongo_db.asset_marketcap_history.find(
+        {'asset': asset, 'market_cap_as': config.XCP}).sort('block_index')]
+
+
+def test_market_cap_history(mongo_db, set_block, book_trade):
+    for block_index in (400001, 400002, 400003):
+        set_block(block_index)
+        book_trade(block_index, ASSET, config.UNIT, config.XCP, 4 * config.UNIT)
+    set_block(400004)
+    book_trade(400004, ASSET, config.UNIT, config.XCP, 2 * config.UNIT)
+
+    assets_trading.compile_market_cap_history(400000, 400003)
+    # (a point is only added as the market cap changes)
+    assert get_market_cap_history(mongo_db, ASSET) == [(400001, 250.0), (400002, 500.0)]
+    assert get_market_cap_history(mongo_db, config.XCP) == [(400001, 100.0)]
+    assert mongo_db.asset_marketcap_history.count({'market_cap_as': config.BTC}) == 0
+
+    # the next compile carries on from the market caps (and prices) up to its first block
+    assets_trading.compile_market_cap_history(400003, 400004)
+    # (the market price being weighted by the volume of the last trades, i.e. 5 for each of the 4 XCP ones, and 3 for
+    # the latest)
+    market_price = (3 * 5 * 4.0 + 3 * 2.0) / (3 * 5 + 3)
+    assert get_market_cap_history(mongo_db, ASSET) == [
+        (400001, 250.0), (400002, 500.0), (400004, pytest.approx(2000.0 / market_price, abs=1e-4))]
+    assert get_market_cap_history(mongo_db, config.XCP) == [(400001, 100.0)]
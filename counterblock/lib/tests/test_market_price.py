@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from counterblock.lib import config
+from counterblock.lib.modules import dex
+from counterblock.lib.modules.dex import assets_trading
+from counterblock.lib.tests.conftest import FIRST_BLOCK_TIME
+
+ASSET = 'TESTASSET'
+START_DT = FIRST_BLOCK_TIME - datetime.timedelta(days=1)
+
+
+@pytest.fixture(autouse=True)
+def market(mongo_db, register_asset, monkeypatch):
+    register_asset(config.XCP)
+    register_asset(ASSET, total_issued=1000 * config.UNIT)
+    monkeypatch.setitem(config.state, 'caught_up', False)
+    assets_trading.pair_price_states.clear()
+    yield
+    assets_trading.pair_price_states.clear()
+
+
+@pytest.fixture
+def book_trade(book_trade):
+    """Books a trade of 1 TESTASSET for the given price (in XCP) in the current block"""
+    return lambda message_index, price: book_trade(message_index, ASSET, config.UNIT, config.XCP, price * config.UNIT)
+
+
+def weighted_price(*prices):
+    # (the trades are weighted by their volume in both assets, i.e. 1 + price for a trade of 1 TESTASSET)
+    return pytest.approx(sum(price * (1 + price) for price in prices) / float(sum(1 + price for price in prices)))
+
+
+def get_buffered_prices():
+    return [p.unit_price for p in assets_trading.pair_price_states[(ASSET, config.XCP)].trades]
+
+
+def test_market_price_summary(set_block, book_trade):
+    for i, price in enumerate((1, 2, 6)):
+        set_block(400000 + i)
+        book_trade(i + 1, price)
+
+    summary = assets_trading.get_market_price_summary(ASSET, config.XCP, with_last_trades=3, start_dt=START_DT)
+    assert summary['market_price'] == weighted_price(1, 2, 6)
+    assert [(t[1], t[4]) for t in summary['last_trades']] == [(1.0, 400000), (2.0, 400001), (6.0, 400002)]
+    # a historical price is looked up out of the trades
+    assert assets_trading.get_market_price_summary(
+        ASSET, config.XCP, with_last_trades=3, start_dt=START_DT, end_dt=FIRST_BLOCK_TIME + datetime.timedelta(days=1)) == summary
+    assert assets_trading.get_market_price_summary(
+        ASSET, config.XCP, start_dt=START_DT, end_dt=FIRST_BLOCK_TIME)['market_price'] == 1.0
+
+    with pytest.raises(Exception):
+        assets_trading.get_market_price_summary(ASSET, config.XCP, with_last_trades=assets_trading.PRICE_BUFFER_SIZE + 1)
+
+
+def test_price_buffer(mongo_db, book_trade, monkeypatch):
+    monkeypatch.setattr(assets_trading, 'PRICE_BUFFER_SIZE', 3)
+    for i, price in enumerate((1, 2, 3, 4)):
+        book_trade(i + 1, price)
+
+    # the buffer is seeded with the last trades, and then fed the new ones
+    assets_trading.get_market_price_summary(ASSET, config.XCP, start_dt=START_DT)
+    assert get_buffered_prices() == [2.0, 3.0, 4.0]
+    mongo_db.trades.remove({})
+    book_trade(5, 5)
+    assert get_buffered_prices() == [3.0, 4.0, 5.0]
+    assert assets_trading.get_market_price_summary(ASSET, config.XCP, start_dt=START_DT)['market_price'] == weighted_price(3, 4, 5)
+
+
+def test_price_buffer_rollback(set_block, book_trade):
+    book_trade(1, 1)
+    set_block(400001)
+    book_trade(2, 2)
+    assert assets_trading.get_market_price_summary(ASSET, config.XCP, start_dt=START_DT)['market_price'] == weighted_price(1, 2)
+
+    # the buffer holding a rolled back trade is dropped, and seeded again without it
+    dex.process_rollback(400000)
+    assert (ASSET, config.XCP) not in assets_trading.pair_price_states
+    assert assets_trading.get_market_price_summary(ASSET, config.XCP, start_dt=START_DT)['market_price'] == 1.0
+    assert get_buffered_prices() == [1.0]
@@ -0,0 +1,122 @@
+import pytest
+
+from counterblock.lib import config
+from counterblock.lib.modules import dex
+
+ASSET = 'TESTASSET'
+
+
+@pytest.fixture(autouse=True)
+def market(mongo_db, register_asset):
+    register_asset(config.XCP)
+    register_asset(ASSET, total_issued=1000 * config.UNIT)
+
+
+@pytest.fixture
+def book_trade(book_trade):
+    """Books a TESTASSET/XCP trade (selling base_quantity TESTASSET for quote_quantity XCP) in the current block"""
+    return lambda message_index, base_quantity, quote_quantity: book_trade(
+        message_index, ASSET, base_quantity, config.XCP, quote_quantity)
+
+
+def test_market_summary(mongo_db, set_block, book_trade):
+    book_trade(1, 10 * config.UNIT, 20 * config.UNIT)
+    set_block(400001)
+    book_trade(2, 10 * config.UNIT, 30 * config.UNIT)
+    dex.refresh_market_summaries()
+
+    summary = mongo_db.market_summaries.find_one({'base_asset': ASSET, 'quote_asset': config.XCP}, {'_id': 0})
+    assert summary['price'] == 3.0
+    assert summary['trend'] == 1
+    assert summary['volume'] == summary['volume_24h'] == 50 * config.UNIT
+    assert summary['base_volume'] == 20 * config.UNIT
+    assert summary['supply'] == 1000 * config.UNIT
+    assert summary['market_cap'] == 3000 * config.UNIT
+    assert summary['last_trade_block'] == 400001
+
+    markets = dex.dex.get_markets_list(order_by='price')
+    assert [(m['base_asset'], m['quote_asset'], m['price'], m['pos']) for m in markets] == [
+        (ASSET, config.XCP, '3.00000000', 1)]
+
+
+def test_market_summary_window(mongo_db, set_block, book_trade):
+    book_trade(1, 10 * config.UNIT, 20 * config.UNIT)
+    dex.refresh_market_summaries()
+    set_block(400000 + 20 * 6)  # 20h later
+    book_trade(2, 10 * config.UNIT, 30 * config.UNIT)
+    dex.refresh_market_summaries()
+    summary = mongo_db.market_summaries.find_one({'base_asset': ASSET, 'quote_asset': config.XCP}, {'_id': 0})
+    assert summary['volume_24h'] == 50 * config.UNIT
+    assert summary['price_24h'] == 0
+
+    # with no trade since, the pair is refreshed as its first trade slides out of the 24h window
+    set_block(400000 + 25 * 6)
+    dex.refresh_market_summaries()
+    summary = mongo_db.market_summaries.find_one({'base_asset': ASSET, 'quote_asset': config.XCP}, {'_id': 0})
+    assert summary['volume_24h'] == 30 * config.UNIT
+    assert summary['volume'] == 50 * config.UNIT
+    assert summary['price_24h'] == 2.0
+    assert summary['progression'] == 50.0
+
+
+def test_market_list_skips_partial_summaries(mongo_db, book_trade):
+    # until the market summaries are refreshed at the end of the block, the pair of a first trade only has volumes
+    book_trade(1, 10 * config.UNIT, 20 * config.UNIT)
+    assert mongo_db.market_summaries.find_one({}, {'_id': 0, 'base_asset': 0, 'quote_asset': 0}) == {
+        'volume': 20 * config.UNIT, 'base_volume': 10 * config.UNIT}
+    for order_by in (None, 'price', 'progression', 'supply', 'market_cap'):
+        assert dex.dex.get_markets_list(order_by=order_by) == []
+
+
+def rollback(max_block_index, set_block):
+    dex.process_rollback(max_block_index)
+    set_block(max_block_index + 1)
+    dex.refresh_market_summaries()
+
+
+def test_market_summary_rollback(mongo_db, set_block, book_trade, monkeypatch):
+    monkeypatch.setitem(config.state, 'caught_up', False)
+    book_trade(1, 10 * config.UNIT, 20 * config.UNIT)
+    dex.refresh_market_summaries()
+    set_block(400010)
+    book_trade(2, 10 * config.UNIT, 30 * config.UNIT)
+    dex.refresh_market_summaries()
+    set_block(400000 + 25 * 6)  # the first trade slides out of the 24h window
+    dex.refresh_market_summaries()
+
+    # rolling back to before that (the window moving back in time)
+    mongo_db.trades.remove({'block_index': {'$gt': 400020}})
+    rollback(400020, set_block)
+    summary = mongo_db.market_summaries.find_one({'base_asset': ASSET, 'quote_asset': config.XCP}, {'_id': 0})
+    assert summary['volume_24h'] == 50 * config.UNIT
+    assert summary['price_24h'] == 0
+    assert summary['block_index'] == 400021
+
+    # rolling back the second trade
+    mongo_db.trades.remove({'block_index': {'$gt': 400005}})
+    rollback(400005, set_block)
+    summary = mongo_db.market_summaries.find_one({'base_asset': ASSET, 'quote_asset': config.XCP}, {'_id': 0})
+    assert summary['volume'] == summary['volume_24h'] == 20 * config.UNIT
+    assert summary['price'] == 2.0
+
+    # and the first one
+    mongo_db.trades.remove({'block_index': {'$gt': 399999}})
+    rollback(399999, set_block)
+    assert mongo_db.market_summaries.count() == 0
+
+
+def test_market_summary_supply_rollback(mongo_db, set_block, book_trade, register_asset, monkeypatch):
+    monkeypatch.setitem(config.state, 'caught_up', False)
+    book_trade(1, 10 * config.UNIT, 20 * config.UNIT)
+    dex.refresh_market_summaries()
+    set_block(400010)
+    register_asset(ASSET, total_issued=2000 * config.UNIT)
+    dex.parse_supply_change({'category': 'issuances'}, {'asset': ASSET, 'status': 'valid'})
+    dex.refresh_market_summaries()
+    assert mongo_db.market_summaries.find_one()['market_cap'] == 4000 * config.UNIT
+
+    register_asset(ASSET, total_issued=1000 * config.UNIT)  # (as restored from tracked_assets by the assets module)
+    rollback(400005, set_block)
+    summary = mongo_db.market_summaries.find_one({'base_asset': ASSET, 'quote_asset': config.XCP}, {'_id': 0})
+    assert summary['supply'] == 1000 * config.UNIT
+    assert summary['market_cap'] == 2000 * config.UNIT
@@ -0,0 +1,93 @@
+import datetime
+
+import pytest
+
+from counterblock.lib import config
+from counterblock.lib.modules.dex import market_windows
+
+ASSET = 'TESTASSET'
+NOW = datetime.datetime(2016, 1, 10, 12, 30)
+
+
+@pytest.fixture(autouse=True)
+def windows(mongo_db, monkeypatch):
+    monkeypatch.setitem(config.state, 'caught_up', True)
+    for asset in (config.XCP, ASSET, 'OTHERASSET'):
+        mongo_db.asset_market_info.insert({'asset': asset, '24h_summary': {'vol': 9, 'count': 9}})
+    market_windows.clear()
+    yield
+    market_windows.clear()
+
+
+def add_trade(mongo_db, block_time, base_asset, quote_asset, unit_price, base_quantity=1.0):
+    trade = {
+        'block_index': 400000, 'message_index': mongo_db.trades.count(), 'block_time': block_time,
+        'base_asset': base_asset, 'quote_asset': quote_asset, 'unit_price': unit_price,
+        'base_quantity_normalized': base_quantity, 'quote_quantity_normalized': base_quantity * unit_price}
+    mongo_db.trades.insert(dict(trade))
+    market_windows.add_trade(trade)
+
+
+def get_market_info(mongo_db, asset):
+    return mongo_db.asset_market_info.find_one({'asset': asset}, {'_id': 0})
+
+
+def test_load(mongo_db):
+    add_trade(mongo_db, NOW - datetime.timedelta(days=8), ASSET, config.XCP, 1.0)  # (out of both windows)
+    add_trade(mongo_db, NOW - datetime.timedelta(days=3), config.XCP, config.BTC, 0.5)
+    add_trade(mongo_db, NOW - datetime.timedelta(days=2), ASSET, config.XCP, 2.0)
+    add_trade(mongo_db, NOW - datetime.timedelta(hours=2), config.XCP, config.BTC, 0.25)
+    add_trade(mongo_db, NOW - datetime.timedelta(hours=1), ASSET, config.XCP, 4.0, base_quantity=3.0)
+    assert not market_windows.state['loaded']  # (the trades above were only recorded)
+    market_windows.process_block(NOW)
+
+    market_info = get_market_info(mongo_db, ASSET)
+    assert market_info['24h_summary'] == {'vol': 3.0, 'count': 1}
+    market_info = get_market_info(mongo_db, config.XCP)
+    assert market_info['24h_summary'] == {'vol': 1.0 + 12.0, 'count': 2}
+    assert market_info['24h_ohlc_in_xcp'] == {}
+    assert [price for hour, price in market_info['7d_history_in_xcp']] == [0.5, 0.25]
+    assert [price for hour, price in market_info['7d_history_in_btc']] == [2.0, 4.0]
+    # the assets without trades in the last 7 days are zeroed out
+    assert get_market_info(mongo_db, 'OTHERASSET')['24h_summary'] == {'vol': 0, 'count': 0}
+
+    assert market_windows.get_pair_stats(ASSET, config.XCP) == {
+        'completed_trades_count': 1, 'vol_base': 3.0, 'vol_quote': 12.0, '24h_pct_change': 100.0}
+
+
+def test_expire(mongo_db):
+    market_windows.process_block(NOW)
+    add_trade(mongo_db, NOW, ASSET, config.XCP, 2.0)
+    add_trade(mongo_db, NOW, config.XCP, config.BTC, 0.5)
+    market_windows.process_block(NOW)
+    assert get_market_info(mongo_db, ASSET)['24h_summary'] == {'vol': 1.0, 'count': 1}
+    assert market_windows.get_pairs() == [(ASSET, config.XCP), (config.XCP, config.BTC)]
+
+    # the trades slide out of the 24h window, and then out of the 7d one
+    market_windows.process_block(NOW + datetime.timedelta(days=1, seconds=1))
+    assert get_market_info(mongo_db, ASSET)['24h_summary'] == {'vol': 0, 'count': 0}
+    assert market_windows.get_pairs() == []
+    assert market_windows.get_pair_stats(ASSET, config.XCP)['24h_pct_change'] == 0.0
+    assert len(get_market_info(mongo_db, config.XCP)['7d_history_in_xcp']) == 1
+    market_windows.process_block(NOW + datetime.timedelta(days=7, hours=1))
+    assert get_market_info(mongo_db, config.XCP)['7d_history_in_xcp'] == []
+
+
+def test_publish_changed_assets(mongo_db):
+    market_windows.process_block(NOW)
+    mongo_db.asset_market_info.update({}, {"$set": {'24h_summary': None}}, multi=True)
+    add_trade(mongo_db, NOW, ASSET, 'OTHERASSET', 2.0)
+    market_windows.process_block(NOW)
+
+    # only the statistics of the traded assets are written out
+    assert get_market_info(mongo_db, ASSET)['24h_summary'] == {'vol': 1.0, 'count': 1}
+    assert get_market_info(mongo_db, 'OTHERASSET')['24h_summary'] == {'vol': 2.0, 'count': 1}
+    assert get_market_info(mongo_db, config.XCP)['24h_summary'] is None
+
+
+def test_not_caught_up(mongo_db, monkeypatch):
+    monkeypatch.setitem(config.state, 'caught_up', False)
+    add_trade(mongo_db, NOW, ASSET, config.XCP, 2.0)
+    market_windows.process_block(NOW)
+    assert not market_windows.state['loaded']
+    assert get_market_info(mongo_db, ASSET)['24h_summary'] == {'vol': 9, 'count': 9}
@@ -0,0 +1,68 @@
+from fractions import Fraction
+
+from counterblock.lib import config, numeric
+
+
+def test_unit_price():
+    assert numeric.unit_price(config.UNIT, 2 * config.UNIT, True, True) == 2
+    assert numeric.unit_price(3 * config.UNIT, 2 * config.UNIT, True, True) == Fraction(2, 3)
+    assert numeric.unit_price(3, config.UNIT, False, True) == Fraction(1, 3)  # indivisible base
+    assert numeric.unit_price(config.UNIT, 5, True, False) == 5  # indivisible quote
+    assert numeric.unit_price(4, 2, False, False) == Fraction(1, 2)
+
+
+def test_quantize_round_down():
+    assert numeric.quantize(Fraction(1, 3), rounding=numeric.ROUND_DOWN) == 33333333
+    assert numeric.quantize(Fraction(2, 3), rounding=numeric.ROUND_DOWN) == 66666666
+    assert numeric.quantize(Fraction(-2, 3), rounding=numeric.ROUND_DOWN) == -66666666
+    assert numeric.quantize(Fraction(1, 8), 2, numeric.ROUND_DOWN) == 12
+
+
+def test_quantize_round_up():
+    assert numeric.quantize(Fraction(1, 3), rounding=numeric.ROUND_UP) == 33333334
+    assert numeric.quantize(Fraction(2, 3), rounding=numeric.ROUND_UP) == 66666667
+    assert numeric.quantize(Fraction(-1, 3), rounding=numeric.ROUND_UP) == -33333334
+    assert numeric.quantize(Fraction(1, 8), 2, numeric.ROUND_UP) == 13
+
+
+def test_quantize_round_half_even():
+    assert numeric.quantize(Fraction(1, 3)) == 33333333
+    assert numeric.quantize(Fraction(2, 3)) == 66666667
+    assert numeric.quantize(Fraction(-2, 3)) == -66666667
+    # ties go to the even neighbour
+    assert numeric.quantize(Fraction(5, 10 ** 9)) == 0
+    assert numeric.quantize(Fraction(15, 10 ** 9)) == 2
+    assert numeric.quantize(Fraction(25, 10 ** 9)) == 2
+    assert numeric.quantize(Fraction(1, 8), 2) == 12
+    assert numeric.quantize(Fraction(3, 8), 2) == 38
+
+
+def test_quantize_exact():
+    for rounding in (numeric.ROUND_DOWN, numeric.ROUND_UP, numeric.ROUND_HALF_EVEN):
+        assert numeric.quantize(Fraction(1, 4), rounding=rounding) == 25000000
+        assert numeric.quantize(3, 0, rounding) == 3
+
+
+def test_format_price_divisible():
+    assert numeric.format_price(config.UNIT, 2 * config.UNIT, True, True) == '2.00000000'
+    assert numeric.format_price(3 * config.UNIT, 2 * config.UNIT, True, True) == '0.66666667'
+    assert numeric.format_price(3 * config.UNIT, 2 * config.UNIT, True, True, numeric.ROUND_DOWN) == '0.66666666'
+    assert numeric.format_price(3 * config.UNIT, 2 * config.UNIT, True, True, numeric.ROUND_UP) == '0.66666667'
+    assert numeric.format_price(config.UNIT * 10 ** 8, 1, True, True) == '0.00000000'
+    assert numeric.format_price(config.UNIT * 10 ** 8, 1, True, True, numeric.ROUND_UP) == '0.00000001'
+
+
+def test_format_price_indivisible():
+    assert numeric.format_price(1, 5, False, False) == '5.00000000'
+    assert numeric.format_price(3, config.UNIT, False, True) == '0.33333333'
+    assert numeric.format_price(3, config.UNIT, False, True, numeric.ROUND_DOWN) == '0.33333333'
+    assert numeric.format_price(3, config.UNIT, False, True, numeric.ROUND_UP) == '0.33333334'
+    assert numeric.format_price(2 * config.UNIT, 1, True, False) == '0.50000000'
+    assert numeric.format_price(3, 1, False, False) == '0.33333333'
+
+
+def test_format_number():
+    assert numeric.format_number(Fraction(-1, 2)) == '-0.50000000'
+    assert numeric.format_number(Fraction(1, 10 ** 8)) == '0.00000001'
+    assert numeric.format_number(Fraction(5, 2), 0) == '2'
+    assert numeric.format_number(Fraction(5, 2), 0, numeric.ROUND_UP) == '3'
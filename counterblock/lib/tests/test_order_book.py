@@ -0,0 +1,109 @@
+import pytest
+
+from counterblock.lib import config, asset_registry
+from counterblock.lib.modules.dex import order_book
+
+ASSET = 'TESTASSET'
+
+
+@pytest.fixture(autouse=True)
+def empty_book():
+    asset_registry.assets.clear()  # both assets of the tests then default to divisible
+    order_book.clear()
+    yield
+    order_book.clear()
+
+
+def make_order(tx_hash, give_asset, give_quantity, get_asset, get_quantity, source='source_address', status='open'):
+    return {
+        'tx_hash': tx_hash, 'source': source, 'status': status,
+        'give_asset': give_asset, 'give_quantity': give_quantity, 'give_remaining': give_quantity,
+        'get_asset': get_asset, 'get_quantity': get_quantity, 'get_remaining': get_quantity,
+        'fee_required_remaining': 0, 'fee_provided_remaining': 0,
+    }
+
+
+def test_price_levels_add_remove():
+    levels = order_book.PriceLevels()
+    levels.add(1.5, 100)
+    levels.add(1.0, 50)
+    levels.add(1.5, 20)
+    assert levels.prices == [1.0, 1.5]
+    assert levels.levels == {1.0: [50, 1], 1.5: [120, 2]}
+
+    levels.remove(1.5, 100)
+    assert levels.prices == [1.0, 1.5]
+    assert levels.levels[1.5] == [20, 1]
+
+    levels.remove(1.5, 20)  # the level's last order
+    assert levels.prices == [1.0]
+    assert levels.levels == {1.0: [50, 1]}
+
+    levels.remove(1.0, 50)
+    assert levels.prices == []
+    assert levels.levels == {}
+
+
+def test_pair_book_set_order():
+    book = order_book.PairBook(config.XCP, ASSET)
+    book.set_order(make_order('ask', config.XCP, 10 * config.UNIT, ASSET, 20 * config.UNIT))
+    book.set_order(make_order('bid', ASSET, 30 * config.UNIT, config.XCP, 10 * config.UNIT, source='other_address'))
+
+    assert book.asks.levels == {2.0: [10 * config.UNIT, 1]}
+    assert book.bids.levels == {3.0: [10 * config.UNIT, 1]}
+    assert set(book.orders) == set(book.entries) == {'ask', 'bid'}
+    assert book.get_summary() == (2, 2.0, 3.0)
+    assert order_book.order_pairs['ask'] == (config.XCP, ASSET)
+    assert order_book.changed_pairs == {(config.XCP, ASSET)}
+    assert order_book.address_order_counts == {
+        'source_address': {(config.XCP, ASSET): 1}, 'other_address': {(config.XCP, ASSET): 1}}
+
+    # updating an order replaces its entry in the price levels
+    updated = make_order('ask', config.XCP, 10 * config.UNIT, ASSET, 20 * config.UNIT)
+    updated['give_remaining'] = 4 * config.UNIT
+    book.set_order(updated)
+    assert book.asks.levels == {2.0: [4 * config.UNIT, 1]}
+    assert order_book.address_order_counts['source_address'] == {(config.XCP, ASSET): 1}
+
+
+def test_pair_book_remove_order():
+    book = order_book.PairBook(config.XCP, ASSET)
+    book.set_order(make_order('ask1', config.XCP, 10 * config.UNIT, ASSET, 20 * config.UNIT))
+    book.set_order(make_order('ask2', config.XCP, 5 * config.UNIT, ASSET, 10 * config.UNIT))
+    assert book.asks.levels == {2.0: [15 * config.UNIT, 2]}
+
+    book.remove_order('ask1')
+    assert book.asks.levels == {2.0: [5 * config.UNIT, 1]}
+    assert order_book.address_order_counts == {'source_address': {(config.XCP, ASSET): 1}}
+
+    book.remove_order('ask2')
+    book.remove_order('unknown')  # no-op
+    assert book.asks.prices == []
+    assert book.orders == book.entries == order_book.order_pairs == order_book.address_order_counts == {}
+    assert book.get_summary() == (0, None, None)
+
+
+def test_pair_book_closed_order():
+    book = order_book.PairBook(config.XCP, ASSET)
+    book.set_order(make_order('ask', config.XCP, 10 * config.UNIT, ASSET, 20 * config.UNIT))
+    book.set_order(make_order('ask', config.XCP, 10 * config.UNIT, ASSET, 20 * config.UNIT, status='filled'))
+    assert book.orders == book.entries == order_book.address_order_counts == {}
+    assert book.asks.prices == []
+
+
+def test_pair_book_hidden_orders():
+    book = order_book.PairBook(config.BTC, ASSET)
+    # a BTC dust order is tracked, but not shown in the price levels
+    book.set_order(make_order('dust', config.BTC, config.ORDER_BTC_DUST_LIMIT_CUTOFF, ASSET, config.UNIT))
+    # nor is a BTC order with nothing left to give
+    spent = make_order('spent', config.BTC, config.UNIT, ASSET, config.UNIT)
+    spent['give_remaining'] = 0
+    book.set_order(spent)
+    assert set(book.orders) == {'dust', 'spent'}
+    assert book.entries == {}
+    assert book.asks.prices == []
+    assert book.get_summary() == (0, None, None)
+
+    book.remove_order('dust')
+    book.remove_order('spent')
+    assert book.orders == order_book.address_order_counts == {}
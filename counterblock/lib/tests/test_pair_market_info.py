@@ -0,0 +1,76 @@
+import pytest
+
+from counterblock.lib import config
+from counterblock.lib.modules import dex
+from counterblock.lib.modules.dex import assets_trading, market_windows, order_book
+
+ASSET = 'TESTASSET'
+
+
+@pytest.fixture(autouse=True)
+def markets(mongo_db, register_asset, monkeypatch):
+    for asset in (config.XCP, config.BTC):
+        register_asset(asset)
+    for asset in (ASSET, 'OTHERASSET'):
+        register_asset(asset, total_issued=1000 * config.UNIT)
+    monkeypatch.setitem(config.state, 'caught_up', True)
+    monkeypatch.setitem(dex.pair_market_info_state, 'refresh_all', True)
+    order_book.clear()
+    order_book.state['loaded'] = True  # (an empty book, rather than one loaded from counterparty-server)
+    market_windows.clear()
+    assets_trading.pair_price_states.clear()
+    yield
+    order_book.clear()
+    market_windows.clear()
+    assets_trading.pair_price_states.clear()
+
+
+def set_order(status, give_asset, get_asset, quantity=config.UNIT):
+    order_book.set_order({
+        'tx_hash': 'a' * 64, 'source': 'source_address', 'status': status, 'tx_index': 1,
+        'give_asset': give_asset, 'give_quantity': quantity, 'give_remaining': quantity,
+        'get_asset': get_asset, 'get_quantity': 2 * quantity, 'get_remaining': 2 * quantity,
+        'fee_required_remaining': 0, 'fee_provided_remaining': 0})
+
+
+def get_pair_market_info(mongo_db):
+    return dict(((e['base_asset'], e['quote_asset']), e) for e in mongo_db.asset_pair_market_info.find({}, {'_id': 0}))
+
+
+def test_pair_market_info(mongo_db, set_block, book_trade):
+    book_trade(1, ASSET, 2 * config.UNIT, config.XCP, 8 * config.UNIT)
+    set_order('open', 'OTHERASSET', config.XCP)
+    dex.publish_market_windows()
+
+    pair_market_info = get_pair_market_info(mongo_db)
+    assert sorted(pair_market_info) == [('OTHERASSET', config.XCP), (ASSET, config.XCP)]
+    e = pair_market_info[(ASSET, config.XCP)]
+    assert (e['completed_trades_count'], e['vol_base'], e['vol_quote'], e['24h_pct_change']) == (1, 2.0, 8.0, None)
+    assert (e['open_orders_count'], e['lowest_ask'], e['highest_bid']) == (0, None, None)
+    assert e['24h_vol_in_xcp'] == 8.0 and e['24h_vol_in_btc'] is None
+    e = pair_market_info[('OTHERASSET', config.XCP)]
+    assert (e['completed_trades_count'], e['open_orders_count'], e['lowest_ask'], e['highest_bid']) == (0, 1, 2.0, None)
+
+    # only the changed pairs are updated with the next blocks, and the pairs with neither trades nor open orders left
+    # are removed
+    set_block(400001)
+    set_order('cancelled', 'OTHERASSET', config.XCP)
+    mongo_db.asset_pair_market_info.update({'base_asset': ASSET}, {"$set": {'vol_base': None}})
+    dex.publish_market_windows()
+    assert list(get_pair_market_info(mongo_db)) == [(ASSET, config.XCP)]
+    assert get_pair_market_info(mongo_db)[(ASSET, config.XCP)]['vol_base'] is None
+    set_block(400000 + 24 * 6 + 1)
+    dex.publish_market_windows()
+    assert get_pair_market_info(mongo_db) == {}
+
+
+def test_pair_market_info_refresh_all(mongo_db, book_trade):
+    book_trade(1, ASSET, 2 * config.UNIT, config.XCP, 8 * config.UNIT)
+    dex.publish_market_windows()
+    mongo_db.asset_pair_market_info.insert({'base_asset': 'OTHERASSET', 'quote_asset': config.XCP})  # (a stale pair)
+
+    # after a rollback, every pair is recomputed (and the stale ones removed)
+    dex.process_rollback(400000)
+    order_book.state['loaded'] = True
+    dex.publish_market_windows()
+    assert list(get_pair_market_info(mongo_db)) == [(ASSET, config.XCP)]
@@ -0,0 +1,88 @@
+import calendar
+
+import pytest
+
+from counterblock.lib import config
+from counterblock.lib.modules import dex
+from counterblock.lib.modules.dex import order_book
+
+
+@pytest.fixture(autouse=True)
+def markets(mongo_db, register_asset, book_trade):
+    for asset in (config.XCP, 'AAA', 'BBB', 'CCC'):
+        register_asset(asset, total_issued=1000 * config.UNIT if asset != config.XCP else None)
+    order_book.clear()
+    order_book.state['loaded'] = True  # (an empty book, rather than one loaded from counterparty-server)
+    yield
+    order_book.clear()
+
+
+def add_order(tx_hash, source, give_asset, get_asset):
+    order_book.set_order({
+        'tx_hash': tx_hash, 'source': source, 'status': 'open', 'tx_index': 1,
+        'give_asset': give_asset, 'give_quantity': config.UNIT, 'give_remaining': config.UNIT,
+        'get_asset': get_asset, 'get_quantity': config.UNIT, 'get_remaining': config.UNIT,
+        'fee_required_remaining': 0, 'fee_provided_remaining': 0})
+
+
+def book_trades(set_block, book_trade):
+    # AAA/XCP trades 30 XCP (10 of them a day later), BBB/XCP 20 XCP, and CCC/XCP 5 XCP
+    book_trade(1, 'AAA', config.UNIT, config.XCP, 20 * config.UNIT)
+    book_trade(2, config.XCP, 20 * config.UNIT, 'BBB', 2 * config.UNIT)
+    book_trade(3, 'CCC', config.UNIT, config.XCP, 5 * config.UNIT)
+    dex.refresh_market_summaries()
+    set_block(400000 + 24 * 6 + 1)
+    book_trade(4, 'AAA', config.UNIT, config.XCP, 10 * config.UNIT)
+    dex.refresh_market_summaries()
+
+
+def test_get_pairs(set_block, book_trade):
+    book_trades(set_block, book_trade)
+    pairs = dex.dex.get_pairs(config.XCP)
+    assert [(p['pair'], p['base_quantity'], p['quote_quantity']) for p in pairs] == [
+        ('AAA/XCP', 2 * config.UNIT, 30 * config.UNIT), ('BBB/XCP', 2 * config.UNIT, 20 * config.UNIT),
+        ('CCC/XCP', config.UNIT, 5 * config.UNIT)]
+    assert [p['pair'] for p in dex.dex.get_pairs(config.XCP, exclude_pairs=['BBB/XCP'], max_pairs=1)] == ['AAA/XCP']
+    assert [p['pair'] for p in dex.dex.get_pairs(config.XCP, last_24h=True)] == ['AAA/XCP']
+    assert dex.dex.get_pairs(config.BTC) == []
+
+    # (deprecated) from_time
+    from_time = calendar.timegm(config.state['cur_block']['block_time_obj'].timetuple()) - 60
+    assert [(p['pair'], p['quote_quantity']) for p in dex.dex.get_pairs(config.XCP, from_time=from_time)] == [
+        ('AAA/XCP', 10 * config.UNIT)]
+    assert [p['pair'] for p in dex.dex.get_quotation_pairs(max_pairs=2, from_time=1)] == ['AAA/XCP', 'BBB/XCP']
+
+
+def test_get_pairs_skips_partial_summaries(book_trade):
+    # the volumes of a first trade are in market_summaries before the rest of its summary (see get_markets_list)
+    book_trade(1, 'AAA', config.UNIT, config.XCP, 20 * config.UNIT)
+    add_order('order1', 'address1', 'AAA', config.XCP)
+    assert dex.dex.get_pairs(config.XCP) == []
+    assert [(p['base_asset'], p['quote_asset'], p['price']) for p in dex.get_users_pairs(['address1'])] == [
+        ('AAA', config.XCP, '0.00000000')]
+
+
+def test_address_order_counts():
+    add_order('order1', 'address1', 'AAA', config.XCP)
+    add_order('order2', 'address1', config.XCP, 'BBB')
+    add_order('order3', 'address2', 'BBB', config.XCP)
+    add_order('order4', 'address3', 'CCC', config.XCP)
+    assert order_book.get_address_order_counts(['address1', 'address2']) == [
+        (('BBB', config.XCP), 2), (('AAA', config.XCP), 1)]
+
+    order_book.remove_order('order3')
+    order_book.set_order(dict(order_book.books[('AAA', config.XCP)].orders['order1'], status='filled'))
+    assert order_book.get_address_order_counts(['address1', 'address2']) == [(('BBB', config.XCP), 1)]
+    assert order_book.address_order_counts == {
+        'address1': {('BBB', config.XCP): 1}, 'address3': {('CCC', config.XCP): 1}}
+
+
+def test_get_users_pairs(set_block, book_trade):
+    book_trades(set_block, book_trade)
+    add_order('order1', 'address1', 'CCC', config.XCP)
+    # the pairs the addresses have open orders in come first, then the most traded pairs (XCP/BTC is always in)
+    pairs = dex.dex.get_users_pairs(['address1'], max_pairs=3)
+    assert [(p['base_asset'], p['quote_asset']) for p in pairs] == [
+        (config.XCP, config.BTC), ('CCC', config.XCP), ('AAA', config.XCP)]
+    assert pairs[1]['price'] == '5.00000000'
+    assert pairs[1]['my_order_count'] == 1
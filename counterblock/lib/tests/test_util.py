@@ -0,0 +1,73 @@
+import collections
+import functools
+
+import gevent.pywsgi
+import pytest
+
+from counterblock.lib import util
+
+
+def test_downsample_lttb_short_series():
+    points = [(i, i * i) for i in range(10)]
+    assert util.downsample_lttb(points, 10) is points
+    assert util.downsample_lttb(points, 20) is points
+
+
+def test_downsample_lttb():
+    points = [(i, 0) for i in range(100)]
+    points[50] = (50, 100)  # a spike, which is to survive the downsampling
+    sampled = util.downsample_lttb(points, 10)
+    assert len(sampled) == 10
+    assert sampled[0] == points[0]
+    assert sampled[-1] == points[-1]
+    assert (50, 100) in sampled
+    assert [p[0] for p in sampled] == sorted(set(p[0] for p in sampled))
+
+
+def test_downsample_lttb_line():
+    # on a straight line every triangle is flat, so the first point of each bucket is picked
+    points = [(i, 2 * i) for i in range(12)]
+    assert util.downsample_lttb(points, 4) == [(0, 0), (1, 2), (6, 12), (11, 22)]
+
+
+@pytest.fixture
+def http_server():
+    """Serves a fixed JSON document over HTTP/1.1 (keepalive, with a body sent in chunks), recording the client port of
+    each request"""
+    client_ports = []
+
+    def body():
+        yield b'{"name": '
+        gevent.sleep(0.01)  # so that the end of the body is not received along with its start
+        yield b'"TESTASSET"}'
+
+    def app(environ, start_response):
+        client_ports.append(environ['REMOTE_PORT'])
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return body()
+
+    server = gevent.pywsgi.WSGIServer(('127.0.0.1', 0), app, log=None)
+    server.start()
+    yield 'http://127.0.0.1:%i/' % server.server_port, client_ports
+    server.stop()
+
+
+def test_fetch_conditional_reuses_connection(http_server, monkeypatch):
+    url, client_ports = http_server
+    monkeypatch.setattr(util, 'fetch_hosts', collections.OrderedDict())
+    monkeypatch.setattr(util, 'FETCH_HOST_MIN_INTERVAL', 0)
+    monkeypatch.setattr(util, 'is_valid_url', functools.partial(util.is_valid_url, allow_localhost=True))
+    for i in range(2):
+        result = util.fetch_conditional(url + 'asset%i.json' % i)
+        assert result['success'] and result['data'] == {'name': 'TESTASSET'}
+    assert len(client_ports) == 2
+    assert client_ports[0] == client_ports[1]  # both requests went over the same (pooled) connection
+
+
+def test_fetch_conditional_too_large(http_server, monkeypatch):
+    url, client_ports = http_server
+    monkeypatch.setattr(util, 'fetch_hosts', collections.OrderedDict())
+    monkeypatch.setattr(util, 'FETCH_HOST_MIN_INTERVAL', 0)
+    monkeypatch.setattr(util, 'is_valid_url', functools.partial(util.is_valid_url, allow_localhost=True))
+    result = util.fetch_conditional(url, max_fetch_size=8, is_json=False)
+    assert result['success'] and result['data'] == b'{"name":'
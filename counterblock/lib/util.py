@@ -8,17 +8,24 @@ import time
 import decimal
 import cgi
 import itertools
+import collections
 import io
 import subprocess
 import calendar
 import hashlib
 import socket
+import urllib.parse
 
 import dateutil.parser
 import gevent
 import gevent.pool
+import gevent.lock
+import gevent.event
+import gevent.threadpool
 import gevent.ssl
 import grequests
+import requests
+import requests.adapters
 import pymongo
 import lxml.html
 from PIL import Image
@@ -31,9 +38,17 @@ from counterblock.lib import config, cache
 
 JSONRPC_API_REQUEST_TIMEOUT = 100  # in seconds
 JSONRPC_CACHE_PERIOD = 3600 # 1 hour
+FETCH_HOST_MAX_CONNECTIONS = 2  # max concurrent (keepalive) connections to any one host, for fetch_conditional
+FETCH_HOST_MIN_INTERVAL = 0.5  # min number of seconds between the start of requests to the same host, for fetch_conditional
+FETCH_HOSTS_MAX_ENTRIES = 500  # max number of hosts to keep a session (and rate limiting state) for, for fetch_conditional
+IMAGE_PROCESSING_THREADS = 2  # max number of images decoded and validated at once
+IMAGE_RESULTS_MAX_ENTRIES = 1000  # max number of image processing results kept (by content hash) for deduplication
 
 D = decimal.Decimal
 logger = logging.getLogger(__name__)
+fetch_hosts = collections.OrderedDict()  # host -> per-host session and rate limiting state, for fetch_conditional
+image_threadpool = gevent.threadpool.ThreadPool(IMAGE_PROCESSING_THREADS)
+image_results = collections.OrderedDict()  # (content hash, formats, dimensions) -> AsyncResult of the processed image
 
 
 def sanitize_eliteness(text):
@@ -248,6 +263,39 @@ def weighted_average(value_weight_list):
         return None
 
 
+def downsample_lttb(points, max_points):
+    """Downsamples a list of (x, y) points (ordered by x) to at most max_points points, using the
+    Largest-Triangle-Three-Buckets algorithm (which keeps the visual shape of the series intact).
+    The first and last points are always kept.
+    """
+    assert max_points >= 3
+    if max_points >= len(points):
+        return points
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / float(max_points - 2)
+    a = 0  # index of the previously selected point
+    for i in range(max_points - 2):
+        # the average point of the next bucket is the third vertex of the triangle
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, len(points))
+        next_bucket = points[next_start:next_end]
+        avg_x = sum(p[0] for p in next_bucket) / float(len(next_bucket))
+        avg_y = sum(p[1] for p in next_bucket) / float(len(next_bucket))
+
+        # pick the point in this bucket forming the largest triangle with the previous point and that average
+        ax, ay = points[a]
+        max_area, max_area_index = -1, None
+        for j in range(int(i * bucket_size) + 1, next_start):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area, max_area_index = area, j
+        sampled.append(points[max_area_index])
+        a = max_area_index
+    sampled.append(points[-1])
+    return sampled
+
+
 def json_dthandler(obj):
     #if bytes, convert to string
     if isinstance(obj, bytes):
@@ -329,6 +377,144 @@ def stream_fetch(urls, completed_callback, urls_group_size=50, urls_group_time_s
             process_group(group)  # should 'block' until each group processing is complete
 
 
+def _get_fetch_host(url):
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    if host in fetch_hosts:
+        fetch_hosts.move_to_end(host)
+    else:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_HOST_MAX_CONNECTIONS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        fetch_hosts[host] = {
+            'session': session,  # reused, so that connections to the host are kept alive between requests
+            'semaphore': gevent.lock.BoundedSemaphore(FETCH_HOST_MAX_CONNECTIONS),
+            'last_request_time': 0,
+        }
+        # evict the least recently used hosts, closing their sessions (skipping any host with requests in flight)
+        for evicted_host in list(fetch_hosts.keys()):
+            if len(fetch_hosts) <= FETCH_HOSTS_MAX_ENTRIES:
+                break
+            entry = fetch_hosts[evicted_host]
+            if evicted_host != host and entry['semaphore'].counter == FETCH_HOST_MAX_CONNECTIONS:
+                del fetch_hosts[evicted_host]
+                entry['session'].close()
+    return fetch_hosts[host]
+
+
+def fetch_conditional(url, etag=None, last_modified=None, max_fetch_size=4 * 1024, fetch_timeout=5, is_json=True):
+    """Fetches the given URL with a conditional GET (if an etag and/or last_modified value from a previous fetch is
+    passed), reusing connections to the URL's host and limiting the number of (and rate of) concurrent requests to it.
+
+    @return: A dict with the following fields:
+      * success: True if the request was successful (either the data was fetched, or it was not modified)
+      * not_modified: True if the server reports the data as not modified since the last fetch (in which case data is None)
+      * data: The fetched data (JSON decoded if is_json is True), or an error string if success is False
+      * content_hash: The sha256 hash of the raw data fetched (if any)
+      * etag, last_modified: The cache validators returned by the server (if any), for use with the next fetch
+    """
+    result = {'success': False, 'not_modified': False, 'data': None, 'content_hash': None, 'etag': None, 'last_modified': None}
+    if not is_valid_url(url, allow_no_protocol=True):
+        result['data'] = "Invalid URL"
+        return result
+
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    host = _get_fetch_host(url)
+    with host['semaphore']:
+        wait = host['last_request_time'] + FETCH_HOST_MIN_INTERVAL - time.time()
+        if wait > 0:
+            gevent.sleep(wait)
+        host['last_request_time'] = time.time()
+
+        r = None
+        try:
+            r = grequests.map((grequests.get(
+                url, session=host['session'], timeout=fetch_timeout, headers=headers, verify=False),), stream=True)[0]
+            #^ (the stream flag has to go to map, which overrides the one given to the request)
+            if r is None:
+                raise Exception("result is None")
+            # read the body to its end (unless it is over max_fetch_size), as only a fully read response has its
+            # connection go back to the host's pool for reuse (r.close() drops the connection of an unfinished one)
+            raw_data = b''
+            for chunk in r.iter_content(chunk_size=max_fetch_size):
+                raw_data += chunk
+                if len(raw_data) > max_fetch_size:
+                    break
+            raw_data = raw_data[:max_fetch_size]  # keep up to max_fetch_size
+            result['etag'] = r.headers.get('ETag', None)
+            result['last_modified'] = r.headers.get('Last-Modified', None)
+            if r.status_code == 304:
+                result['success'] = result['not_modified'] = True
+                return result
+            if r.status_code != 200:
+                result['data'] = "Got non-successful response code of: %s" % r.status_code
+                return result
+        except Exception as e:
+            result['data'] = "Got exception: %s" % e
+            return result
+        finally:
+            if r is not None:
+                r.close()  # releases the connection to the pool (or closes it, if the body was not read to its end)
+
+    result['content_hash'] = hashlib.sha256(raw_data).hexdigest()
+    if is_json:
+        try:
+            result['data'] = json.loads(raw_data.decode('utf-8'))
+        except Exception as e:
+            result['data'] = "Invalid JSON data: %s" % e
+            return result
+    else:
+        result['data'] = raw_data
+    result['success'] = True
+    return result
+
+
+def _process_image(raw_image_data, formats, dimensions):
+    """Decodes and validates the given raw image data, and returns it re-encoded with all metadata stripped.
+    NOTE: This is CPU bound, and is run in image_threadpool (i.e. off of the gevent hub)"""
+    try:
+        image = Image.open(io.BytesIO(raw_image_data))
+        image.load()
+    except Exception as e:
+        raise Exception("Unable to parse image data")
+    if image.format.lower() not in formats:
+        raise Exception("Image is not a PNG (got %s)" % image.format)
+    if image.size != dimensions:
+        raise Exception("Image size is not 48x48 (got %s)" % (image.size,))
+    if image.mode not in ['RGB', 'RGBA']:
+        raise Exception("Image mode is not RGB/RGBA (got %s)" % image.mode)
+
+    # copy over just the pixel data, which strips all metadata, just in case
+    clean_image = Image.new(image.mode, image.size)
+    clean_image.putdata(list(image.getdata()))
+    output = io.BytesIO()
+    clean_image.save(output, format=image.format)
+    return image.format.lower(), output.getvalue()
+
+
+def _process_image_deduped(raw_image_data, formats, dimensions):
+    """Processes the image data in image_threadpool, reusing the result for any image with the same content that
+    was already processed (or is being processed) with the same validation parameters"""
+    key = (hashlib.sha256(raw_image_data).hexdigest(), tuple(formats), tuple(dimensions))
+    if key in image_results:
+        image_results.move_to_end(key)
+        return image_results[key].get()  # may wait on an in-progress processing of the same image
+
+    image_results[key] = result = gevent.event.AsyncResult()
+    while len(image_results) > IMAGE_RESULTS_MAX_ENTRIES:
+        image_results.popitem(last=False)
+    try:
+        result.set(image_threadpool.apply(_process_image, (raw_image_data, formats, dimensions)))
+    except Exception as e:
+        result.set_exception(e)
+    return result.get()
+
+
 def fetch_image(url, folder, filename, max_size=20 * 1024, formats=['png'], dimensions=(48, 48), fetch_timeout=1):
     def make_data_dir(subfolder):
         path = os.path.join(config.data_dir, subfolder)
@@ -336,38 +522,34 @@ def fetch_image(url, folder, filename, max_size=20 * 1024, formats=['png'], dime
             os.makedirs(path)
         return path
 
+    def write_image(path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
     try:
         # fetch the image data
+        r = None
         try:
             r = grequests.map((grequests.get(url, timeout=fetch_timeout, headers={'Connection': 'close'}, verify=False, stream=True),))[0]
             if r is None:
                 raise Exception("result is None")
-
-            raw_image_data = r.iter_content(chunk_size=max_size)  # read up to max_size
-        except Exception as e:
-            raise Exception("Got fetch_image request error: %s" % e)
-        else:
             if r.status_code != 200:
                 raise Exception("Bad status code returned from fetch_image: '%s'" % (r.status_code))
+            raw_image_data = next(r.iter_content(chunk_size=max_size), b'')  # read up to max_size
+        except Exception as e:
+            raise Exception("Got fetch_image request error: %s" % e)
         finally:
-            if r:
+            if r is not None:
                 r.close()
 
-        # decode image data
+        # decode, validate and clean the image data (off of the gevent hub)
         try:
-            image = Image.open(io.StringIO(raw_image_data))
+            image_format, image_data = _process_image_deduped(raw_image_data, formats, dimensions)
         except Exception as e:
-            raise Exception("Unable to parse image data at: %s" % url)
-        if image.format.lower() not in formats:
-            raise Exception("Image is not a PNG: %s (got %s)" % (url, image.format))
-        if image.size != dimensions:
-            raise Exception("Image size is not 48x48: %s (got %s)" % (url, image.size))
-        if image.mode not in ['RGB', 'RGBA']:
-            raise Exception("Image mode is not RGB/RGBA: %s (got %s)" % (url, image.mode))
+            raise Exception("%s: %s" % (e, url))
         imagePath = make_data_dir(folder)
-        imagePath = os.path.join(imagePath, filename + '.' + image.format.lower())
-        image.save(imagePath)
-        os.system("exiftool -q -overwrite_original -all= %s" % imagePath)  # strip all metadata, just in case
+        imagePath = os.path.join(imagePath, filename + '.' + image_format)
+        image_threadpool.apply(write_image, (imagePath, image_data))
         return True
     except Exception as e:
         logger.warn(e)
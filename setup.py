@@ -42,6 +42,7 @@ required_packages = [
     'flask==0.11.1',
     'json-rpc==1.10.3',
     'pytest==2.9.2',
+    'mongomock==4.3.0',
     'pycoin==0.77',
     #'python-bitcoinlib==0.10.1', <-- restore this when python-bitcoinlib 0.10.x with bech32 support is released
     'pymongo==3.2.2',